@@ -0,0 +1,234 @@
+import sys
+import os
+import re
+import time
+import logging
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+#python file with the shared mapstore bulk loader
+import bulk_loader
+
+#python file with the dependency-aware runner of the SQL steps
+import sql_runner
+
+#python file with the pandas contingency engine
+import contingency_engine
+
+# Schema where the SQL path runs on the synthetic history, so the 'entradas' tables aren't touched
+BENCHMARK_SCHEMA = "benchmark_contingencia"
+
+# Steps of 'tables_processing.sql' reproduced by contingency_engine.py
+CONTINGENCY_STEPS = ["ultimo_resultado", "toxicologia"]
+
+# Tables compared between both paths and the columns that sort their rows
+COMPARED_TABLES = {"mrsat_ultimo_resultado": ["cod_estacion_analisis", "grupo"],
+                   "contingencia_estaciones": contingency_engine.STATION_KEYS,
+                   "contingencia_causal": ["cod_area"]}
+
+
+def synthetic_history(n_rows, grupos_df, limites_df, seed = 0):
+    """Generates a synthetic mrSAT history with the columns used by the contingency.
+
+    Each area is clean, sub-toxic or toxic: its results are a random share of the 'lim_cont', the 'lim_tox' or
+    twice the 'lim_tox' of their group, split among the analyses of the group, so the areas spread over the three
+    'n_accion'. Centros and bancos have disjoint codes, and a share of the results are traces ('T') or below the
+    detection limit ('<'). A share of the records repeat the station, analysis and date of another one with a
+    different result, some have a null result or extraction date, and some bancos have a null centro code.
+
+    Args:
+        n_rows (int): Number of records.
+        grupos_df (pandas.core.frame.DataFrame): 'grupos_toxinas' table.
+        limites_df (pandas.core.frame.DataFrame): 'limites_toxicologicos' table.
+        seed (int): Seed of the random generator.
+
+    Returns:
+        pandas.core.frame.DataFrame
+    """
+
+    rng = np.random.default_rng(seed)
+    n_areas = max(n_rows // 500, 10)
+
+    areas = rng.integers(1, n_areas + 1, n_rows)
+    is_centro = rng.random(n_rows) < 0.7
+    analisis_idx = rng.integers(0, len(grupos_df), n_rows)
+    hours = rng.integers(0, 60 * 24, n_rows)
+
+    # Ceiling of each analysis result, so the sum of the group stays under it
+    limites = grupos_df.merge(limites_df, on = "grupo", how = "left")
+    n_analisis = limites.groupby("grupo")["analisis"].transform("count").to_numpy()
+    ceilings = np.stack([limites["lim_cont"], limites["lim_tox"], 2 * limites["lim_tox"]], axis = 1) / n_analisis[:, None]
+    area_risk = rng.choice(3, n_areas + 1, p = [0.5, 0.3, 0.2])
+
+    # Few distinct shares, so stations tie on their results. They are rounded to multiples of 2^-20, whose sums are
+    # exact in any order, so the summation order of each path doesn't break a tie or cross a limit
+    shares = rng.integers(0, 11, n_rows) / 10
+    resultado = np.round(shares * ceilings[analisis_idx, area_risk[areas]] * 2 ** 20) / 2 ** 20
+
+    # Traces are valued at the 'lim_cont', so they are left out of the clean areas
+    signo = rng.choice(np.array([None, "<", "T"], dtype = object), n_rows, p = [0.8, 0.1, 0.1])
+    signo[(signo == "T") & (area_risk[areas] == 0)] = None
+
+    mrsat_df = pd.DataFrame({
+        "CodigoCentro": np.where(is_centro, areas * 100 + rng.integers(0, 20, n_rows), 0).astype(float),
+        "CodigoBancoNatural": np.where(is_centro, 0, 1000000 + areas * 10 + rng.integers(0, 5, n_rows)),
+        "EstacionMonitoreo": "E" + pd.Series(rng.integers(1, 4, n_rows)).astype(str),
+        "DescripcionAnalisis": grupos_df["analisis"].to_numpy()[analisis_idx],
+        "FechaExtraccion": pd.Timestamp("2026-01-01") - pd.to_timedelta(hours, unit = "h"),
+        "Resultado": resultado,
+        "Signo": signo,
+        "Estado": rng.choice(np.array(["INFORMADO", "PENDIENTE"], dtype = object), n_rows, p = [0.95, 0.05]),
+        "CodigoArea": areas,
+        "DescripcionArea": "Area " + pd.Series(areas).astype(str)})
+
+    # Records of the same station, analysis and date with another result
+    repeated = mrsat_df.sample(frac = 0.02, random_state = seed)
+    repeated["Resultado"] = np.round(repeated["Resultado"] * rng.uniform(0.5, 1.5, len(repeated)) * 2 ** 20) / 2 ** 20
+    mrsat_df = pd.concat([mrsat_df, repeated], ignore_index = True)
+
+    for column in ["Resultado", "FechaExtraccion"]:
+        mrsat_df.loc[rng.random(len(mrsat_df)) < 0.01, column] = None
+
+    # A null centro code is set on every record of a banco, as a banco mixing null and 0 codes has no single latest row
+    bancos = mrsat_df.loc[mrsat_df["CodigoCentro"] == 0, "CodigoBancoNatural"].unique()
+    bancos_sin_centro = rng.choice(bancos, len(bancos) // 10, replace = False)
+    mrsat_df.loc[mrsat_df["CodigoBancoNatural"].isin(bancos_sin_centro), "CodigoCentro"] = None
+
+    return mrsat_df
+
+def to_benchmark_steps(steps):
+    """Redirects the contingency steps of 'tables_processing.sql' from the 'entradas' schema to the benchmark schema.
+
+    Args:
+        steps (list): sql_runner.SqlStep of the file, in order.
+
+    Returns:
+        list: rewritten sql_runner.SqlStep.
+    """
+
+    return [step._replace(sql = re.sub(r"\bentradas\.", BENCHMARK_SCHEMA + ".", step.sql))
+            for step in steps if step.name in CONTINGENCY_STEPS]
+
+def run_sql_path(db_engine, mrsat_df, grupos_df, limites_df, logger):
+    """Loads the synthetic history to the benchmark schema and runs the contingency steps of 'tables_processing.sql'.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        mrsat_df (pandas.core.frame.DataFrame): Synthetic mrSAT history.
+        grupos_df (pandas.core.frame.DataFrame): 'grupos_toxinas' table.
+        limites_df (pandas.core.frame.DataFrame): 'limites_toxicologicos' table.
+
+    Returns:
+        tuple: (dict, float) table name -> pandas.core.frame.DataFrame and seconds elapsed on the steps.
+    """
+
+    with db_engine.begin() as con:
+        con.execute(text("DROP SCHEMA IF EXISTS " + BENCHMARK_SCHEMA + " CASCADE"))
+        con.execute(text("CREATE SCHEMA " + BENCHMARK_SCHEMA))
+
+    bulk_loader.copy_df_to_db(mrsat_df, db_engine, "mrsat_60days", BENCHMARK_SCHEMA, logger)
+    bulk_loader.copy_df_to_db(grupos_df, db_engine, "grupos_toxinas", BENCHMARK_SCHEMA, logger)
+    bulk_loader.copy_df_to_db(limites_df, db_engine, "limites_toxicologicos", BENCHMARK_SCHEMA, logger)
+
+    with open("./sql_queries/tables_processing.sql", encoding = "utf8") as file:
+        steps = to_benchmark_steps(sql_runner.parse_steps(file.read()))
+
+    start = time.perf_counter()
+    sql_runner.run_steps(db_engine, steps, logger, settings = {"etl.contingency_mode": "full"})
+    elapsed = time.perf_counter() - start
+
+    tables = {table_name: pd.read_sql("SELECT * FROM " + BENCHMARK_SCHEMA + "." + table_name, db_engine)
+              for table_name in COMPARED_TABLES}
+
+    with db_engine.begin() as con:
+        con.execute(text("DROP SCHEMA " + BENCHMARK_SCHEMA + " CASCADE"))
+
+    return tables, elapsed
+
+def normalize_table(df, sort_columns):
+    """Sorts a table and casts its columns to comparable types.
+
+    Args:
+        df (pandas.core.frame.DataFrame): Table of one of the paths.
+        sort_columns (list): Columns that identify a row.
+
+    Returns:
+        pandas.core.frame.DataFrame
+    """
+
+    df = df.copy()
+    for column in df.columns:
+        if column.startswith("fecha"):
+            df[column] = pd.to_datetime(df[column])
+        elif pd.api.types.is_numeric_dtype(df[column]):
+            df[column] = df[column].astype(float)
+
+    return df.sort_values(sort_columns).reset_index(drop = True)
+
+def compare_tables(engine_tables, sql_tables):
+    """Checks that both paths give the same tables, with a relative tolerance on the summed results.
+
+    Args:
+        engine_tables (dict): table name -> pandas.core.frame.DataFrame of contingency_engine.py.
+        sql_tables (dict): table name -> pandas.core.frame.DataFrame of 'tables_processing.sql'.
+
+    Returns:
+        list: names of the tables that differ.
+    """
+
+    different = []
+    for table_name, sort_columns in COMPARED_TABLES.items():
+        sql_df = sql_tables[table_name]
+        engine_df = normalize_table(engine_tables[table_name][sql_df.columns], sort_columns)
+        sql_df = normalize_table(sql_df, sort_columns)
+
+        try:
+            pd.testing.assert_frame_equal(engine_df, sql_df, check_dtype = False, check_exact = False, rtol = 1e-9)
+        except AssertionError as e:
+            print("[ERROR] - " + table_name + " differs between both paths")
+            print(e)
+            different.append(table_name)
+
+    return different
+
+def main(argv):
+    # Usage: python3 benchmark_contingency.py config.json [n_rows ...]
+    if len(argv) < 2:
+        sys.exit("[ERROR] - Usage: python3 benchmark_contingency.py <config.json> [n_rows ...]")
+
+    config = sql_runner.get_config(argv[1])
+    if not os.path.exists(config["log_path"]):
+        os.makedirs(config["log_path"])
+    logging.basicConfig(filename = config["log_path"] + "/benchmark_contingency.log",
+                        format = '%(asctime)s %(message)s',
+                        filemode = 'a',
+                        level = logging.DEBUG)
+    logger = logging.getLogger()
+
+    mapstore_engine = sql_runner.create_mapstore_engine(config)
+    grupos_df, limites_df = contingency_engine.read_toxin_tables()
+    sizes = [int(n_rows) for n_rows in argv[2:]] or [1000000, 2000000, 5000000]
+    failed = False
+
+    for n_rows in sizes:
+        mrsat_df = synthetic_history(n_rows, grupos_df, limites_df)
+
+        start = time.perf_counter()
+        engine_tables = contingency_engine.compute_contingency(mrsat_df, grupos_df, limites_df, logger)
+        engine_elapsed = time.perf_counter() - start
+
+        sql_tables, sql_elapsed = run_sql_path(mapstore_engine, mrsat_df, grupos_df, limites_df, logger)
+        different = compare_tables(engine_tables, sql_tables)
+        failed = failed or bool(different)
+
+        print(f"{n_rows} rows: pandas {engine_elapsed:.2f} s ({n_rows / engine_elapsed:,.0f} rows/s), "
+              f"SQL {sql_elapsed:.2f} s ({n_rows / sql_elapsed:,.0f} rows/s), "
+              f"outputs {'differ' if different else 'identical'}")
+        logger.debug(f"[OK] - BENCHMARK {n_rows} ROWS PANDAS {engine_elapsed:.2f} S SQL {sql_elapsed:.2f} S")
+
+    if failed:
+        sys.exit(2)
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,384 @@
+import io
+import queue
+import threading
+import time
+import pandas as pd
+from pandas.api import types as ptypes
+from sqlalchemy import inspect
+from sqlalchemy import types as sqltypes
+
+# Rows written to the COPY buffer on each round trip
+COPY_CHUNK_SIZE = 50000
+
+
+def use_copy(config_data, table_name):
+    """Checks if a table is loaded with COPY according to the 'copy_tables' key of the mapstore config.
+
+    Args:
+        config_data (dict): config.json parameters.
+        table_name (str): Name of the output table on the mapstore's database.
+
+    Returns:
+        bool.
+    """
+
+    copy_tables = config_data['mapstore'].get('copy_tables', [])
+    return copy_tables == '*' or table_name in copy_tables
+
+def column_types(df, db_engine, dtype):
+    """Gets the PostgreSQL type of each DataFrame column, using the same mapping as DataFrame.to_sql.
+
+    Args:
+        df (pandas.core.frame.DataFrame): DataFrame to load.
+        db_engine (sqlalchemy.engine.base.Engine): Database sqlalchemy engine.
+        dtype (dict): column name -> sqlalchemy type or DDL string, overriding the inferred type.
+
+    Returns:
+        dict: column name -> DDL type.
+    """
+
+    types = {}
+
+    for column, series in df.items():
+        if column in dtype:
+            col_type = dtype[column]
+            types[column] = col_type if isinstance(col_type, str) else col_type.compile(dialect = db_engine.dialect)
+        elif ptypes.is_bool_dtype(series):
+            types[column] = 'BOOLEAN'
+        elif ptypes.is_integer_dtype(series):
+            types[column] = 'BIGINT'
+        elif ptypes.is_float_dtype(series):
+            types[column] = 'DOUBLE PRECISION'
+        elif isinstance(series.dtype, pd.DatetimeTZDtype):
+            types[column] = 'TIMESTAMP WITH TIME ZONE'
+        elif ptypes.is_datetime64_any_dtype(series):
+            types[column] = 'TIMESTAMP WITHOUT TIME ZONE'
+        else:
+            types[column] = 'TEXT'
+
+    return types
+
+def reflect_column_types(connection, table_name, schema):
+    """Gets the PostgreSQL type of each column of a table from the metadata of its database.
+
+    Unlike column_types(), the types don't depend on the values of a sample of rows, so a
+    column that is null or has no nulls on the first rows still gets the type of its source.
+
+    Args:
+        connection (sqlalchemy.engine.Connection.connect): SQLAlchemy connection of the table's database.
+        table_name (str): Name of the table.
+        schema (str): Schema of the table.
+
+    Returns:
+        dict: column name -> DDL type, in the order of the table.
+    """
+
+    types = {}
+
+    for column in inspect(connection).get_columns(table_name, schema = schema):
+        col_type = column['type']
+        if isinstance(col_type, sqltypes.Boolean):
+            types[column['name']] = 'BOOLEAN'
+        elif isinstance(col_type, sqltypes.Integer):
+            types[column['name']] = 'BIGINT'
+        elif isinstance(col_type, sqltypes.Numeric):
+            types[column['name']] = 'DOUBLE PRECISION'
+        elif isinstance(col_type, sqltypes.DateTime):
+            types[column['name']] = 'TIMESTAMP WITH TIME ZONE' if getattr(col_type, 'timezone', False) else 'TIMESTAMP WITHOUT TIME ZONE'
+        elif isinstance(col_type, sqltypes.Date):
+            types[column['name']] = 'DATE'
+        else:
+            types[column['name']] = 'TEXT'
+
+    return types
+
+def match_column_types(df, types):
+    """Casts the DataFrame columns that pandas read with another type than the one of the table.
+
+    An integer or boolean column with nulls is read as float, and its values would be
+    written as '12.0', which COPY rejects on a BIGINT or BOOLEAN column.
+
+    Args:
+        df (pandas.core.frame.DataFrame): DataFrame to load.
+        types (dict): column name -> DDL type of the table.
+
+    Returns:
+        pandas.core.frame.DataFrame
+    """
+
+    casts = {}
+
+    for column, series in df.items():
+        if types.get(column) == 'BIGINT' and not ptypes.is_integer_dtype(series):
+            casts[column] = 'Int64'
+        elif types.get(column) == 'BOOLEAN' and not ptypes.is_bool_dtype(series):
+            casts[column] = 'boolean'
+
+    return df.astype(casts) if casts else df
+
+def copy_rows(cursor, df, table, columns, chunk_size = COPY_CHUNK_SIZE):
+    """Streams the DataFrame rows to an existing table through COPY FROM STDIN in chunked CSV buffers.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): Cursor of the raw DBAPI connection.
+        df (pandas.core.frame.DataFrame): DataFrame to load.
+        table (str): Quoted name of the output table.
+        columns (str): Quoted and comma separated DataFrame columns.
+        chunk_size (int): Rows written to the COPY buffer on each round trip.
+    """
+
+    for chunk_start in range(0, len(df), chunk_size):
+        buffer = io.StringIO()
+        df.iloc[chunk_start:chunk_start + chunk_size].to_csv(buffer, index = False, header = False, na_rep = '\\N')
+        buffer.seek(0)
+        cursor.copy_expert('COPY ' + table + ' (' + columns + ") FROM STDIN WITH (FORMAT csv, NULL '\\N')", buffer)
+
+def copy_df_to_db(df, db_engine, table_name, schema, logger, if_exists = 'replace', dtype = None, chunk_size = COPY_CHUNK_SIZE):
+    """Loads a DataFrame to a PostgreSQL table streaming CSV buffers through COPY FROM STDIN.
+
+    The table is created with typed columns and every chunk is copied on the same
+    transaction, so readers never see a half loaded table. When appending to an existing
+    table the DataFrame is cast to the types of the table, not to the ones of its values.
+
+    Args:
+        df (pandas.core.frame.DataFrame): DataFrame to load.
+        db_engine (sqlalchemy.engine.base.Engine): Database sqlalchemy engine.
+        table_name (str): Name of the output table.
+        schema (str): Schema of the output table.
+        if_exists (str): 'replace' to recreate the table or 'append' to add the rows to it.
+        dtype (dict): column name -> sqlalchemy type or DDL string, overriding the inferred type.
+        chunk_size (int): Rows written to the COPY buffer on each round trip.
+    """
+
+    start = time.perf_counter()
+    quote = db_engine.dialect.identifier_preparer.quote
+    table = quote(schema) + '.' + quote(table_name)
+    types = column_types(df, db_engine, dtype or {})
+    columns = ', '.join(quote(column) for column in df.columns)
+    ddl = ', '.join(quote(column) + ' ' + col_type for column, col_type in types.items())
+
+    # An integer column with nulls only on this DataFrame is read as float, e.g. on a later page of a layer
+    if if_exists == 'append' and inspect(db_engine).has_table(table_name, schema = schema):
+        with db_engine.connect() as con:
+            df = match_column_types(df, reflect_column_types(con, table_name, schema))
+
+    raw_con = db_engine.raw_connection()
+    try:
+        with raw_con.cursor() as cursor:
+            if if_exists == 'replace':
+                cursor.execute('DROP TABLE IF EXISTS ' + table)
+            cursor.execute('CREATE TABLE IF NOT EXISTS ' + table + ' (' + ddl + ')')
+            copy_rows(cursor, df, table, columns, chunk_size)
+
+        raw_con.commit()
+    except Exception:
+        raw_con.rollback()
+        raise
+    finally:
+        raw_con.close()
+
+    elapsed = time.perf_counter() - start
+    rows_sec = len(df) / elapsed if elapsed > 0 else float(len(df))
+    print(f"[OK] - {len(df)} rows copied to {schema}.{table_name} in {elapsed:.2f} s ({rows_sec:.0f} rows/s)")
+    logger.debug(f"[OK] - {table_name.upper()} COPY_DF_TO_DB {len(df)} ROWS {rows_sec:.0f} ROWS/S")
+
+def read_chunks(source_connection, query, chunk_size, chunks):
+    """Reads the query results in chunks with a streaming cursor and puts them on the queue.
+
+    The queue receives None when the results are exhausted, or the raised exception.
+
+    Args:
+        source_connection (sqlalchemy.engine.Connection.connect): Source SQLAlchemy connection.
+        query (sqlalchemy.sql.Select): Query to stream.
+        chunk_size (int): Rows fetched on each round trip.
+        chunks (queue.Queue): Bounded queue shared with the writer.
+    """
+
+    try:
+        streaming_connection = source_connection.execution_options(stream_results = True)
+        for chunk in pd.read_sql(query, streaming_connection, chunksize = chunk_size):
+            chunks.put(chunk)
+        chunks.put(None)
+    except Exception as e:
+        chunks.put(e)
+
+def stream_query_to_db(source_connection, query, db_engine, table_name, schema, logger, chunk_size = COPY_CHUNK_SIZE, types = None):
+    """Streams the results of a query on another database to a PostgreSQL table with COPY.
+
+    A reader thread fetches the next chunk while the current one is being copied, and at
+    most two chunks wait on the queue, so memory stays flat regardless of the number of
+    transferred rows. The table is replaced on a single transaction, even when the query
+    returns no rows. Its column types are the given ones, or else the ones inferred from the
+    first chunk, and every chunk is cast to them before being copied.
+
+    Args:
+        source_connection (sqlalchemy.engine.Connection.connect): Source SQLAlchemy connection.
+        query (sqlalchemy.sql.Select): Query to stream.
+        db_engine (sqlalchemy.engine.base.Engine): Destination database sqlalchemy engine.
+        table_name (str): Name of the output table.
+        schema (str): Schema of the output table.
+        chunk_size (int): Rows fetched and copied on each round trip.
+        types (dict): column name -> DDL type of the output table, e.g. from reflect_column_types().
+
+    Returns:
+        int: number of transferred rows.
+    """
+
+    start = time.perf_counter()
+    quote = db_engine.dialect.identifier_preparer.quote
+    table = quote(schema) + '.' + quote(table_name)
+    chunks = queue.Queue(maxsize = 2)
+    reader = threading.Thread(target = read_chunks, args = (source_connection, query, chunk_size, chunks), daemon = True)
+    reader.start()
+    n_rows = 0
+    created = False
+
+    raw_con = db_engine.raw_connection()
+    try:
+        with raw_con.cursor() as cursor:
+            while True:
+                chunk = chunks.get()
+                if chunk is None:
+                    break
+                if isinstance(chunk, Exception):
+                    raise chunk
+
+                if not created:
+                    types = types or column_types(chunk, db_engine, {})
+                    create_table(cursor, table, types, quote)
+                    created = True
+
+                columns = ', '.join(quote(column) for column in chunk.columns)
+                copy_rows(cursor, match_column_types(chunk, types), table, columns, chunk_size)
+                n_rows += len(chunk)
+
+            # The query returned no chunk, the table is still replaced by an empty one
+            if not created:
+                if types is None:
+                    raise ValueError("The query returned no rows and the types of " + table + " are unknown")
+                create_table(cursor, table, types, quote)
+
+        raw_con.commit()
+    except Exception:
+        raw_con.rollback()
+        raise
+    finally:
+        raw_con.close()
+
+    elapsed = time.perf_counter() - start
+    rows_sec = n_rows / elapsed if elapsed > 0 else float(n_rows)
+    print(f"[OK] - {n_rows} rows streamed to {schema}.{table_name} in {elapsed:.2f} s ({rows_sec:.0f} rows/s)")
+    logger.debug(f"[OK] - {table_name.upper()} STREAM_QUERY_TO_DB {n_rows} ROWS {rows_sec:.0f} ROWS/S")
+    return n_rows
+
+def create_table(cursor, table, types, quote):
+    """Drops a table and creates it again with the given column types.
+
+    Args:
+        cursor (psycopg2.extensions.cursor): Cursor of the raw DBAPI connection.
+        table (str): Quoted name of the table.
+        types (dict): column name -> DDL type.
+        quote (function): Identifier quoting function of the dialect.
+    """
+
+    cursor.execute('DROP TABLE IF EXISTS ' + table)
+    cursor.execute('CREATE TABLE ' + table + ' (' + ', '.join(quote(column) + ' ' + col_type for column, col_type in types.items()) + ')')
+
+def upsert_df(df, db_engine, table_name, schema, key_columns, logger, prune_column = None, prune_since = None,
+              tie_order = None, replace = False):
+    """Upserts a DataFrame into a PostgreSQL table with INSERT ... ON CONFLICT on the key columns.
+
+    The rows are copied to a temporary staging table and merged in a single transaction.
+    The table and the unique index on the key columns are created when missing. When
+    'prune_column' and 'prune_since' are given, the rows of the table with
+    prune_column >= prune_since that are not present in the DataFrame are deleted,
+    so the refreshed range mirrors the source. Rows that share the key columns are
+    collapsed to the first one by 'tie_order', and their number is logged.
+
+    Args:
+        df (pandas.core.frame.DataFrame): DataFrame with the new or changed rows.
+        db_engine (sqlalchemy.engine.base.Engine): Database sqlalchemy engine.
+        table_name (str): Name of the output table.
+        schema (str): Schema of the output table.
+        key_columns (list): Columns that identify a row. They must not contain nulls.
+        prune_column (str): Optional column of the refreshed range.
+        prune_since (datetime.datetime): Optional start of the refreshed range.
+        tie_order (list): SQL order expressions that pick the kept row among the ones with the same key.
+        replace (bool): Drop the table and create it again on the same transaction, instead of merging.
+
+    Returns:
+        int: number of upserted rows.
+    """
+
+    start = time.perf_counter()
+    quote = db_engine.dialect.identifier_preparer.quote
+    table = quote(schema) + '.' + quote(table_name)
+    types = column_types(df, db_engine, {})
+    columns = ', '.join(quote(column) for column in df.columns)
+    keys = ', '.join(quote(column) for column in key_columns)
+    ddl = ', '.join(quote(column) + ' ' + col_type for column, col_type in types.items())
+    updates = ', '.join(quote(column) + ' = EXCLUDED.' + quote(column) for column in df.columns if column not in key_columns)
+    key_match = ' AND '.join('t.' + quote(column) + ' = s.' + quote(column) for column in key_columns)
+    order = ', '.join([keys] + (tie_order or []))
+
+    raw_con = db_engine.raw_connection()
+    try:
+        with raw_con.cursor() as cursor:
+            if replace:
+                cursor.execute('DROP TABLE IF EXISTS ' + table)
+            cursor.execute('CREATE TABLE IF NOT EXISTS ' + table + ' (' + ddl + ')')
+            cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS ' + quote(table_name + '_key_idx') + ' ON ' + table + ' (' + keys + ')')
+            cursor.execute('CREATE TEMP TABLE upsert_stage (LIKE ' + table + ') ON COMMIT DROP')
+            copy_rows(cursor, df, 'upsert_stage', columns)
+
+            cursor.execute('SELECT (SELECT count(*) FROM upsert_stage) - '
+                           '(SELECT count(*) FROM (SELECT DISTINCT ' + keys + ' FROM upsert_stage) AS stage_keys)')
+            n_collapsed = cursor.fetchone()[0]
+
+            if prune_column is not None:
+                cursor.execute('DELETE FROM ' + table + ' AS t WHERE t.' + quote(prune_column) + ' >= %s '
+                               'AND NOT EXISTS (SELECT 1 FROM upsert_stage AS s WHERE ' + key_match + ')', (prune_since,))
+
+            cursor.execute('INSERT INTO ' + table + ' (' + columns + ') '
+                           'SELECT DISTINCT ON (' + keys + ') ' + columns + ' FROM upsert_stage ORDER BY ' + order + ' '
+                           'ON CONFLICT (' + keys + ') ' + ('DO UPDATE SET ' + updates if updates else 'DO NOTHING'))
+            n_rows = cursor.rowcount
+
+        raw_con.commit()
+    except Exception:
+        raw_con.rollback()
+        raise
+    finally:
+        raw_con.close()
+
+    elapsed = time.perf_counter() - start
+    if n_collapsed:
+        print(f"[OK] - {n_collapsed} rows with a repeated key collapsed into {schema}.{table_name}")
+        logger.debug(f"[OK] - {table_name.upper()} UPSERT_DF {n_collapsed} REPEATED KEY ROWS COLLAPSED")
+    print(f"[OK] - {n_rows} rows upserted into {schema}.{table_name} in {elapsed:.2f} s")
+    logger.debug(f"[OK] - {table_name.upper()} UPSERT_DF {n_rows} ROWS")
+    return n_rows
+
+def load_df(df, config_data, db_engine, table_name, schema, logger, if_exists = 'replace', dtype = None):
+    """Loads a DataFrame to the mapstore database with COPY or DataFrame.to_sql, as configured for the table.
+
+    Args:
+        df (pandas.core.frame.DataFrame): DataFrame to load.
+        config_data (dict): config.json parameters.
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        table_name (str): Name of the output table.
+        schema (str): Schema of the output table.
+        if_exists (str): 'replace' to recreate the table or 'append' to add the rows to it.
+        dtype (dict): column name -> sqlalchemy type, overriding the inferred type.
+    """
+
+    if use_copy(config_data, table_name):
+        copy_df_to_db(df, db_engine, table_name, schema, logger, if_exists = if_exists, dtype = dtype)
+
+    else:
+        df.to_sql(table_name,
+                  db_engine,
+                  if_exists = if_exists,
+                  schema = schema,
+                  index = False,
+                  dtype = dtype)
@@ -0,0 +1,315 @@
+import sys
+import os
+import time
+import logging
+import numpy as np
+import pandas as pd
+
+#python file with the shared mapstore bulk loader
+import bulk_loader
+
+#python file with the dependency-aware runner of the SQL steps
+import sql_runner
+
+# Toxin groups of the 'res_<grupo>' and 'fecha_<grupo>' columns of the stations, as named by 'tables_processing.sql'
+PIVOT_GROUPS = [("VPM", "res_vpm", "fecha_vpm"),
+                ("VAM", "res_vam", "fecha_vam"),
+                ("YTX", "res_ytx", "fecha_ytx"),
+                ("PTX_AO", "res_ptx_ao", "fecha_ptxao"),
+                ("DTX", "res_dtx", "fecha_dtx"),
+                ("AZA", "res_aza", "fecha_aza")]
+
+# Groups whose traces ('T') are valued at their 'lim_cont'
+TRACE_GROUPS = ["DTX", "AZA"]
+
+TOX_EST_KEYS = ["cod_estacion", "cod_estacion_grupo", "estacion", "grupo", "cod_area", "n_area",
+                "cod_centro", "tipo", "nm_toxina", "lim_cont", "lim_tox"]
+STATION_KEYS = ["cod_estacion", "estacion", "cod_area", "cod_centro"]
+CAUSAL_COLUMNS = ["cod_area", "grupo", "nm_toxina", "cod_centro", "lim_cont", "lim_tox", "resultado", "dif_tox", "causal"]
+
+
+def read_toxin_tables(entradas_path = "./entradas"):
+    """Reads the 'grupos_toxinas.csv' and 'limites_toxicologicos.csv' files of the entradas folder.
+
+    Args:
+        entradas_path (str): Path of the entradas folder.
+
+    Returns:
+        tuple: (pandas.core.frame.DataFrame, pandas.core.frame.DataFrame) toxin groups and limits.
+    """
+
+    grupos_df = pd.read_csv(entradas_path + "/grupos_toxinas.csv", sep = ";", encoding = "utf-8-sig", na_values = "NA")
+    limites_df = pd.read_csv(entradas_path + "/limites_toxicologicos.csv", sep = ";", encoding = "utf-8-sig", na_values = "NA")
+    return grupos_df, limites_df
+
+def code_to_str(series):
+    """Casts a code column to text as Postgres does on a concatenation: integral floats without decimals.
+
+    Args:
+        series (pandas.core.series.Series): Code column.
+
+    Returns:
+        pandas.core.series.Series: object column, with NaN for nulls.
+    """
+
+    if pd.api.types.is_numeric_dtype(series):
+        values = series.astype("Int64").astype(str)
+    else:
+        values = series.astype(str)
+    return values.where(series.notna())
+
+def concat_codes(*columns):
+    """Concatenates text columns with '-', with a null result if any of them is null, like the '||' operator.
+
+    Args:
+        columns (pandas.core.series.Series): Text columns.
+
+    Returns:
+        pandas.core.series.Series
+    """
+
+    result = columns[0]
+    for column in columns[1:]:
+        result = result + "-" + column
+    return result
+
+def latest_results(mrsat_df, grupos_df, limites_df):
+    """Gets the latest informed result of each analysis in each station, as the 'ultimo_resultado' step.
+
+    The 'Resultado' is normalized with the 'Signo' rules and the limits of its group are added.
+    When a station has more than one result of an analysis on its latest date, the highest one is kept.
+
+    Args:
+        mrsat_df (pandas.core.frame.DataFrame): mrSAT records, as the 'mrsat_60days' table.
+        grupos_df (pandas.core.frame.DataFrame): 'grupos_toxinas' table.
+        limites_df (pandas.core.frame.DataFrame): 'limites_toxicologicos' table.
+
+    Returns:
+        pandas.core.frame.DataFrame
+    """
+
+    informed = mrsat_df[mrsat_df["Estado"] == "INFORMADO"]
+    tox = informed.merge(grupos_df[["analisis", "grupo"]], left_on = "DescripcionAnalisis", right_on = "analisis")
+    tox = tox.merge(limites_df[["grupo", "tipo", "nm_toxina", "lim_cont", "lim_tox"]], on = "grupo", how = "left")
+
+    signo = tox["Signo"]
+    trace_group = tox["grupo"].isin(TRACE_GROUPS)
+    tox["resultado_toxina"] = np.select([(signo == "T") & trace_group, signo == "<", (signo == "T") & ~trace_group],
+                                        [tox["lim_cont"], 0, 0],
+                                        tox["Resultado"].astype(float))
+
+    # Stations of a centro are identified by its code and the ones of a banco by the banco code
+    is_centro = tox["CodigoCentro"].notna() & (tox["CodigoCentro"] != 0)
+    tox["owner"] = tox["CodigoCentro"].where(is_centro, tox["CodigoBancoNatural"])
+
+    # The latest result is selected before the identifiers are concatenated, on the fewer remaining rows.
+    # As 'fechaext DESC' in Postgres, a null date sorts before every date, while a null result sorts last
+    station_keys = ["owner", "EstacionMonitoreo", "DescripcionAnalisis", "grupo"]
+    tox["fecha_nula"] = tox["FechaExtraccion"].isna()
+    tox = tox.sort_values(station_keys + ["fecha_nula", "FechaExtraccion", "resultado_toxina"],
+                          ascending = [True] * len(station_keys) + [False, False, False], na_position = "last", kind = "stable")
+    tox = tox.drop_duplicates(station_keys).reset_index(drop = True)
+
+    owner = code_to_str(tox["owner"])
+    station = code_to_str(tox["EstacionMonitoreo"])
+
+    return pd.DataFrame({
+        "fechaext": tox["FechaExtraccion"],
+        "cod_estacion": concat_codes(owner, station),
+        "cod_estacion_grupo": concat_codes(owner, station, tox["grupo"]),
+        "cod_estacion_analisis": concat_codes(owner, station, tox["DescripcionAnalisis"]),
+        "estacion": tox["EstacionMonitoreo"],
+        "grupo": tox["grupo"],
+        "analisis": tox["DescripcionAnalisis"],
+        "cod_area": tox["CodigoArea"],
+        "n_area": tox["DescripcionArea"],
+        "cod_centro": tox["CodigoCentro"],
+        "tipo": tox["tipo"],
+        "nm_toxina": tox["nm_toxina"],
+        "lim_cont": tox["lim_cont"],
+        "lim_tox": tox["lim_tox"],
+        "resultado_toxina": tox["resultado_toxina"]})
+
+def station_groups(ult_tox):
+    """Sums the results of each toxin group in each station and gets its 'n_accion' and 'dif_tox', as the 'tox_est' table.
+
+    Args:
+        ult_tox (pandas.core.frame.DataFrame): Latest results, as returned by latest_results().
+
+    Returns:
+        pandas.core.frame.DataFrame
+    """
+
+    grouped = ult_tox.groupby(TOX_EST_KEYS, dropna = False, sort = False)
+    tox_est = grouped["fechaext"].max().to_frame()
+    tox_est["resultado"] = grouped["resultado_toxina"].sum(min_count = 1)
+    tox_est = tox_est.reset_index()
+
+    resultado, lim_cont, lim_tox = tox_est["resultado"], tox_est["lim_cont"], tox_est["lim_tox"]
+    tox_est["n_accion"] = np.select([resultado > lim_tox, (resultado > lim_cont) & (resultado < lim_tox)], [3, 2], 1)
+    tox_est["dif_tox"] = resultado - lim_tox
+    return tox_est
+
+def area_causal(tox_est):
+    """Gets the causal toxin of each area in contingency: the station-group with the highest 'dif_tox', as the 'causal_area' table.
+
+    Args:
+        tox_est (pandas.core.frame.DataFrame): Station-group results, as returned by station_groups().
+
+    Returns:
+        pandas.core.frame.DataFrame
+    """
+
+    max_tox = tox_est[tox_est["n_accion"] > 1].sort_values(["cod_area", "dif_tox", "cod_estacion_grupo"],
+                                                             ascending = [True, False, True], kind = "stable")
+    max_tox = max_tox.drop_duplicates("cod_area").reset_index(drop = True)
+
+    dif_tox = max_tox["dif_tox"]
+    in_contingency = (dif_tox > 0) | ((dif_tox < 0) & (max_tox["resultado"] > max_tox["lim_cont"]))
+    max_tox["causal"] = max_tox["nm_toxina"].where(in_contingency, " ")
+    return max_tox[CAUSAL_COLUMNS]
+
+def station_pivot(tox_est):
+    """Gets the result and date of each toxin group in each station and its highest 'n_accion', as the 'pivot_est' table.
+
+    Args:
+        tox_est (pandas.core.frame.DataFrame): Station-group results, as returned by station_groups().
+
+    Returns:
+        pandas.core.frame.DataFrame
+    """
+
+    pivot = tox_est[STATION_KEYS + ["n_accion"]].copy()
+    for grupo, res_column, fecha_column in PIVOT_GROUPS:
+        is_group = tox_est["grupo"] == grupo
+        pivot[res_column] = tox_est["resultado"].where(is_group, 0)
+        pivot[fecha_column] = tox_est["fechaext"].where(is_group)
+
+    grouped = pivot.groupby(STATION_KEYS, dropna = False, sort = False)
+    pivot_est = pd.concat([grouped[[res_column for _, res_column, _ in PIVOT_GROUPS]].sum(min_count = 1),
+                           grouped[[fecha_column for _, _, fecha_column in PIVOT_GROUPS]].max(),
+                           grouped["n_accion"].max()], axis = 1)
+
+    columns = [column for _, res_column, fecha_column in PIVOT_GROUPS for column in (res_column, fecha_column)]
+    return pivot_est[columns + ["n_accion"]].reset_index()
+
+def area_contingency(pivot_est, causal_area):
+    """Gets the highest result of each toxin group in each area, its 'n_accion', causal and messages, as the contingency layers.
+
+    Args:
+        pivot_est (pandas.core.frame.DataFrame): Station results, as returned by station_pivot().
+        causal_area (pandas.core.frame.DataFrame): Causal of each area, as returned by area_causal().
+
+    Returns:
+        pandas.core.frame.DataFrame
+    """
+
+    areas = pivot_est.merge(causal_area[["cod_area", "causal"]], on = "cod_area", how = "left")
+    columns = [column for _, res_column, fecha_column in PIVOT_GROUPS for column in (res_column, fecha_column)]
+
+    areas = areas.groupby(["cod_area", "causal"], dropna = False, sort = False)[columns + ["n_accion"]].max().reset_index()
+    for _, _, fecha_column in PIVOT_GROUPS:
+        areas[fecha_column] = pd.to_datetime(areas[fecha_column]).dt.normalize()
+
+    n_accion = areas["n_accion"]
+    areas["accion"] = np.select([n_accion == 3, n_accion == 2], ["valores tóxicos", "valores subtóxicos"], "sin presencia de toxinas")
+    areas["msje"] = np.where(n_accion > 1, "registra presencia de", "se encuentra")
+    areas["pre_causal"] = np.where(n_accion > 1, "de", "")
+    return areas
+
+def compute_contingency(mrsat_df, grupos_df, limites_df, logger):
+    """Computes the toxicological contingency of a mrSAT DataFrame with the rules of 'tables_processing.sql'.
+
+    Args:
+        mrsat_df (pandas.core.frame.DataFrame): mrSAT records, as the 'mrsat_60days' table.
+        grupos_df (pandas.core.frame.DataFrame): 'grupos_toxinas' table.
+        limites_df (pandas.core.frame.DataFrame): 'limites_toxicologicos' table.
+
+    Returns:
+        dict: table name -> pandas.core.frame.DataFrame, with the 'mrsat_ultimo_resultado',
+            'contingencia_estaciones', 'contingencia_causal' and 'areas_contingencia' tables.
+    """
+
+    start = time.perf_counter()
+
+    ult_tox = latest_results(mrsat_df, grupos_df, limites_df)
+    tox_est = station_groups(ult_tox)
+    causal_area = area_causal(tox_est)
+    pivot_est = station_pivot(tox_est)
+
+    tables = {"mrsat_ultimo_resultado": ult_tox,
+              "contingencia_estaciones": pivot_est,
+              "contingencia_causal": causal_area,
+              "areas_contingencia": area_contingency(pivot_est, causal_area)}
+
+    elapsed = time.perf_counter() - start
+    print(f"[OK] - Contingency of {len(mrsat_df)} mrSAT records computed in {elapsed:.2f} s")
+    logger.debug(f"[OK] - COMPUTE_CONTINGENCY {len(mrsat_df)} ROWS {elapsed:.2f} S")
+    return tables
+
+def tables_to_db(tables, config_data, db_engine, logger):
+    """Replaces the state and contingency tables of the 'entradas' schema with the computed ones.
+
+    The contingency layers are then built from them by running the 'contingencia' step of
+    'tables_processing.sql', so they don't wait for the next run of generate_spatial_outputs.py.
+
+    Args:
+        tables (dict): table name -> pandas.core.frame.DataFrame, as returned by compute_contingency().
+        config_data (dict): config.json parameters.
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+    """
+
+    schema = config_data['mapstore']['schema']
+
+    try:
+        for table_name in ["mrsat_ultimo_resultado", "contingencia_estaciones", "contingencia_causal"]:
+            bulk_loader.load_df(tables[table_name], config_data, db_engine, table_name, schema, logger)
+
+        print("[OK] - Contingency tables successfully loaded to mapstore DB")
+        logger.debug("[OK] - TABLES_TO_DB")
+
+        sql_runner.run_sql_file(db_engine, "tables_processing.sql", logger, step_name = "contingencia")
+
+    except Exception as e:
+        print(e)
+        print("[ERROR] - Loading the contingency tables")
+        logger.error('[ERROR] - TABLES_TO_DB')
+        sys.exit(2)
+
+def tables_to_csv(tables, output_path, logger):
+    """Writes the computed tables as CSV files on a folder.
+
+    Args:
+        tables (dict): table name -> pandas.core.frame.DataFrame, as returned by compute_contingency().
+        output_path (str): Output folder.
+    """
+
+    if not os.path.exists(output_path):
+        os.makedirs(output_path)
+
+    for table_name, df in tables.items():
+        df.to_csv(output_path + "/" + table_name + ".csv", sep = ";", index = False)
+
+    print("[OK] - Contingency tables written to " + output_path)
+    logger.debug("[OK] - TABLES_TO_CSV")
+
+def main(argv):
+    # Usage: python3 contingency_engine.py mrsat.csv output_folder [config.json]
+    if len(argv) < 3:
+        sys.exit("[ERROR] - Usage: python3 contingency_engine.py <mrsat csv> <output folder> [config.json]")
+
+    logging.basicConfig(format = '%(asctime)s %(message)s', level = logging.INFO)
+    logger = logging.getLogger()
+
+    mrsat_df = pd.read_csv(argv[1], parse_dates = ["FechaExtraccion"])
+    grupos_df, limites_df = read_toxin_tables()
+
+    tables = compute_contingency(mrsat_df, grupos_df, limites_df, logger)
+    tables_to_csv(tables, argv[2], logger)
+
+    if len(argv) > 3:
+        config = sql_runner.get_config(argv[3])
+        tables_to_db(tables, config, sql_runner.create_mapstore_engine(config), logger)
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,197 @@
+import sys
+import os
+import time
+import logging
+from sqlalchemy import create_engine, event
+
+# Engines created on this process, by process id, config object and connection string. Worker
+# processes started with fork get their own engines instead of the pooled connections of the parent
+ENGINES = {}
+
+# Number of connections opened by each engine and seconds spent opening them
+CONNECT_STATS = {}
+
+# Connection arguments of the SQL Server ODBC driver
+MSSQL_CONNECT_ARGS = {
+    "TrustServerCertificate": "yes",
+    "Echo": "True",
+    "MARS_Connection": "yes"
+}
+
+
+def create_db_string(config_data, db_object, logger = None):
+    """Create database connection string based on the config file parameters.
+
+    Objects without 'db_type' (e.g. the 'mapstore' object of ide_subpesca_conector.py) are PostgreSQL.
+
+    Args:
+        config_data (dict): config.json parameters.
+        db_object (str): Name of the DB object specified on the config.json file.
+
+    Returns:
+        str
+    """
+
+    db_type = config_data[db_object].get('db_type', 'postgresql')
+
+    db_string = '{}://{}:{}@{}:{}/{}'.format(
+        db_type,
+        config_data[db_object]['user'],
+        config_data[db_object]['passwd'],
+        config_data[db_object]['host'],
+        config_data[db_object]['port'],
+        config_data[db_object]['db'])
+
+    # Case if the DB is SQL Server
+    if db_type == 'mssql+pyodbc':
+        db_string = db_string + '?driver=ODBC+Driver+17+for+SQL+Server'
+
+    if logger is not None:
+        logger.debug("[OK] - CREATE_DB_STRING")
+    return db_string
+
+def engine_options(config_data, db_object):
+    """Gets the pool and driver options of the engine of a DB object.
+
+    Every engine checks its connections before using them ('pool_pre_ping') and recycles them
+    after 'pool_recycle' seconds. PostgreSQL engines send executemany() as multi-row VALUES
+    pages and SQL Server engines use the pyodbc fast_executemany parameter arrays.
+
+    Args:
+        config_data (dict): config.json parameters.
+        db_object (str): Name of the DB object specified on the config.json file.
+
+    Returns:
+        dict: keyword arguments of sqlalchemy.create_engine.
+    """
+
+    db_config = config_data[db_object]
+    db_type = db_config.get('db_type', 'postgresql')
+
+    options = {
+        # The pool has room for the parallel steps of sql_runner.py
+        "pool_size": db_config.get('pool_size', max(db_config.get('sql_workers', 4), 5)),
+        "max_overflow": db_config.get('max_overflow', 10),
+        "pool_recycle": db_config.get('pool_recycle', 1800),
+        "pool_pre_ping": True
+    }
+
+    if db_type.startswith('postgresql'):
+        options["executemany_mode"] = "values_plus_batch"
+        options["insertmanyvalues_page_size"] = db_config.get('insert_page_size', 1000)
+
+    elif db_type == 'mssql+pyodbc':
+        options["fast_executemany"] = True
+        options["connect_args"] = MSSQL_CONNECT_ARGS
+
+    return options
+
+def instrument_engine(db_engine, db_object, logger):
+    """Logs the time spent opening each new connection of an engine and adds it to CONNECT_STATS.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): SQLAlchemy database engine.
+        db_object (str): Name of the DB object specified on the config.json file.
+    """
+
+    stats = CONNECT_STATS.setdefault(db_object, {"connections": 0, "seconds": 0.0})
+
+    @event.listens_for(db_engine, "do_connect")
+    def start_connect(dialect, connection_record, cargs, cparams):
+        connection_record.info["connect_start"] = time.perf_counter()
+
+    @event.listens_for(db_engine, "connect")
+    def end_connect(dbapi_connection, connection_record):
+        elapsed = time.perf_counter() - connection_record.info.pop("connect_start", time.perf_counter())
+        stats["connections"] += 1
+        stats["seconds"] += elapsed
+        logger.debug(f"[OK] - CONNECT {db_object.upper()} {elapsed * 1000:.1f} MS")
+
+def get_engine(config_data, db_object, logger = None):
+    """Gets the SQLAlchemy engine of a DB object, creating it on the first call of the process.
+
+    Args:
+        config_data (dict): config.json parameters.
+        db_object (str): Name of the DB object specified on the config.json file.
+
+    Returns:
+        sqlalchemy.engine.base.Engine.
+    """
+
+    logger = logger or logging.getLogger()
+    db_string = create_db_string(config_data, db_object)
+    key = (os.getpid(), db_object, db_string)
+
+    if key in ENGINES:
+        return ENGINES[key]
+
+    try:
+        db_engine = create_engine(db_string, **engine_options(config_data, db_object))
+        instrument_engine(db_engine, db_object, logger)
+        ENGINES[key] = db_engine
+        print("[OK] - SQLAlchemy engine successfully created")
+        logger.debug("[OK] - CREATE_DB_ENGINE " + db_object.upper())
+        return db_engine
+
+    except Exception as e:
+        print("[ERROR] - Creating the database connection engine")
+        print(e)
+        logger.error('[ERROR] - CREATE_DB_ENGINE')
+        sys.exit(2)
+
+def connect_to_engine(db_engine, config_data, db_object, logger):
+    """Connects to sqlalchemy database engine.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): SQLAlchemy database engine.
+        config_data (dict): config.json parameters.
+        db_object (str): Name of the DB object specified on the config.json file.
+
+    Returns:
+        sqlalchemy.engine.Connection.connect
+    """
+
+    db_type = config_data[db_object].get('db_type', 'postgresql')
+
+    if db_type == 'postgresql':
+        db_con = db_engine.connect()
+
+    else:
+        db_con = db_engine.connect().execution_options(autocommit=False)
+
+    print('[OK] - SQLAlchemy connection succesfully generated')
+    logger.debug("[OK] - CONNECT_TO_ENGINE")
+    return db_con
+
+def log_connect_stats(logger):
+    """Prints and logs the connections opened by each engine of the process and the time spent opening them.
+
+    Args:
+        logger (logging.Logger): Logger of the script.
+    """
+
+    for db_object, stats in CONNECT_STATS.items():
+        print(f"[OK] - {db_object}: {stats['connections']} connections opened in {stats['seconds']:.2f} s")
+        logger.debug(f"[OK] - CONNECT_STATS {db_object.upper()} {stats['connections']} CONNECTIONS {stats['seconds']:.2f} S")
+
+def dispose_engines():
+    """Closes the pooled connections of every engine of the process."""
+
+    for (pid, _, _), db_engine in list(ENGINES.items()):
+        if pid == os.getpid():
+            db_engine.dispose()
+
+def forget_parent_engines():
+    """Drops the engines inherited by a forked worker process without closing their connections.
+
+    The connections still belong to the parent, closing them from the worker would end the
+    parent's sessions. The worker creates its own engines on its first get_engine() call.
+    """
+
+    for db_engine in ENGINES.values():
+        db_engine.dispose(close = False)
+    ENGINES.clear()
+    CONNECT_STATS.clear()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child = forget_parent_engines)
@@ -0,0 +1,110 @@
+import hashlib
+import json
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+# Metadata table of the mapstore database with the fingerprint of each loaded table
+FINGERPRINT_TABLE = "etl_fingerprints"
+
+
+def df_fingerprint(df):
+    """Gets a fingerprint of the DataFrame content that doesn't depend on the order of its rows.
+
+    Each row is hashed with pandas.util.hash_pandas_object and the sorted row hashes are
+    hashed again with SHA-256, together with the column names and dtypes.
+
+    Args:
+        df (pandas.core.frame.DataFrame): DataFrame to fingerprint.
+
+    Returns:
+        str: hex SHA-256 digest.
+    """
+
+    row_hashes = np.sort(pd.util.hash_pandas_object(df, index = False).to_numpy())
+    columns = [[str(column), str(dtype)] for column, dtype in df.dtypes.items()]
+
+    digest = hashlib.sha256(json.dumps(columns).encode("utf8"))
+    digest.update(row_hashes.tobytes())
+    return digest.hexdigest()
+
+def create_fingerprint_table(con, schema):
+    """Creates the metadata table of the fingerprints if it doesn't exist.
+
+    Args:
+        con (sqlalchemy.engine.base.Connection): Mapstore DB connection.
+        schema (str): Schema of the metadata table.
+    """
+
+    con.execute(text("""
+        CREATE TABLE IF NOT EXISTS {schema}.{table} (
+            table_name text PRIMARY KEY,
+            fingerprint text NOT NULL,
+            n_rows bigint,
+            updated_at timestamp NOT NULL DEFAULT now()
+        )""".format(schema = schema, table = FINGERPRINT_TABLE)))
+
+def get_fingerprints(db_engine, schema):
+    """Gets the stored fingerprint of the tables that still exist on the mapstore database.
+
+    The metadata table is created if it doesn't exist.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        schema (str): Schema of the loaded tables and the metadata table.
+
+    Returns:
+        dict: table name -> fingerprint.
+    """
+
+    with db_engine.begin() as con:
+        create_fingerprint_table(con, schema)
+
+        rows = con.execute(text("""
+            SELECT table_name, fingerprint
+            FROM {schema}.{table}
+            WHERE to_regclass(quote_ident(:schema) || '.' || quote_ident(table_name)) IS NOT NULL
+            """.format(schema = schema, table = FINGERPRINT_TABLE)), {"schema": schema})
+
+        return {table_name: table_fingerprint for table_name, table_fingerprint in rows}
+
+def save_fingerprints(db_engine, schema, fingerprints):
+    """Stores the fingerprint of the loaded tables on the mapstore database.
+
+    It must be called once the tables and their dependent SQL were processed, so a failed
+    run loads them again on the next one.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        schema (str): Schema of the loaded tables and the metadata table.
+        fingerprints (dict): table name -> (fingerprint, number of rows).
+    """
+
+    if not fingerprints:
+        return
+
+    with db_engine.begin() as con:
+        con.execute(text("""
+            INSERT INTO {schema}.{table} (table_name, fingerprint, n_rows, updated_at)
+            VALUES (:table_name, :fingerprint, :n_rows, now())
+            ON CONFLICT (table_name) DO UPDATE
+            SET fingerprint = EXCLUDED.fingerprint,
+                n_rows = EXCLUDED.n_rows,
+                updated_at = EXCLUDED.updated_at
+            """.format(schema = schema, table = FINGERPRINT_TABLE)),
+            [{"table_name": table_name, "fingerprint": table_fingerprint, "n_rows": n_rows}
+             for table_name, (table_fingerprint, n_rows) in fingerprints.items()])
+
+def delete_fingerprints(db_engine, schema, table_names):
+    """Removes the stored fingerprint of tables loaded without fingerprinting, so they're loaded on the next run.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        schema (str): Schema of the loaded tables and the metadata table.
+        table_names (list): Names of the tables.
+    """
+
+    with db_engine.begin() as con:
+        create_fingerprint_table(con, schema)
+        con.execute(text("DELETE FROM {schema}.{table} WHERE table_name = ANY(:table_names)".format(
+            schema = schema, table = FINGERPRINT_TABLE)), {"table_names": list(table_names)})
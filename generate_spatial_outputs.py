@@ -3,29 +3,36 @@ import json
 import os
 import logging
 import pandas as pd
-from sqlalchemy import create_engine
 from sqlalchemy import text
-from datetime import datetime
+from sqlalchemy import column, inspect, literal_column, select, table
+from datetime import datetime, timedelta
 
-def execute_sql_query(mapstore_engine, sql_query, logger):
-    """Executes the 'tables_processing.sql' query on mapstore database.
+#python file with the shared mapstore bulk loader
+import bulk_loader
 
-    Args:
-        mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
-        sql_query (sqlalchemy.sql.elements.TextClause): 'tables_processing.sql' query
-    """
-    try:
-        with mapstore_engine.connect().execution_options(autocommit=True) as con:
-            con.execute(sql_query)
-        print("[OK] - SQL query successfully executed")
-        logger.debug("[OK] - EXECUTE_SQL_QUERY")
+#python file with the shared database engines
+import db_engine
 
-    except Exception as e:
-        print('[ERROR] - Executing SQL query')
-        print(e)
-        logger.error('[ERROR] - EXECUTE_SQL_QUERY')
-        sys.exit(2)
+#python file with the staging schema build of the output layers
+import staging_build
+
+#python file with the index declarations of the output layers
+import index_manager
+
+#python file with the partitioned mrSAT history
+import mrsat_history
+
+#python file with the vector tile cache of the output layers
+import tile_cache
 
+# Bytes of a NOTIFY payload, below the 8000 bytes limit of Postgres
+NOTIFY_PAYLOAD_MAX = 7900
+
+# Columns that identify a mrSAT record when the table is synchronized incrementally
+MRSAT_KEY_COLUMNS = ["CodigoCentro", "CodigoBancoNatural", "EstacionMonitoreo", "DescripcionAnalisis", "FechaExtraccion"]
+
+# Record kept among the mrSAT records with the same key, the highest result as the contingency steps do
+MRSAT_TIE_ORDER = ['"Resultado" DESC NULLS LAST']
 
 def df_to_db(df, config_data, db_engine, logger):
     """Replace the existing 'mrsat_60days' table on the mapstore DB.
@@ -40,11 +47,7 @@ def df_to_db(df, config_data, db_engine, logger):
     schema = config_data['mapstore']['schema']
     
     try:
-        df.to_sql(table,
-                    db_engine, 
-                    if_exists = 'replace', 
-                    schema = schema, 
-                    index = False)
+        bulk_loader.load_df(df, config_data, db_engine, table, schema, logger)
 
         print("[OK] - mrSAT table successfully replaced on mapstore DB")
         logger.debug("[OK] - DF_TO_DB")
@@ -56,15 +59,18 @@ def df_to_db(df, config_data, db_engine, logger):
         sys.exit(2)
 
 
-def open_sql_query(logger):
+def open_sql_query(logger, sql_file = "tables_processing.sql"):
     """Opens the SQL query to generate the outputs tables on mapstore database.
 
+    Args:
+        sql_file (str): Name of the .sql file to open.
+
     Returns:
         sqlalchemy.sql.elements.TextClause
     """
 
     try:
-        with open("./sql_queries/tables_processing.sql", encoding="utf8") as file:
+        with open("./sql_queries/" + sql_file, encoding="utf8") as file:
             sql_query = text(file.read())
         print("[OK] - SQL file successfully opened")
         logger.debug("[OK] - OPEN_SQL_QUERY")
@@ -96,96 +102,335 @@ def table_to_df(config_data, db_connection, logger):
     logger.debug("[OK] - TABLE_TO_DF")
     return df
 
-def connect_to_engine(db_engine, config_data, db_object, logger):
-    """Connects to sqlalchemy database engine.
+def stream_table_to_db(config_data, db_connection, mapstore_engine, logger):
+    """Streams the mrsat db's 'mrsat_60days' table to the mapstore DB in chunks, replacing the existing one.
+
+    Args:
+        config_data (dict): config.json parameters.
+        db_connection (sqlalchemy.engine.Connection.connect): mrSAT SQLAlchemy connection object.
+        mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+    """
+
+    mrsat_table = table(config_data['mrsat']['last_days_table'], schema = config_data['mrsat']['schema'])
+    query = select(literal_column('*')).select_from(mrsat_table)
+
+    try:
+        # The column types come from the mrSAT table, not from the values of its first chunk
+        types = bulk_loader.reflect_column_types(db_connection, config_data['mrsat']['last_days_table'], config_data['mrsat']['schema'])
+
+        bulk_loader.stream_query_to_db(db_connection,
+                                       query,
+                                       mapstore_engine,
+                                       'mrsat_60days',
+                                       config_data['mapstore']['schema'],
+                                       logger,
+                                       chunk_size = config_data['mrsat'].get('chunk_size', bulk_loader.COPY_CHUNK_SIZE),
+                                       types = types)
+
+        print("[OK] - mrSAT table successfully streamed to mapstore DB")
+        logger.debug("[OK] - STREAM_TABLE_TO_DB")
+
+    except Exception as e:
+        print(e)
+        print("[ERROR] - Streaming mrSAT table")
+        logger.error('[ERROR] - STREAM_TABLE_TO_DB')
+        sys.exit(2)
+
+def new_records_to_df(config_data, db_connection, since, logger):
+    """Transforms the mrsat db's 'mrsat_60days' records extracted since the given date to a Pandas DataFrame.
 
     Args:
-        db_engine (sqlalchemy.engine.base.Engine): SQLAlchemy database engine.
         config_data (dict): config.json parameters.
-        db_object (str): Name of the DB object specified on the config.json file.
+        db_connection (sqlalchemy.engine.Connection.connect): SQLAlchemy connection object.
+        since (datetime.datetime): Minimum 'FechaExtraccion' of the records.
 
     Returns:
-        sqlalchemy.engine.Connection.connect
+        pandas.core.frame.DataFrame
     """
 
-    db_type = config_data[db_object]['db_type']
+    mrsat_table = table(config_data['mrsat']['last_days_table'], schema = config_data['mrsat']['schema'])
+    query = select(literal_column('*')).select_from(mrsat_table).where(column('FechaExtraccion') >= since)
 
-    if db_type == 'postgresql':
-        db_con = db_engine.connect()
+    df = pd.read_sql(query, db_connection)
+    print("[OK] - " + str(len(df)) + " records extracted since " + str(since))
+    logger.debug("[OK] - NEW_RECORDS_TO_DF")
+    return df
 
-    else:
-        db_con = db_engine.connect().execution_options(autocommit=False)
-    
-    print('[OK] - SQLAlchemy connection succesfully generated')
-    logger.debug("[OK] - CONNECT_TO_ENGINE")
-    return db_con
+def get_high_water_mark(config_data, mapstore_engine, logger):
+    """Gets the latest 'FechaExtraccion' of the 'mrsat_60days' table on the mapstore DB.
 
-def create_db_engine(config_data, db_object, db_string, logger):
-    """Creates the SQL Alchemy db engine. 
+    Returns None when the table doesn't exist or has no unique key index yet, in which
+    case the whole source table has to be synchronized.
 
     Args:
         config_data (dict): config.json parameters.
-        db_object (str): Name of the DB object specified on the config.json file.
-        db_string (str):  Mapstore database connection string.
-    
+        mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+
     Returns:
-        sqlalchemy.engine.base.Engine.
+        datetime.datetime
+    """
+
+    schema = config_data['mapstore']['schema']
+    indexes = inspect(mapstore_engine).get_indexes('mrsat_60days', schema) \
+        if inspect(mapstore_engine).has_table('mrsat_60days', schema) else []
+
+    if 'mrsat_60days_key_idx' not in [index['name'] for index in indexes]:
+        print("[OK] - No high-water mark found, the whole mrSAT table will be synchronized")
+        return None
+
+    with mapstore_engine.connect() as con:
+        high_water_mark = con.execute(text('SELECT MAX("FechaExtraccion") FROM ' + schema + '.mrsat_60days')).scalar()
+
+    print("[OK] - mrSAT high-water mark: " + str(high_water_mark))
+    logger.debug("[OK] - GET_HIGH_WATER_MARK")
+    return high_water_mark
+
+def mark_pending_areas(config_data, mapstore_engine, areas, since, logger):
+    """Adds the areas whose mrSAT records are about to change to the 'contingencia_areas_pendientes' table.
+
+    The incremental contingency only recomputes the pending areas. They're marked before the
+    records are changed, so a failed run recomputes them on the next one.
+
+    Args:
+        config_data (dict): config.json parameters.
+        mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        areas (list): 'CodigoArea' of the new or changed records.
+        since (datetime.datetime): Start of the refreshed range of the 'mrsat_60days' table.
+            With None every area of the table is marked.
+    """
+
+    schema = config_data['mapstore']['schema']
+
+    with mapstore_engine.begin() as con:
+        con.execute(text('CREATE TABLE IF NOT EXISTS ' + schema + '.contingencia_areas_pendientes (cod_area bigint PRIMARY KEY)'))
+
+        con.execute(text('INSERT INTO ' + schema + '.contingencia_areas_pendientes '
+                         'SELECT DISTINCT unnest(CAST(:areas AS bigint[])) ON CONFLICT DO NOTHING'),
+                    {"areas": [int(area) for area in areas]})
+
+        if mrsat_history.table_exists(con, schema, 'mrsat_60days'):
+            con.execute(text('INSERT INTO ' + schema + '.contingencia_areas_pendientes '
+                             'SELECT DISTINCT "CodigoArea"::bigint FROM ' + schema + '.mrsat_60days '
+                             'WHERE "CodigoArea" IS NOT NULL AND (CAST(:since AS timestamp) IS NULL OR "FechaExtraccion" >= :since) '
+                             'ON CONFLICT DO NOTHING'),
+                        {"since": since})
+
+    print("[OK] - Areas with new mrSAT records marked for the contingency")
+    logger.debug("[OK] - MARK_PENDING_AREAS")
+
+def sync_new_records(config_data, mrsat_connection, mapstore_engine, logger):
+    """Upserts the new or changed mrSAT records into the 'mrsat_60days' table and expires the old ones.
+
+    Records are pulled from 'lookback_days' before the high-water mark, so results updated
+    on mrSAT after their extraction date are refreshed as well.
+
+    Args:
+        config_data (dict): config.json parameters.
+        mrsat_connection (sqlalchemy.engine.Connection.connect): mrSAT SQLAlchemy connection object.
+        mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
     """
 
+    schema = config_data['mapstore']['schema']
+    key_columns = config_data['mrsat'].get('key_columns', MRSAT_KEY_COLUMNS)
+    lookback_days = config_data['mrsat'].get('lookback_days', 3)
+
     try:
-        # Type of the DB 
-        db_type = config_data[db_object]['db_type']
+        high_water_mark = get_high_water_mark(config_data, mapstore_engine, logger)
 
-        if db_type == 'postgresql':
-            db_engine = create_engine(db_string)
-            print("[OK] - SQLAlchemy engine successfully created")
-            logger.debug("[OK] - CREATE_DB_ENGINE")
-            return db_engine
+        if high_water_mark is None:
+            mrsat_df = table_to_df(config_data, mrsat_connection, logger)
+            mark_pending_areas(config_data, mapstore_engine, mrsat_df['CodigoArea'].dropna().unique(), None, logger)
+            # The table is replaced on the upsert's transaction, so a failed load keeps the previous one
+            bulk_loader.upsert_df(mrsat_df, mapstore_engine, 'mrsat_60days', schema, key_columns, logger,
+                                  tie_order = MRSAT_TIE_ORDER, replace = True)
 
         else:
-            conn_args={
-                "TrustServerCertificate": "yes",
-                "Echo": "True",
-                "MARS_Connection": "yes"
-                }
+            since = high_water_mark - timedelta(days = lookback_days)
+            mrsat_df = new_records_to_df(config_data, mrsat_connection, since, logger)
+            mark_pending_areas(config_data, mapstore_engine, mrsat_df['CodigoArea'].dropna().unique(), since, logger)
+            bulk_loader.upsert_df(mrsat_df, mapstore_engine, 'mrsat_60days', schema, key_columns, logger,
+                                  prune_column = 'FechaExtraccion', prune_since = since, tie_order = MRSAT_TIE_ORDER)
+
+        with mapstore_engine.begin() as con:
+            expired = con.execute(open_sql_query(logger, 'expire_mrsat_records.sql'),
+                                  {"window_days": config_data['mrsat'].get('window_days', 60)}).scalar()
 
-            db_engine = create_engine(db_string, connect_args=conn_args)
-            print("[OK] - SQLAlchemy engine succesfully generated")
-            logger.debug("[OK] - CREATE_DB_ENGINE")
-            return db_engine
+        print("[OK] - " + str(expired) + " expired mrSAT records deleted")
+        logger.debug("[OK] - SYNC_NEW_RECORDS")
 
     except Exception as e:
-        print("[ERROR] - Creating the database connection engine")
         print(e)
-        logger.error('[ERROR] - CREATE_DB_ENGINE')
+        print("[ERROR] - Synchronizing mrSAT table")
+        logger.error('[ERROR] - SYNC_NEW_RECORDS')
         sys.exit(2)
 
-def create_db_string(config_data, db_object, logger):
-    """Create database connection string based on the config file parameters.
+def mark_expired_areas(config_data, mapstore_engine, window_start, logger):
+    """Adds the areas with mrSAT records about to leave the 'mrsat_60days' window to the 'contingencia_areas_pendientes' table.
 
     Args:
         config_data (dict): config.json parameters.
-        db_object (str): Name of the DB object specified on the config.json file.
+        mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        window_start (datetime.datetime): New start of the window.
+    """
+
+    schema = config_data['mapstore']['schema']
+
+    with mapstore_engine.begin() as con:
+        if mrsat_history.table_exists(con, schema, 'mrsat_60days'):
+            con.execute(text('INSERT INTO ' + schema + '.contingencia_areas_pendientes '
+                             'SELECT DISTINCT "CodigoArea"::bigint FROM ' + schema + '.mrsat_60days '
+                             'WHERE "CodigoArea" IS NOT NULL AND "FechaExtraccion" < :window_start '
+                             'ON CONFLICT DO NOTHING'),
+                        {"window_start": window_start})
+
+    logger.debug("[OK] - MARK_EXPIRED_AREAS")
+
+def sync_partitioned_records(config_data, mrsat_connection, mapstore_engine, logger):
+    """Replaces the recent partitions of the mrSAT history, moves the 'mrsat_60days' view window and drops the expired partitions.
+
+    The partitions are refreshed from the one that contains 'lookback_days' before the
+    latest loaded record, so results updated on mrSAT after their extraction date are
+    refreshed as well.
+
+    Args:
+        config_data (dict): config.json parameters.
+        mrsat_connection (sqlalchemy.engine.Connection.connect): mrSAT SQLAlchemy connection object.
+        mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+    """
+
+    schema = config_data['mapstore']['schema']
+    lookback_days = config_data['mrsat'].get('lookback_days', 3)
+    interval = config_data['mrsat'].get('partition_interval', 'week')
+
+    try:
+        high_water_mark = mrsat_history.get_high_water_mark(mapstore_engine, schema)
+
+        if high_water_mark is None:
+            refresh_start = None
+            mrsat_df = table_to_df(config_data, mrsat_connection, logger)
+        else:
+            refresh_start = mrsat_history.get_refresh_start(mapstore_engine, schema,
+                                                            high_water_mark - timedelta(days = lookback_days))
+            mrsat_df = new_records_to_df(config_data, mrsat_connection, refresh_start, logger)
+
+        mark_pending_areas(config_data, mapstore_engine, mrsat_df['CodigoArea'].dropna().unique(), refresh_start, logger)
+        mrsat_history.replace_partitions(mrsat_df, mapstore_engine, schema, refresh_start, interval, logger)
+
+        window_start = datetime.now() - timedelta(days = config_data['mrsat'].get('window_days', 60))
+        mark_expired_areas(config_data, mapstore_engine, window_start, logger)
+        mrsat_history.create_window_view(mapstore_engine, schema, window_start, logger)
+
+        mrsat_history.drop_old_partitions(mapstore_engine, schema, config_data['mrsat'].get('retention_days', 730), logger)
+        logger.debug("[OK] - SYNC_PARTITIONED_RECORDS")
+
+    except Exception as e:
+        print(e)
+        print("[ERROR] - Synchronizing mrSAT history")
+        logger.error('[ERROR] - SYNC_PARTITIONED_RECORDS')
+        sys.exit(2)
+
+def get_contingency_mode(config_data, mapstore_engine, logger):
+    """Gets the mode of the toxicological contingency step: 'incremental' or 'full'.
+
+    The incremental mode needs the incremental or partitioned mrSAT synchronization, which marks the changed
+    areas, and the contingency tables of a previous run. Otherwise the whole window is processed.
+
+    Args:
+        config_data (dict): config.json parameters.
+        mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
 
     Returns:
         str
     """
 
-    db_string = '{}://{}:{}@{}:{}/{}'.format(
-        config_data[db_object]['db_type'],
-        config_data[db_object]['user'],
-        config_data[db_object]['passwd'], 
-        config_data[db_object]['host'], 
-        config_data[db_object]['port'], 
-        config_data[db_object]['db'])
-
-    # Case if the DB is SQL Server
-    if config_data[db_object]['db_type'] == 'mssql+pyodbc':
-        db_string = db_string + '?driver=ODBC+Driver+17+for+SQL+Server'
-    
-    print("[OK] - Connection string successfully generated")
-    logger.debug("[OK] - CREATE_DB_STRING")
-    return db_string 
+    schema = config_data['mapstore']['schema']
+    contingency_mode = config_data['mrsat'].get('contingency_mode', 'full')
+
+    if contingency_mode == 'incremental':
+        if config_data['mrsat'].get('sync_mode', 'replace') not in ('incremental', 'partitioned'):
+            print("[OK] - The incremental contingency needs the incremental or partitioned mrSAT sync, processing the whole window")
+            contingency_mode = 'full'
+
+        elif not inspect(mapstore_engine).has_table('contingencia_estaciones', schema):
+            print("[OK] - No previous contingency tables found, processing the whole window")
+            contingency_mode = 'full'
+
+    print("[OK] - Contingency mode: " + contingency_mode)
+    logger.debug("[OK] - GET_CONTINGENCY_MODE " + contingency_mode.upper())
+    return contingency_mode
+
+def get_pending_areas(config_data, mapstore_engine, contingency_mode):
+    """Gets the areas the contingency steps are about to recompute.
+
+    Args:
+        config_data (dict): config.json parameters.
+        mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        contingency_mode (str): 'incremental' or 'full'.
+
+    Returns:
+        list: area codes, or None if every area is recomputed.
+    """
+
+    if contingency_mode != 'incremental':
+        return None
+
+    with mapstore_engine.connect() as con:
+        return con.execute(text('SELECT cod_area FROM ' + config_data['mapstore']['schema'] +
+                                '.contingencia_areas_pendientes ORDER BY cod_area')).scalars().all()
+
+def notify_changed_areas(config_data, mapstore_engine, areas, logger):
+    """Sends the recomputed areas to the mailer daemon listening on the 'notify_channel', once the contingency layers are built.
+
+    The payload is the comma separated area codes, or '*' if every area was recomputed or
+    the codes don't fit on a notification.
+
+    Args:
+        config_data (dict): config.json parameters.
+        mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        areas (list): area codes, or None for every area.
+    """
+
+    if areas is not None and not areas:
+        return
+
+    channel = config_data['mapstore'].get('notify_channel', 'contingencia_areas')
+    payload = '*' if areas is None else ','.join(str(int(area)) for area in areas)
+    if len(payload) > NOTIFY_PAYLOAD_MAX:
+        payload = '*'
+
+    with mapstore_engine.begin() as con:
+        con.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": channel, "payload": payload})
+
+    print("[OK] - Changed contingency areas notified on " + channel)
+    logger.debug("[OK] - NOTIFY_CHANGED_AREAS")
+
+def refresh_toxin_rollups(config_data, mapstore_engine, logger):
+    """Updates the daily and weekly toxin aggregates of 'toxin_rollups.sql' with the days of the new mrSAT records.
+
+    With the incremental sync modes only the days from 'lookback_days' before the last
+    aggregated day are recomputed, otherwise every day of the 'mrsat_60days' window.
+
+    Args:
+        config_data (dict): config.json parameters.
+        mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+    """
+
+    lookback_days = None
+    if config_data['mrsat'].get('sync_mode', 'replace') in ('incremental', 'partitioned'):
+        lookback_days = config_data['mrsat'].get('lookback_days', 3)
+
+    try:
+        with mapstore_engine.begin() as con:
+            con.execute(open_sql_query(logger, 'toxin_rollups.sql'), {"lookback_days": lookback_days})
+
+        print("[OK] - Toxin rollups successfully updated")
+        logger.debug("[OK] - REFRESH_TOXIN_ROLLUPS")
+
+    except Exception as e:
+        print(e)
+        print("[ERROR] - Updating toxin rollups")
+        logger.error('[ERROR] - REFRESH_TOXIN_ROLLUPS')
+        sys.exit(2)
 
 def create_logger(log_file):
     """Create a logger based on the passed log file.
@@ -291,33 +536,66 @@ def main(argv):
     # Creates the logger
     logger = create_logger(log_file)
 
-    # Generates 'mapstore' database coonection string
-    mrsat_string = create_db_string(config, 'mrsat', logger)
-
-    # Creates mrsat's database engine
-    mrsat_engine = create_db_engine(config, 'mrsat', mrsat_string, logger)
+    # Gets mrsat's database engine, shared by the whole process
+    mrsat_engine = db_engine.get_engine(config, 'mrsat', logger)
 
     # Connects to mrsat's database engine
-    mrsat_connection = connect_to_engine(mrsat_engine, config, 'mrsat', logger)
+    mrsat_connection = db_engine.connect_to_engine(mrsat_engine, config, 'mrsat', logger)
 
-    # Transforms the 'mrsat_60days' table to Pandas DataFrame 
-    mrsat_df = table_to_df(config, mrsat_connection, logger)
-    
-    # Generates 'mapstore' database coonection string
-    mapstore_string = create_db_string(config, 'mapstore', logger)
+    # Gets mapstore's database engine, shared by the whole process
+    mapstore_engine = db_engine.get_engine(config, 'mapstore', logger)
+
+    sync_mode = config['mrsat'].get('sync_mode', 'replace')
+
+    if sync_mode == 'incremental':
+        # Upserts only the new or changed records into the 'mrsat_60days' table on the mapstore DB
+        sync_new_records(config, mrsat_connection, mapstore_engine, logger)
 
-    # Creates mapstore's database engine
-    mapstore_engine = create_db_engine(config, 'mapstore', mapstore_string, logger)
+    elif sync_mode == 'partitioned':
+        # Replaces the recent partitions of the mrSAT history, read through the 'mrsat_60days' view
+        sync_partitioned_records(config, mrsat_connection, mapstore_engine, logger)
 
-    # Replaces the 'mrsat_60days' table on the mapstore DB
-    df_to_db(mrsat_df, config, mapstore_engine, logger)
+    elif config['mrsat'].get('transfer_mode') == 'stream':
+        # Streams the 'mrsat_60days' table in chunks to the mapstore DB
+        stream_table_to_db(config, mrsat_connection, mapstore_engine, logger)
 
-    # Opens the 'tables_processing.sql' file
-    sql_query = open_sql_query(logger)
+    else:
+        # Transforms the 'mrsat_60days' table to Pandas DataFrame 
+        mrsat_df = table_to_df(config, mrsat_connection, logger)
+
+        # Replaces the 'mrsat_60days' table on the mapstore DB
+        df_to_db(mrsat_df, config, mapstore_engine, logger)
+
+    # Indexes the area key of the mrSAT table and the contingency tables and updates their statistics.
+    # The partitions of the mrSAT history are indexed when they're created
+    indexed_tables = ['mrsat_ultimo_resultado', 'contingencia_estaciones', 'contingencia_causal']
+    if sync_mode != 'partitioned':
+        indexed_tables.insert(0, 'mrsat_60days')
+    index_manager.provision_indexes(mapstore_engine, config['mapstore']['schema'], indexed_tables, logger)
+
+    # Updates the daily and weekly toxin aggregates read by toxin_trends.py
+    refresh_toxin_rollups(config, mapstore_engine, logger)
+
+    # Recomputes only the areas with new mrSAT records or the whole window
+    contingency_mode = get_contingency_mode(config, mapstore_engine, logger)
 
-    # Executes the SQL to preprocces the input tables
-    execute_sql_query(mapstore_engine, sql_query, logger)
+    # Areas recomputed by the contingency steps, notified to the mailer once the layers are built
+    changed_areas = get_pending_areas(config, mapstore_engine, contingency_mode)
+
+    # Executes the steps of 'tables_processing.sql', running the independent ones in parallel,
+    # in place or through the staging schema
+    staging_build.run_sql_file(mapstore_engine, 'tables_processing.sql', config, logger,
+                               {'etl.contingency_mode': contingency_mode})
+
+    notify_changed_areas(config, mapstore_engine, changed_areas, logger)
+
+    if 'tiles' in config:
+        # Regenerates the vector tiles that cover the changed features of the output layers
+        tile_cache.update_tiles(config, mapstore_engine, tile_cache.TILE_LAYERS['tables_processing.sql'], logger)
     
+    # Reports the connections opened by each engine
+    db_engine.log_connect_stats(logger)
+
     end = datetime.now()
 
     print(f"[OK] - Tables successfully copied to mapstore's database. Time elapsed: {end - start}")
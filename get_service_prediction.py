@@ -4,10 +4,22 @@ import os
 import logging
 import requests
 import pandas as pd
-from sqlalchemy import create_engine
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from sqlalchemy import text
+from sqlalchemy import inspect
 from datetime import datetime
 
+#python file with the shared mapstore bulk loader
+import bulk_loader
+#python file with the shared database engines
+import db_engine
+#python file with the on-disk conditional HTTP cache
+import http_cache
+#python file with the index declarations of the output layers
+import index_manager
+
 def get_config(filepath=""):
     """Reads the config.json file.
 
@@ -43,80 +55,43 @@ def get_parameters(argv):
     config_filepath = argv[1]
     return config_filepath
 
-def create_db_string(config_data, db_object):
-    """Create database connection string based on the config file parameters.
+def create_http_session(config_data):
+    """Creates a keep-alive HTTP session with retries and exponential backoff for the prediction services.
 
     Args:
         config_data (dict): config.json parameters.
-        db_object (str): Name of the DB object specified on the config.json file.
 
     Returns:
-        str
-    """
-
-    db_string = '{}://{}:{}@{}:{}/{}'.format(
-        config_data[db_object]['db_type'],
-        config_data[db_object]['user'],
-        config_data[db_object]['passwd'], 
-        config_data[db_object]['host'], 
-        config_data[db_object]['port'], 
-        config_data[db_object]['db'])
-
-    # Case if the DB is SQL Server
-    if config_data[db_object]['db_type'] == 'mssql+pyodbc':
-        db_string = db_string + '?driver=ODBC+Driver+17+for+SQL+Server'
-    
-    print("[OK] - Connection string successfully generated")
-    return db_string 
-
-def create_db_engine(config_data, db_object, db_string):
-    """Creates the SQL Alchemy db engine. 
-
-    Args:
-        config_data (dict): config.json parameters.
-        db_object (str): Name of the DB object specified on the config.json file.
-        db_string (str):  Mapstore database connection string.
-    
-    Returns:
-        sqlalchemy.engine.base.Engine.
+        requests.Session.
     """
 
-    try:
-        # Type of the DB 
-        db_type = config_data[db_object]['db_type']
-
-        if db_type == 'postgresql':
-            db_engine = create_engine(db_string)
-            print("[OK] - SQLAlchemy engine successfully created")
-            return db_engine
-
-        else:
-            conn_args={
-                "TrustServerCertificate": "yes",
-                "Echo": "True",
-                "MARS_Connection": "yes"
-                }
+    retries = Retry(total = config_data["pred_service"].get("max_retries", 3),
+                    backoff_factor = config_data["pred_service"].get("backoff_factor", 0.5),
+                    status_forcelist = [429, 500, 502, 503, 504],
+                    allowed_methods = ["GET"],
+                    raise_on_status = False)
+    pool_size = config_data["pred_service"].get("max_workers", 8)
+    adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size, max_retries = retries)
 
-            db_engine = create_engine(db_string, connect_args=conn_args)
-            print("[OK] - SQLAlchemy engine succesfully generated")
-            return db_engine
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
 
-    except Exception as e:
-        print("[ERROR] - Creating the database connection engine")
-        print(e)
-        sys.exit(2)
+    print("[OK] - HTTP session succesfully created")
+    return session
 
-
-def get_json_response(url):
+def get_json_response(url, session = None):
     """ Gets json response from an URL
     
     Args:
         url (str): URL of REST service
+        session (requests.Session): Optional pooled HTTP session used to make the request.
         
     Returns:
         json_data (dict): JSON response.
     """
-    json_data = requests.get(url).json()
+    http = session if session is not None else requests
+    json_data = http.get(url).json()
 
     print("[OK] - " + url + " service succesfully requested")
     
@@ -170,76 +145,172 @@ def get_areas_urls(toxins_url, areas_list):
     
     return areas_url_list
 
-def remove_unavailable_areas(areas_url_list):
-    available_areas = [url for url in areas_url_list if str(requests.get(url)) == '<Response [200]>']
-    
-    print("[OK] - Unavailable areas succesfully removed")
+def cached_request(url, session, cache_dir = None):
+    """Requests an URL, conditionally through the on-disk HTTP cache if a cache folder is given.
+
+    Args:
+        url (str): URL of REST service.
+        session (requests.Session): Pooled HTTP session.
+        cache_dir (str): Optional path of the cache folder.
+
+    Returns:
+        tuple: (int, bytes, bool) status code, response content and whether it changed since the last load.
+    """
+
+    if cache_dir is None:
+        response = session.get(url)
+        return response.status_code, response.content, True
+
+    return http_cache.cached_get(session, url, cache_dir)
+
+def get_area_toxins(url, session, cache_dir = None):
+    """Requests the available toxins of an area, checking on the same response if the area is available.
+
+    Args:
+        url (str): Formatted URL of the REST service of available toxins from an area.
+        session (requests.Session): Pooled HTTP session.
+        cache_dir (str): Optional path of the cache folder.
+
+    Returns:
+        tuple: (list, bool) available toxins, or None if the area is unavailable, and whether they changed.
+    """
 
-    return available_areas   
+    status, content, changed = cached_request(url, session, cache_dir)
 
-def create_areas_dict(areas_url_list):
-    """Creates a dictionary with the area's id and their respective available toxins.
+    if status != 200:
+        return None, changed
+
+    return json.loads(content), changed
+
+def create_areas_dict(areas_url_list, session, max_workers, cache_dir = None):
+    """Creates a dictionary with the available area's id and their respective toxins.
+
+    Each area URL is requested exactly once, concurrently, and the unavailable areas are left out.
     
     Args:
         areas_url_list (list): List of all the URL's of the areas.
+        session (requests.Session): Pooled HTTP session.
+        max_workers (int): Number of concurrent requests.
+        cache_dir (str): Optional path of the cache folder.
     
     Returns:
-        areas_dict (dict): Dictionary with the area's id and their respective available toxins.
+        tuple: (dict, set) area's id -> available toxins, and ids of the areas whose toxins changed.
     """
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        toxins_list = list(executor.map(lambda url: get_area_toxins(url, session, cache_dir), areas_url_list))
+
+    areas_dict = {int(url.split('=')[1]) : toxins for url, (toxins, _) in zip(areas_url_list, toxins_list) if toxins is not None}
+    changed_areas = {int(url.split('=')[1]) for url, (toxins, changed) in zip(areas_url_list, toxins_list)
+                     if toxins is not None and changed}
     
-    areas_dict = {int(url.split('=')[1]) : get_json_response(url) for url in areas_url_list}
-    
+    print("[OK] - " + str(len(areas_url_list) - len(areas_dict)) + " unavailable areas succesfully removed")
     print("[OK] - Areas dictionary succesfully generated")
 
-    return areas_dict
+    return areas_dict, changed_areas
+
+def get_area_toxin_df(content, area, toxina):
+    """Stores the prediction of a toxin in an area as a DataFrame.
+
+    Args:
+        content (bytes): JSON response of the prediction REST service.
+        area (int): ID from an area.
+        toxina (str): Name of the toxin.
+
+    Returns:
+        pandas.core.frame.DataFrame
+    """
+
+    json_response = json.loads(content)
+    df = pd.DataFrame.from_dict(json_response['original']['points'])
+    df['area'] = area
+    df['analisis'] = toxina
+    return df
 
-def create_df_list(areas_dict, service_url):
-    """Creates a list with all the requested areas and toxins.
+def create_df_list(areas_dict, service_url, session, max_workers, cache_dir = None, changed_areas = None):
+    """Creates a list with the requested areas and toxins.
+
+    Every area-toxin prediction is requested, but when 'changed_areas' is given only the areas on it,
+    or with at least one changed prediction, are transformed to DataFrames.
 
     Args:
         areas_dict (dict): Dictionary with the area's id and their respective available toxins.
-        config_data (dict): config.json parameters.
-        service_name (str): name of the URL of the REST service on the config.json file.
+        service_url (str): URL of the prediction REST service.
+        session (requests.Session): Pooled HTTP session.
+        max_workers (int): Number of concurrent requests.
+        cache_dir (str): Optional path of the cache folder.
+        changed_areas (set): Optional ids of the areas already known to have changed.
     
     Returns: 
-        df_list (list): List of multiple area-toxin DF's
+        tuple: (list, set) area-toxin DF's and ids of the areas they belong to.
     """ 
-    
-    df_list = []
 
-    for area, toxinas in areas_dict.items():
+    pairs = [(area, toxina) for area, toxinas in areas_dict.items() for toxina in toxinas]
 
-        for toxina in toxinas:
-            url = service_url.format(area, toxina)
-            json_response = get_json_response(url)
-            df = pd.DataFrame.from_dict(json_response['original']['points'])
-            df['area'] = area
-            df['analisis'] = toxina
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        responses = list(executor.map(lambda pair: cached_request(service_url.format(pair[0], pair[1]), session, cache_dir), pairs))
+
+    for (area, toxina), (status, content, changed) in zip(pairs, responses):
+        if status != 200:
+            raise ValueError("Prediction of {} in area {} returned HTTP status {}".format(toxina, area, status))
+
+    if changed_areas is None:
+        load_areas = set(areas_dict)
+    else:
+        load_areas = set(changed_areas) | {area for (area, _), (_, _, changed) in zip(pairs, responses) if changed}
 
-            df_list.append(df)
+    df_list = [get_area_toxin_df(content, area, toxina)
+               for (area, toxina), (_, content, _) in zip(pairs, responses) if area in load_areas]
 
     print("[OK] - List of DF's succesfully generated")
 
-    return df_list
+    return df_list, load_areas
+
+def mark_areas_loaded(areas_dict, toxins_url, service_url, cache_dir):
+    """Records the cached toxins and predictions of the areas as loaded to the database.
+
+    Args:
+        areas_dict (dict): Dictionary with the area's id and their respective available toxins.
+        toxins_url (str): URL of REST service of available toxins from an area.
+        service_url (str): URL of the prediction REST service.
+        cache_dir (str): Path of the cache folder.
+    """
+
+    for area, toxinas in areas_dict.items():
+        http_cache.mark_loaded(cache_dir, format_toxin_url(toxins_url, area))
+        for toxina in toxinas:
+            http_cache.mark_loaded(cache_dir, service_url.format(area, toxina))
+
+def update_changed_areas(df, mapstore_engine, table_name, available_areas, changed_areas):
+    """Replaces the predictions of the changed areas and removes the unavailable ones in one transaction.
+
+    Args:
+        df (pandas.core.frame.DataFrame): Predictions of the changed areas.
+        mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        table_name (str): Name of the output table on the mapstore's database.
+        available_areas (list): Ids of the available areas.
+        changed_areas (list): Ids of the changed areas.
+    """
+
+    with mapstore_engine.begin() as con:
+        con.execute(text('DELETE FROM entradas.' + table_name + ' WHERE NOT (area = ANY(:available)) OR area = ANY(:changed)'),
+                    {"available": list(available_areas), "changed": list(changed_areas)})
+        if not df.empty:
+            df.to_sql(table_name, con, if_exists = 'append', schema = 'entradas', index = False)
+
+    print("[OK] - " + str(len(changed_areas)) + " changed areas succesfully updated")
 
-def df_to_db(df, mapstore_engine, table_name):
-    """Copy the IDE DataFrames to the mapstore database.
+def df_to_db(df, config_data, mapstore_engine, table_name):
+    """Copy the prediction DataFrame to the mapstore database.
 
     Args:
-        df (pandas.core.frame.DataFrame): Dataframe from IDE service.
+        df (pandas.core.frame.DataFrame): Dataframe from the prediction service.
         config_data (dict): config.json parameters.
         mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
         table_name (str): Name of the output table on the mapstore's database.
-    
-    Raises:
-        SAWarning: Did not recognize type 'geometry' of column 'geom'
     """
 
-    df.to_sql(table_name, 
-              mapstore_engine, 
-              if_exists = 'replace', 
-              schema = 'entradas', 
-              index = False)
+    bulk_loader.load_df(df, config_data, mapstore_engine, table_name, 'entradas', logging.getLogger())
 
 
 def main(argv):
@@ -257,14 +328,17 @@ def main(argv):
     areas_url = config["pred_service"]["areas_url"]
     toxins_url = config["pred_service"]["toxins_url"]
 
-    # Generates 'mapstore' database coonection string
-    mapstore_con_string = create_db_string(config, 'mapstore')
+    # Gets mapstore's database engine, shared by the whole process
+    mapstore_engine = db_engine.get_engine(config, 'mapstore')
 
-    # Creates mapstore's database engine
-    mapstore_engine = create_db_engine(config, 'mapstore', mapstore_con_string)
+    # Number of concurrent requests to the prediction services
+    max_workers = config["pred_service"].get("max_workers", 8)
+
+    # Creates the keep-alive HTTP session shared by the requests
+    session = create_http_session(config)
 
     # Gets json response from the available areas service
-    areas_response = get_json_response(areas_url)
+    areas_response = get_json_response(areas_url, session)
 
     # Gets the list of areas from the REST service
     areas_list = get_list_areas(areas_response)
@@ -272,20 +346,40 @@ def main(argv):
     # Gets the formatted urls of all the available areas
     areas_url_list = get_areas_urls(toxins_url, areas_list)
 
-    # Removes the unavilable areas from the areas list
-    areas_url_list = remove_unavailable_areas(areas_url_list)
+    # Optional folder of the conditional HTTP cache
+    cache_dir = config["pred_service"].get("cache_dir")
+
+    # Creates a dictionary with the available areas and their toxins.
+    areas_dict, changed_areas = create_areas_dict(areas_url_list, session, max_workers, cache_dir)
 
-    # Creates a dictionary with tha areas and their toxins.
-    areas_dict = create_areas_dict(areas_url_list)
+    # With the cache, only the changed areas are updated on an existing table
+    incremental = cache_dir is not None and inspect(mapstore_engine).has_table("mrsat_pred", schema = "entradas")
 
     # Generates list of area-toxin DF's
-    df_list = create_df_list(areas_dict, service_url)
+    df_list, load_areas = create_df_list(areas_dict, service_url, session, max_workers, cache_dir,
+                                         changed_areas if incremental else None)
+
+    if incremental:
+        print("[OK] - " + str(len(areas_dict) - len(load_areas)) + " unchanged areas skipped")
+
+        # Replaces the changed areas on the mapstore DB
+        df_final = pd.concat(df_list) if df_list else pd.DataFrame()
+        update_changed_areas(df_final, mapstore_engine, "mrsat_pred", list(areas_dict), load_areas)
+
+    else:
+        # Concatenates the final DF
+        df_final = pd.concat(df_list)
+
+        # Copies the final DF to the mapstore DB
+        df_to_db(df_final, config, mapstore_engine, "mrsat_pred")
 
-    # Concatenates the final DF
-    df_final = pd.concat(df_list)
+    # Index and analyze the predictions table
+    index_manager.provision_indexes(mapstore_engine, "entradas", ["mrsat_pred"], logging.getLogger())
 
-    # Copies the final DF to the mapstore DB
-    df_to_db(df_final, mapstore_engine, "mrsat_pred")
+    if cache_dir is not None:
+        # Records the areas as loaded and keeps the cache folder under its size limit
+        mark_areas_loaded(areas_dict, toxins_url, service_url, cache_dir)
+        http_cache.evict_cache(cache_dir, config["pred_service"].get("cache_max_bytes", http_cache.CACHE_MAX_BYTES))
 
     end = datetime.now()
 
@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import time
+
+# Default maximum size of the cache directory (500 MB)
+CACHE_MAX_BYTES = 500 * 1024 * 1024
+
+
+def cache_key(url, params = None):
+    """Gets the cache key of a request, based on its URL and query parameters.
+
+    Args:
+        url (str): URL of the request.
+        params (dict): Query parameters of the request.
+
+    Returns:
+        str.
+    """
+
+    request_id = url + "?" + json.dumps(params or {}, sort_keys = True)
+    return hashlib.sha256(request_id.encode("utf8")).hexdigest()
+
+def read_metadata(cache_dir, key):
+    """Reads the stored metadata of a cached response.
+
+    Args:
+        cache_dir (str): Path of the cache folder.
+        key (str): Cache key of the request.
+
+    Returns:
+        dict: metadata, or an empty dict if the response isn't cached.
+    """
+
+    meta_file = os.path.join(cache_dir, key + ".json")
+    body_file = os.path.join(cache_dir, key + ".body")
+
+    if not (os.path.exists(meta_file) and os.path.exists(body_file)):
+        return {}
+
+    with open(meta_file) as json_file:
+        return json.load(json_file)
+
+def write_file(filepath, content, mode = "wb"):
+    """Writes a file atomically, so an interrupted run never leaves a truncated cache entry.
+
+    Args:
+        filepath (str): Path of the file.
+        content (bytes or str): Content of the file.
+        mode (str): File mode, 'wb' for bytes or 'w' for text.
+    """
+
+    tmp_file = filepath + ".tmp"
+    with open(tmp_file, mode) as file:
+        file.write(content)
+    os.replace(tmp_file, filepath)
+
+def cached_get(session, url, cache_dir, params = None, headers = None):
+    """Makes a conditional GET request backed by the on-disk response cache.
+
+    The stored ETag and Last-Modified of the previous response are sent as If-None-Match
+    and If-Modified-Since. The response is reported as changed while its content hash differs
+    from the one recorded by mark_loaded, so a payload whose load failed is loaded again on the
+    next run. Only 200 responses are cached.
+
+    Args:
+        session (requests.Session): HTTP session used to make the request.
+        url (str): URL of the request.
+        cache_dir (str): Path of the cache folder.
+        params (dict): Query parameters of the request.
+        headers (dict): Additional headers of the request.
+
+    Returns:
+        tuple: (int, bytes, bool) status code, response content and whether it changed since the last load.
+    """
+
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok = True)
+
+    key = cache_key(url, params)
+    metadata = read_metadata(cache_dir, key)
+    body_file = os.path.join(cache_dir, key + ".body")
+
+    request_headers = dict(headers or {})
+    if metadata.get("etag"):
+        request_headers["If-None-Match"] = metadata["etag"]
+    if metadata.get("last_modified"):
+        request_headers["If-Modified-Since"] = metadata["last_modified"]
+
+    response = session.get(url, params = params, headers = request_headers)
+
+    if response.status_code == 304 and metadata:
+        with open(body_file, "rb") as file:
+            content = file.read()
+
+    elif response.status_code == 200:
+        content = response.content
+        content_hash = hashlib.sha256(content).hexdigest()
+        if content_hash != metadata.get("content_hash"):
+            write_file(body_file, content)
+        metadata = {
+            "url": url,
+            "params": params,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_hash": content_hash,
+            "loaded_hash": metadata.get("loaded_hash"),
+            "size": len(content)
+        }
+
+    else:
+        return response.status_code, response.content, True
+
+    metadata["last_access"] = time.time()
+    write_file(os.path.join(cache_dir, key + ".json"), json.dumps(metadata), mode = "w")
+    return 200, content, metadata["content_hash"] != metadata["loaded_hash"]
+
+def mark_loaded(cache_dir, url, params = None):
+    """Records the cached response of a request as loaded to the database.
+
+    Args:
+        cache_dir (str): Path of the cache folder.
+        url (str): URL of the request.
+        params (dict): Query parameters of the request.
+    """
+
+    key = cache_key(url, params)
+    metadata = read_metadata(cache_dir, key)
+
+    if metadata:
+        metadata["loaded_hash"] = metadata["content_hash"]
+        write_file(os.path.join(cache_dir, key + ".json"), json.dumps(metadata), mode = "w")
+
+def evict_cache(cache_dir, max_bytes = CACHE_MAX_BYTES):
+    """Removes the least recently used responses until the cache fits in the given size.
+
+    Args:
+        cache_dir (str): Path of the cache folder.
+        max_bytes (int): Maximum size of the cached responses.
+
+    Returns:
+        int: number of evicted responses.
+    """
+
+    if not os.path.exists(cache_dir):
+        return 0
+
+    entries = []
+    for filename in os.listdir(cache_dir):
+        if filename.endswith(".json"):
+            key = filename[:-len(".json")]
+            metadata = read_metadata(cache_dir, key)
+            entries.append((metadata.get("last_access", 0), metadata.get("size", 0), key))
+
+    total_bytes = sum(size for _, size, _ in entries)
+    n_evicted = 0
+
+    for _, size, key in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        for extension in (".json", ".body"):
+            filepath = os.path.join(cache_dir, key + extension)
+            if os.path.exists(filepath):
+                os.remove(filepath)
+        total_bytes -= size
+        n_evicted += 1
+
+    return n_evicted
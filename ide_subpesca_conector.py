@@ -2,45 +2,58 @@ import requests
 import sys
 import os
 import json
+import time
 import pandas as pd
 import logging
-from shapely.geometry import Polygon
-from sqlalchemy import create_engine
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+import numpy as np
+import shapely
+from itertools import chain
+from sqlalchemy import inspect
 from sqlalchemy import text
+from sqlalchemy.types import UserDefinedType
 from datetime import datetime
 
+#python file with the shared mapstore bulk loader
+import bulk_loader
+#python file with the shared database engines
+import db_engine
+#python file with the on-disk conditional HTTP cache
+import http_cache
+#python file with the change detection of the loaded tables
+import fingerprint
+#python file with the staging schema build of the output layers
+import staging_build
+#python file with the index declarations of the output layers
+import index_manager
+#python file with the vector tile cache of the output layers
+import tile_cache
 
+# Suffix of the schema where the paged download loads each layer before replacing its table
+PAGED_SCHEMA_SUFFIX = "_paged"
 
-def execute_sql_query(mapstore_engine, sql_query, logger):
-    """Execute the given sql query on mapstore database.
+# ArcGIS services of the config file and the name of their output table on mapstore
+IDE_LAYERS = {
+    "centros": "concesiones_acuicultura",
+    "areas_colecta": "areas_colecta",
+    "ecmpo": "ecmpo",
+    "amerb": "amerb",
+    "acui_en_amerb": "acuiamerb"
+}
 
-    Args:
-        mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
-        sql_query (sqlalchemy.sql.elements.TextClause): SQL file query
-    """
 
-    with mapstore_engine.connect().execution_options(autocommit=True) as con:
-        con.execute(sql_query)
-    print("[OK] - SQL query successfully executed")
-    logger.debug("[OK] - EXECUTE_SQL_QUERY")
+class Geometry(UserDefinedType):
+    """PostGIS geometry column type, used to create the 'geom' column of the IDE tables."""
 
-def open_sql_query(sql_file, logger):
-    """Open the SQL query to add the geometry type to the IDE tables on mapstore database.
+    cache_ok = True
 
-    Args:
-        sql_file (str): Name of the .sql file to execute
+    def get_col_spec(self, **kw):
+        return "geometry(Geometry, 4326)"
 
-    Returns:
-        sqlalchemy.sql.elements.TextClause
-    """
 
-    with open("./sql_queries/" + sql_file, encoding = "utf8") as file:
-        sql_query = text(file.read())
-    print("[OK] - " + sql_file + " SQL file successfully opened")
-    logger.debug("[OK] - " + sql_file.upper() + " OPEN_SQL_QUERY")
-    return sql_query
- 
-def df_to_db(df, config_data, mapstore_engine, table_name, logger):
+def df_to_db(df, config_data, mapstore_engine, table_name, logger, if_exists = 'replace', schema = None):
     """Copy the IDE DataFrames to the mapstore database.
 
     Args:
@@ -48,61 +61,22 @@ def df_to_db(df, config_data, mapstore_engine, table_name, logger):
         config_data (dict): config.json parameters.
         mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
         table_name (str): Name of the output table on the mapstore's database.
-    
-    Raises:
-        SAWarning: Did not recognize type 'geometry' of column 'geom'
+        if_exists (str): 'replace' to recreate the table or 'append' to add the rows to it.
+        schema (str): Schema of the output table, the mapstore's schema by default.
     """
 
-    df.to_sql(table_name, 
-                mapstore_engine, 
-                if_exists = 'replace', 
-                schema = config_data['mapstore']['schema'], 
-                index = False)
+    bulk_loader.load_df(df,
+                        config_data,
+                        mapstore_engine,
+                        table_name,
+                        schema or config_data['mapstore']['schema'],
+                        logger,
+                        if_exists = if_exists,
+                        dtype = {"geom": Geometry()})
 
     print("[OK] - " + table_name + " dataframe successfully copied to Mapstore database")
     logger.debug("[OK] - " + table_name.upper() + " DF_TO_DB")
 
-def create_mapstore_engine(mapstore_connection, logger):
-    """Create sqlalchemy mapstore engine based on the mapstore connection string.
-
-    Args:
-        mapstore_connection (str): string with the mapstore databse connection.
-
-    Returns:
-        sqlalchemy.engine.base.Engine
-    """
-    try:
-        mapstore_engine = create_engine(mapstore_connection)
-        print("[OK] - SQLAlchemy engine succesfully generated")
-        logger.debug("[OK] - CREATE_MAPSTORE_ENGINE")
-        return mapstore_engine
-
-    except Exception as e:
-        print('[ERROR] - Creating DB engine')
-        print(e)
-        logger.error('[ERROR] - CREATE_MAPSTORE_ENGINE')
-        sys.exit(2)
-
-def create_mapstore_connection(config_data, logger):
-    """Create mapstore connection string based on the config file parameters.
-
-    Args:
-        config_data (dict): config.json parameters.
-
-    Returns:
-        str
-    """
-
-    mapstore_connection = 'postgresql://{}:{}@{}:{}/{}'.format(
-        config_data['mapstore']['user'],
-        config_data['mapstore']['passwd'], 
-        config_data['mapstore']['host'], 
-        config_data['mapstore']['port'], 
-        config_data['mapstore']['db'])
-    print("[OK] - Connection string successfully generated")
-    logger.debug("[OK] - CREATE_MAPSTORE_CONNECTION")
-    return mapstore_connection   
-
 def drop_str_geometry(df, logger):
     """Drop the previous geometry column.
 
@@ -119,7 +93,10 @@ def drop_str_geometry(df, logger):
     return df
 
 def transform_geometry_column(df, logger):
-    """Transform the geometry column to a SQL readable format.
+    """Encodes the "geometry.rings" column as a hex EWKB 'geom' column with SRID 4326.
+
+    The EWKB strings are parsed by PostGIS when they are inserted into a geometry column,
+    so no WKT round trip nor UPDATE of the table is needed afterwards.
 
     Args:
         df (pandas.core.frame.DataFrame): Dataframe from IDE service.
@@ -128,41 +105,89 @@ def transform_geometry_column(df, logger):
         pandas.core.frame.DataFrame
     """
 
-    df["geometry"] = df["geometry"].apply(Polygon).apply(str)
+    geometries = shapely.set_srid(rings_to_geometries(df["geometry.rings"].values), 4326)
+    df["geom"] = shapely.to_wkb(geometries, hex = True, include_srid = True)
     print("[OK] - Geometry column format successfully converted")
     logger.debug("[OK] - TRANSFORM GEOMETRY COLUMN")
     return df
 
-def polygon_coords_to_df(df, coord_list, logger):
-    """Appends the list of coordinates to the centros_df DataFrame as a column.
+def rings_to_geometries(rings_column):
+    """Builds the shapely geometries of the ESRI 'rings' arrays with vectorized constructors.
+
+    All rings of every feature are kept. Following the ESRI convention, clockwise rings are
+    outer shells and counter-clockwise rings are holes of the shell that contains them.
+    Features with one shell become a Polygon, features with several shells a MultiPolygon
+    and features without rings a null geometry.
 
     Args:
-        df (pandas.core.frame.DataFrame): Dataframe from IDE service.
-        coord_list (list): list of lists with the coodinates of each farming center.
+        rings_column (numpy.ndarray): ESRI 'rings' of each feature (list of rings of [x, y] points).
 
     Returns:
-        pandas.core.frame.DataFrame
+        numpy.ndarray: array of shapely geometries.
     """
 
-    df["geometry"] = coord_list
-    print("[OK] - New geometry column successfully appended")
-    logger.debug("[OK] - POLYGON_COORDS_TO_DF")
-    return df
-
-def list_to_tuples(df, logger):
-    """Transforms the "geometry.rings" column from list of lists to a list of tuples. 
+    rings_column = [rings if isinstance(rings, list) else [] for rings in rings_column]
+    geometries = np.full(len(rings_column), None, dtype = object)
+
+    ring_counts = np.array([len(rings) for rings in rings_column], dtype = np.int64)
+    all_rings = list(chain.from_iterable(rings_column))
+    if not all_rings:
+        return geometries
+
+    point_counts = np.array([len(ring) for ring in all_rings], dtype = np.int64)
+    coords = np.array(list(chain.from_iterable(all_rings)), dtype = float)[:, :2]
+    rings = shapely.linearrings(coords, indices = np.repeat(np.arange(len(all_rings)), point_counts))
+
+    # Feature of each ring, counted only over the features with geometry
+    features = np.flatnonzero(ring_counts)
+    ring_feature = np.repeat(np.arange(len(features)), ring_counts[features])
+    first_ring = np.zeros(len(all_rings), dtype = bool)
+    first_ring[np.cumsum(ring_counts[features]) - ring_counts[features]] = True
+
+    # Clockwise rings are shells, the first ring of a feature always opens a polygon
+    is_shell = ~shapely.is_ccw(rings) | first_ring
+    ring_polygon = np.cumsum(is_shell) - 1
+
+    # Holes go to the preceding shell, unless the feature has several shells and
+    # the hole lies inside another one of them
+    shell_feature = ring_feature[is_shell]
+    n_shells = np.bincount(shell_feature, minlength = len(features))
+    for hole in np.flatnonzero(~is_shell & (n_shells[ring_feature] > 1)):
+        shells = np.flatnonzero(is_shell & (ring_feature == ring_feature[hole]))
+        shell_polygons = shapely.polygons(rings[shells])
+        x, y = shapely.get_coordinates(rings[hole])[0]
+        containing = shells[shapely.contains_xy(shell_polygons, x, y)]
+        if len(containing) > 0:
+            areas = shapely.area(shapely.polygons(rings[containing]))
+            ring_polygon[hole] = ring_polygon[containing[np.argmin(areas)]]
+
+    order = np.lexsort((~is_shell, ring_polygon))
+    polygons = shapely.polygons(rings[order], indices = ring_polygon[order])
+
+    multipolygons = shapely.multipolygons(polygons, indices = shell_feature)
+    first_polygon = np.cumsum(n_shells) - n_shells
+    geometries[features] = np.where(n_shells == 1, polygons[first_polygon], multipolygons)
+    return geometries
+
+def process_ide_df(df, logger):
+    """Applies the rename and geometry transformation steps to an IDE DataFrame.
 
     Args:
         df (pandas.core.frame.DataFrame): Dataframe from IDE service.
 
     Returns:
-        list.
+        pandas.core.frame.DataFrame
     """
 
-    coord_list = [[*map(tuple, row[0])] for row in df["geometry.rings"].values]
-    print("[OK] - List of lists successfully converted to list of tuples")
-    logger.debug("[OK] - LIST_TO_TUPLES")
-    return coord_list
+    # Rename DataFrame's columns
+    df = rename_df_columns(df, logger)
+
+    # Encode the rings of every feature as a WKB geometry column
+    df = transform_geometry_column(df, logger)
+
+    # Drop the old geometry column
+    df = drop_str_geometry(df, logger)
+    return df
 
 def rename_df_columns(df, logger):
     """Removes the word 'attributes' from the Pandas DataFrame's columns.
@@ -209,22 +234,306 @@ def response_to_json(ide_response, logger):
     logger.debug("[OK] - RESPONSE_TO_JSON")
     return json_response
 
-def get_ide_response(config_data, service, logger):
+def get_ide_response(config_data, service, logger, session = None):
     """Gets the response of subpesca's rest api service request based on the config data parameters.
 
     Args:
         config_data (dict): config.json parameters.
         service (str) : name of the arcgis service on the local config file.
+        session (requests.Session): Optional pooled HTTP session used to make the request.
 
     Returns:
         requests.models.Response.
     """
 
-    ide_response = requests.get(config_data["ide_subpesca"]["request_url"][service], headers = config_data["ide_subpesca"]["headers"])
+    http = session if session is not None else requests
+    ide_response = http.get(config_data["ide_subpesca"]["request_url"][service], headers = config_data["ide_subpesca"]["headers"])
     print("[OK] - ArcGIS rest API " + service + " service succesfully requested")
     logger.debug("[OK] - GET_IDE_RESPONSE FROM " + service.upper() + " SERVICE")
     return ide_response
 
+def fetch_ide_layer(config_data, service, session, logger, skip_unchanged = False):
+    """Downloads an IDE layer and transforms it to a Pandas DataFrame, measuring the elapsed time.
+
+    If the 'cache_dir' key of the 'ide_subpesca' config object is set, the layer is requested
+    conditionally through the on-disk HTTP cache.
+
+    Args:
+        config_data (dict): config.json parameters.
+        service (str): name of the arcgis service on the local config file.
+        session (requests.Session): Pooled HTTP session shared by the fetch workers.
+        skip_unchanged (bool): Don't decode the layer if its payload didn't change since the last run.
+
+    Returns:
+        tuple: (pandas.core.frame.DataFrame, float) layer DataFrame, or None if it was skipped, and seconds elapsed.
+    """
+
+    start = time.perf_counter()
+    cache_dir = config_data["ide_subpesca"].get("cache_dir")
+
+    if cache_dir is None:
+        ide_response = get_ide_response(config_data, service, logger, session)
+        json_response = response_to_json(ide_response, logger)
+    else:
+        status, content, changed = http_cache.cached_get(session,
+                                                         config_data["ide_subpesca"]["request_url"][service],
+                                                         cache_dir)
+        if status != 200:
+            raise ValueError("{} service returned HTTP status {}".format(service, status))
+
+        print("[OK] - ArcGIS rest API " + service + " service succesfully requested")
+        logger.debug("[OK] - GET_IDE_RESPONSE FROM " + service.upper() + " SERVICE")
+
+        if skip_unchanged and not changed:
+            return None, time.perf_counter() - start
+
+        json_response = json.loads(content)
+
+    df = json_to_df(json_response, logger)
+    elapsed = time.perf_counter() - start
+    return df, elapsed
+
+def create_http_session(config_data, pool_size):
+    """Creates a keep-alive HTTP session shared by the IDE fetch workers.
+
+    Args:
+        config_data (dict): config.json parameters.
+        pool_size (int): Maximum number of pooled connections to the IDE host.
+
+    Returns:
+        requests.Session.
+    """
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update(config_data["ide_subpesca"]["headers"])
+    return session
+
+def get_ide_dataframes(config_data, services, logger, loaded_services = ()):
+    """Downloads the given IDE layers concurrently on a bounded thread pool.
+
+    The number of workers is read from the optional 'max_workers' key of the
+    'ide_subpesca' config object and defaults to one worker per layer.
+
+    Args:
+        config_data (dict): config.json parameters.
+        services (list): names of the arcgis services on the local config file.
+        loaded_services (list): services already loaded on the mapstore database, which are
+            skipped if their cached payload didn't change.
+
+    Returns:
+        dict: service name -> pandas.core.frame.DataFrame, or None for the skipped layers.
+    """
+
+    max_workers = config_data["ide_subpesca"].get("max_workers", len(services))
+    ide_dfs = {}
+
+    with create_http_session(config_data, max_workers) as session:
+        with ThreadPoolExecutor(max_workers = max_workers) as executor:
+            futures = {executor.submit(fetch_ide_layer, config_data, service, session, logger,
+                                       service in loaded_services): service
+                       for service in services}
+
+            for future in as_completed(futures):
+                service = futures[future]
+                try:
+                    ide_dfs[service], elapsed = future.result()
+                except Exception as e:
+                    print("[ERROR] - Downloading " + service + " service")
+                    print(e)
+                    logger.error("[ERROR] - GET_IDE_DATAFRAMES FROM " + service.upper() + " SERVICE")
+                    sys.exit(2)
+
+                if ide_dfs[service] is None:
+                    print(f"[OK] - {service} layer unchanged, skipped in {elapsed:.2f} s")
+                    logger.debug(f"[OK] - GET_IDE_DATAFRAMES {service.upper()} UNCHANGED {elapsed:.2f} S")
+                else:
+                    print(f"[OK] - {service} layer downloaded in {elapsed:.2f} s")
+                    logger.debug(f"[OK] - GET_IDE_DATAFRAMES {service.upper()} {elapsed:.2f} S")
+
+    return ide_dfs
+
+def get_loaded_services(config_data, mapstore_engine):
+    """Gets the IDE services whose output table already exists on the mapstore database.
+
+    Args:
+        config_data (dict): config.json parameters.
+        mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+
+    Returns:
+        list.
+    """
+
+    inspector = inspect(mapstore_engine)
+    return [service for service, table_name in IDE_LAYERS.items()
+            if inspector.has_table(table_name, schema = config_data['mapstore']['schema'])]
+
+def get_ide_count(config_data, service, session, logger):
+    """Gets the number of features of an IDE layer with a 'returnCountOnly' request.
+
+    Args:
+        config_data (dict): config.json parameters.
+        service (str): name of the arcgis service on the local config file.
+        session (requests.Session): Pooled HTTP session.
+
+    Returns:
+        int.
+    """
+
+    count_response = session.get(config_data["ide_subpesca"]["request_url"][service],
+                                 params = {"returnCountOnly": "true"})
+    n_features = count_response.json()["count"]
+    print("[OK] - " + service + " service has " + str(n_features) + " features")
+    logger.debug("[OK] - GET_IDE_COUNT FROM " + service.upper() + " SERVICE")
+    return n_features
+
+def get_ide_oid_field(config_data, service, session, logger):
+    """Gets the object id field of an IDE layer, from the 'objectIdField' of the layer resource.
+
+    Args:
+        config_data (dict): config.json parameters.
+        service (str): name of the arcgis service on the local config file.
+        session (requests.Session): Pooled HTTP session.
+
+    Returns:
+        str.
+    """
+
+    # The layer resource is the query url without its '/query' operation
+    layer_url = config_data["ide_subpesca"]["request_url"][service].split("?")[0].rsplit("/query", 1)[0]
+    layer_json = session.get(layer_url, params = {"f": "json"}).json()
+
+    oid_field = layer_json.get("objectIdField")
+    if oid_field is None:
+        oid_field = next((field["name"] for field in layer_json.get("fields", []) if field["type"] == "esriFieldTypeOID"), "OBJECTID")
+
+    logger.debug("[OK] - GET_IDE_OID_FIELD FROM " + service.upper() + " SERVICE: " + oid_field)
+    return oid_field
+
+def get_ide_page(config_data, service, offset, n_records, session, logger, order_field = "OBJECTID"):
+    """Requests one page of features of an IDE layer and transforms it to a Pandas DataFrame.
+
+    The features are ordered by the object id, since ArcGIS doesn't keep the order of the
+    features between requests otherwise and the pages could repeat or skip features.
+
+    Args:
+        config_data (dict): config.json parameters.
+        service (str): name of the arcgis service on the local config file.
+        offset (int): Position of the first feature of the page ('resultOffset').
+        n_records (int): Number of features expected on the page ('resultRecordCount').
+        session (requests.Session): Pooled HTTP session.
+        order_field (str): Object id field of the layer ('orderByFields').
+
+    Returns:
+        pandas.core.frame.DataFrame.
+
+    Raises:
+        ValueError: the server returned less features than requested, i.e. its maxRecordCount
+        is lower than the configured page size.
+    """
+
+    page_response = session.get(config_data["ide_subpesca"]["request_url"][service],
+                                params = {"resultOffset": offset, "resultRecordCount": n_records, "orderByFields": order_field})
+    json_response = page_response.json()
+
+    if len(json_response["features"]) < n_records:
+        raise ValueError("Page at offset {} of {} service returned {} of {} features, lower the 'page_size'".format(
+            offset, service, len(json_response["features"]), n_records))
+
+    df = pd.json_normalize(json_response["features"])
+    logger.debug("[OK] - GET_IDE_PAGE FROM " + service.upper() + " SERVICE AT OFFSET " + str(offset))
+    return df
+
+def iter_ide_pages(config_data, service, session, logger):
+    """Yields the pages of an IDE layer in order, downloading up to 'page_workers' pages at once.
+
+    Only the pages in flight are kept in memory, so the peak memory is bounded by
+    'page_size' * 'page_workers' instead of the size of the whole layer.
+
+    Args:
+        config_data (dict): config.json parameters.
+        service (str): name of the arcgis service on the local config file.
+        session (requests.Session): Pooled HTTP session.
+
+    Yields:
+        pandas.core.frame.DataFrame.
+    """
+
+    page_size = config_data["ide_subpesca"]["page_size"]
+    page_workers = config_data["ide_subpesca"].get("page_workers", 1)
+    n_features = get_ide_count(config_data, service, session, logger)
+    order_field = config_data["ide_subpesca"].get("order_field") or get_ide_oid_field(config_data, service, session, logger)
+
+    with ThreadPoolExecutor(max_workers = page_workers) as executor:
+        pending = deque()
+
+        for offset in range(0, n_features, page_size):
+            n_records = min(page_size, n_features - offset)
+            pending.append(executor.submit(get_ide_page, config_data, service, offset, n_records, session, logger, order_field))
+
+            if len(pending) >= page_workers:
+                yield pending.popleft().result()
+
+        while pending:
+            yield pending.popleft().result()
+
+def ide_layer_to_db_paged(config_data, service, table_name, mapstore_engine, session, logger):
+    """Streams an IDE layer page by page through the transformation steps into the mapstore database.
+
+    The pages are loaded into a table of the 'PAGED_SCHEMA_SUFFIX' schema, which replaces the
+    layer's table in a single transaction once every page is loaded. If a page fails the
+    layer's table is left as it was, and a layer without features replaces it with an empty one.
+
+    Args:
+        config_data (dict): config.json parameters.
+        service (str): name of the arcgis service on the local config file.
+        table_name (str): Name of the output table on the mapstore's database.
+        mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        session (requests.Session): Pooled HTTP session.
+    """
+
+    start = time.perf_counter()
+    schema = config_data['mapstore']['schema']
+    paged_schema = schema + PAGED_SCHEMA_SUFFIX
+    n_pages = 0
+
+    try:
+        with mapstore_engine.begin() as con:
+            con.execute(text("CREATE SCHEMA IF NOT EXISTS " + paged_schema))
+
+        for page_df in iter_ide_pages(config_data, service, session, logger):
+            page_df = process_ide_df(page_df, logger)
+            df_to_db(page_df, config_data, mapstore_engine, table_name, logger,
+                     if_exists = 'replace' if n_pages == 0 else 'append', schema = paged_schema)
+            n_pages += 1
+
+        with mapstore_engine.begin() as con:
+            if n_pages == 0:
+                # Empty layer, its table keeps the columns of the previous load
+                con.execute(text("DROP TABLE IF EXISTS {paged}.{table}".format(paged = paged_schema, table = table_name)))
+                if con.execute(text("SELECT to_regclass(:table_name) IS NOT NULL"), {"table_name": schema + "." + table_name}).scalar():
+                    con.execute(text("CREATE TABLE {paged}.{table} (LIKE {schema}.{table})".format(
+                        paged = paged_schema, schema = schema, table = table_name)))
+                else:
+                    con.execute(text("CREATE TABLE {paged}.{table} (geom {geom})".format(
+                        paged = paged_schema, table = table_name, geom = Geometry().get_col_spec())))
+
+            con.execute(text("DROP TABLE IF EXISTS {schema}.{table}".format(schema = schema, table = table_name)))
+            con.execute(text("ALTER TABLE {paged}.{table} SET SCHEMA {schema}".format(
+                paged = paged_schema, schema = schema, table = table_name)))
+
+    except Exception as e:
+        print("[ERROR] - Downloading " + service + " service by pages")
+        print(e)
+        logger.error("[ERROR] - IDE_LAYER_TO_DB_PAGED FROM " + service.upper() + " SERVICE")
+        sys.exit(2)
+
+    elapsed = time.perf_counter() - start
+    print(f"[OK] - {service} layer copied in {n_pages} pages in {elapsed:.2f} s")
+    logger.debug(f"[OK] - IDE_LAYER_TO_DB_PAGED {service.upper()} {n_pages} PAGES {elapsed:.2f} S")
+
 def create_logger(log_file):
     """Create a logger based on the passed log file.
 
@@ -328,87 +637,84 @@ def main(argv):
     # Create the logger
     logger = create_logger(log_file)
 
-    # Get responses from arcgis rest services
-    centros_response = get_ide_response(config_data, "centros", logger)
-    areas_response = get_ide_response(config_data, "areas_colecta", logger)
-    ecmpo_response = get_ide_response(config_data, "ecmpo", logger)
-    amerb_response = get_ide_response(config_data, "amerb", logger)
-    acuiamerb_response = get_ide_response(config_data, "acui_en_amerb", logger)
-
-
-    # Tranform responses to dictionary
-    centros_json = response_to_json(centros_response, logger)
-    areas_json = response_to_json(areas_response, logger)
-    ecmpo_json = response_to_json(ecmpo_response, logger)
-    amerb_json = response_to_json(amerb_response, logger)
-    acuiamerb_json = response_to_json(acuiamerb_response, logger)
-
-    # Transform dictionarys to DataFrames
-    centros_df = json_to_df(centros_json, logger)
-    areas_df = json_to_df(areas_json, logger)
-    ecmpo_df = json_to_df(ecmpo_json, logger)
-    amerb_df = json_to_df(amerb_json, logger)
-    acuiamerb_df = json_to_df(acuiamerb_json, logger)
-    
-    # Rename DataFrame's columns
-    centros_df = rename_df_columns(centros_df, logger)
-    areas_df = rename_df_columns(areas_df, logger)
-    ecmpo_df = rename_df_columns(ecmpo_df, logger)
-    amerb_df = rename_df_columns(amerb_df, logger)
-    acuiamerb_df = rename_df_columns(acuiamerb_df, logger)
-
-    # Transform the list of list of coordinates to list of tuples
-    centros_df_coord_list = list_to_tuples(centros_df, logger)
-    areas_df_coord_list = list_to_tuples(areas_df, logger)
-    ecmpo_df_coord_list = list_to_tuples(ecmpo_df, logger)
-    amerb_df_coord_list = list_to_tuples(amerb_df, logger)
-    acuiamerb_coord_list = list_to_tuples(acuiamerb_df, logger)
-
-    # Append new column to DataFrame
-    centros_df = polygon_coords_to_df(centros_df, centros_df_coord_list, logger)
-    areas_df = polygon_coords_to_df(areas_df, areas_df_coord_list, logger)
-    ecmpo_df = polygon_coords_to_df(ecmpo_df, ecmpo_df_coord_list, logger)
-    amerb_df = polygon_coords_to_df(amerb_df, amerb_df_coord_list, logger)
-    acuiamerb_df = polygon_coords_to_df(acuiamerb_df, acuiamerb_coord_list, logger)
-
-    # Change format of the geometry column
-    centros_df = transform_geometry_column(centros_df, logger)
-    areas_df = transform_geometry_column(areas_df, logger)
-    ecmpo_df = transform_geometry_column(ecmpo_df, logger)
-    amerb_df = transform_geometry_column(amerb_df, logger)
-    acuiamerb_df = transform_geometry_column(acuiamerb_df, logger)
+    # Gets the shared sqlalchemy engine of the mapstore db
+    mapstore_engine = db_engine.get_engine(config_data, 'mapstore', logger)
 
-    # Drop the old geometry column
-    centros_df = drop_str_geometry(centros_df, logger)
-    areas_df = drop_str_geometry(areas_df, logger)
-    ecmpo_df = drop_str_geometry(ecmpo_df, logger)
-    amerb_df = drop_str_geometry(amerb_df, logger)
-    acuiamerb_df = drop_str_geometry(acuiamerb_df, logger)
+    skipped_services = []
+    changed_tables = {}
+
+    if "page_size" in config_data["ide_subpesca"]:
+        # Stream every layer page by page to the mapstore database
+        with create_http_session(config_data, config_data["ide_subpesca"].get("page_workers", 1)) as session:
+            for service, table_name in IDE_LAYERS.items():
+                ide_layer_to_db_paged(config_data, service, table_name, mapstore_engine, session, logger)
+
+        # The paged layers aren't fingerprinted, their previous fingerprint is no longer valid
+        fingerprint.delete_fingerprints(mapstore_engine, config_data['mapstore']['schema'], IDE_LAYERS.values())
+
+    else:
+        # Layers already on mapstore are skipped if their cached payload didn't change
+        loaded_services = []
+        if "cache_dir" in config_data["ide_subpesca"]:
+            loaded_services = get_loaded_services(config_data, mapstore_engine)
+
+        # Gets the fingerprint of the tables loaded on previous runs
+        fingerprints = fingerprint.get_fingerprints(mapstore_engine, config_data['mapstore']['schema'])
+
+        # Download the arcgis rest services concurrently and transform them to DataFrames
+        ide_dfs = get_ide_dataframes(config_data, list(IDE_LAYERS), logger, loaded_services)
+
+        for service, table_name in IDE_LAYERS.items():
+            if ide_dfs[service] is None:
+                skipped_services.append(service)
+                continue
+
+            # Rename the columns and transform the geometry of the DataFrame
+            df = process_ide_df(ide_dfs.pop(service), logger)
+
+            # Skip the layers whose content didn't change since their last load
+            df_fingerprint = fingerprint.df_fingerprint(df)
+            if fingerprints.get(table_name) == df_fingerprint:
+                skipped_services.append(service)
+                continue
+
+            # Copy the DataFrame to the mapstore database
+            df_to_db(df, config_data, mapstore_engine, table_name, logger)
+            changed_tables[table_name] = (df_fingerprint, len(df))
+
+        if "cache_dir" in config_data["ide_subpesca"]:
+            # Keep the cache folder under its size limit
+            n_evicted = http_cache.evict_cache(config_data["ide_subpesca"]["cache_dir"],
+                                               config_data["ide_subpesca"].get("cache_max_bytes", http_cache.CACHE_MAX_BYTES))
+            logger.debug("[OK] - EVICT_CACHE " + str(n_evicted) + " RESPONSES")
 
-    # Create string with the db mapstore parameters
-    mapstore_connection = create_mapstore_connection(config_data, logger)
+    # Index and analyze the copied tables
+    loaded_tables = [table_name for service, table_name in IDE_LAYERS.items() if service not in skipped_services]
+    index_manager.provision_indexes(mapstore_engine, config_data['mapstore']['schema'], loaded_tables, logger)
 
-    # Create sqlalchemy engine based on the mapstore db paramters
-    mapstore_engine = create_mapstore_engine(mapstore_connection, logger)
+    if skipped_services:
+        print("[OK] - Unchanged layers skipped: " + ", ".join(skipped_services))
+        logger.debug("[OK] - SKIPPED LAYERS: " + ", ".join(skipped_services).upper())
 
-    # Copy the DataFrame to the mapstore database
-    df_to_db(centros_df, config_data, mapstore_engine, "concesiones_acuicultura", logger)
-    df_to_db(areas_df, config_data, mapstore_engine, "areas_colecta", logger)
-    df_to_db(ecmpo_df, config_data, mapstore_engine, "ecmpo", logger)
-    df_to_db(amerb_df, config_data, mapstore_engine, "amerb", logger)
-    df_to_db(acuiamerb_df, config_data, mapstore_engine, "acuiamerb", logger)
+    if len(skipped_services) < len(IDE_LAYERS):
+        # Execute the SQL steps that change the column names of the IDE tables, in place or through the staging schema
+        staging_build.run_sql_file(mapstore_engine, "ide_layers_processing.sql", config_data, logger)
 
-    # Open the 'add_geometry_to_services.sql' file
-    geom_sql_query = open_sql_query("add_geometry_to_services.sql", logger)
+        if "tiles" in config_data:
+            # Regenerate the vector tiles that cover the changed features of the IDE layers
+            tile_cache.update_tiles(config_data, mapstore_engine, tile_cache.TILE_LAYERS["ide_layers_processing.sql"], logger)
 
-    # Execute the SQL query to transform the geometry type of the new tables
-    execute_sql_query(mapstore_engine, geom_sql_query, logger)
+    # Stores the fingerprint of the copied tables
+    fingerprint.save_fingerprints(mapstore_engine, config_data['mapstore']['schema'], changed_tables)
 
-    # Open the 'ide_layers_processing.sql' file
-    ide_process_sql_query = open_sql_query("ide_layers_processing.sql", logger)
+    if "cache_dir" in config_data["ide_subpesca"] and "page_size" not in config_data["ide_subpesca"]:
+        # Record the cached layers as loaded, so they're skipped while they don't change
+        for service in IDE_LAYERS:
+            http_cache.mark_loaded(config_data["ide_subpesca"]["cache_dir"],
+                                   config_data["ide_subpesca"]["request_url"][service])
 
-    # Execute the SQL query to change the column names of the IDE tables
-    execute_sql_query(mapstore_engine, ide_process_sql_query, logger)
+    # Reports the connections opened by the mapstore engine
+    db_engine.log_connect_stats(logger)
 
     end = datetime.now()
 
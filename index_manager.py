@@ -0,0 +1,176 @@
+import sys
+import os
+import re
+import time
+import hashlib
+import logging
+from sqlalchemy import text
+
+#python file with the dependency-aware runner of the SQL steps
+import sql_runner
+
+# Indexes of each generated table: GiST on the geometry and B-tree on the area, centro and date keys
+LAYER_INDEXES = {
+    # Layers of 'tables_processing.sql'
+    "capas_estaticas.centros_acuicultura": {"gist": ["geom"], "btree": ["codigocentro", "codigoarea"]},
+    "capas_estaticas.centros_psmb": {"gist": ["geom"], "btree": ["codigocentro", "codigoarea"]},
+    "capas_estaticas.centros_no_psmb": {"gist": ["geom"], "btree": ["codigocentro", "codigoarea"]},
+    "capas_estaticas.areas_psmb": {"gist": ["geom"], "btree": ["codigoarea", "fecha_est"]},
+    "capas_estaticas.bancos_psmb": {"gist": ["geom"], "btree": ["cd_psmb", "fecha_est"]},
+    "capas_estaticas.centros_tara": {"gist": ["geom"], "btree": ["codigocentro", "codigoarea", "fecha"]},
+    "capas_estaticas.areas_tara": {"gist": ["geom"], "btree": ["codigoarea", "fecha_max"]},
+    "capas_estaticas.centros_salmonidos": {"gist": ["geom"], "btree": ["codigocentro"]},
+    "capas_estaticas.areas_contingencia": {"gist": ["geom"], "btree": ["codigoarea"]},
+    "capas_estaticas.bancos_contingencia": {"gist": ["geom"], "btree": ["cd_psmb"]},
+    "capas_estaticas.centro_causal": {"gist": ["geom"], "btree": ["cod_centro"]},
+    # Layers of 'ide_layers_processing.sql'
+    "capas_estaticas.areas_colecta": {"gist": ["geom"], "btree": []},
+    "capas_estaticas.ecmpo": {"gist": ["geom"], "btree": []},
+    "capas_estaticas.amerb": {"gist": ["geom"], "btree": []},
+    "capas_estaticas.acuiamerb": {"gist": ["geom"], "btree": []},
+    # Layer of 'add_geometry_to_pred.sql'
+    "capas_estaticas.mrsat_pred": {"gist": ["geom"], "btree": ["area", "date"]},
+    # Input tables joined by the SQL files
+    "entradas.concesiones_acuicultura": {"gist": ["geom"], "btree": ["REP_SUBPESCA2.ADM_UOT.PULLINQUE4_T_ACUICULTURA.N_CODIGOCENTRO"]},
+    "entradas.areas_psmb": {"gist": [], "btree": ["Código Área"]},
+    "entradas.existencias_moluscos": {"gist": [], "btree": ["codigoCentro", "periodoInformado"]},
+    "entradas.existencias_salmonidos": {"gist": [], "btree": ["Cd_Centro"]},
+    "entradas.mrsat_pred": {"gist": [], "btree": ["area"]},
+    "entradas.mrsat_60days": {"gist": [], "btree": ["CodigoArea"]},
+    # Latest result per station of the 'ultimo_resultado' step and contingency tables of the 'toxicologia' step, replaced by area
+    "entradas.mrsat_ultimo_resultado": {"gist": [], "btree": ["cod_area"]},
+    "entradas.contingencia_estaciones": {"gist": [], "btree": ["cod_area"]},
+    "entradas.contingencia_causal": {"gist": [], "btree": ["cod_area"]}
+}
+
+
+def index_name(table_name, column_name, method):
+    """Gets the name of an index, unique on the schema and within the 63 characters of a Postgres identifier.
+
+    Args:
+        table_name (str): Name of the table, without schema.
+        column_name (str): Indexed column.
+        method (str): 'gist' or 'btree'.
+
+    Returns:
+        str
+    """
+
+    column_slug = re.sub(r"[^a-z0-9]+", "_", column_name.lower()).strip("_")
+    name = table_name + "_" + column_slug + "_" + method + "_idx"
+
+    if len(name) > 63:
+        column_hash = hashlib.md5(column_name.encode("utf8")).hexdigest()[:8]
+        name = table_name[:40] + "_" + column_hash + "_" + method + "_idx"
+
+    return name
+
+def create_index(con, schema, table_name, column_name, method):
+    """Creates an index if it doesn't exist, measuring its build time and size.
+
+    Args:
+        con (sqlalchemy.engine.base.Connection): Mapstore DB connection.
+        schema (str): Schema of the table.
+        table_name (str): Name of the table.
+        column_name (str): Indexed column.
+        method (str): 'gist' or 'btree'.
+
+    Returns:
+        tuple: (str, float, int) index name, seconds elapsed and size in bytes.
+    """
+
+    name = index_name(table_name, column_name, method)
+    start = time.perf_counter()
+    con.execute(text('CREATE INDEX IF NOT EXISTS {} ON {}.{} USING {} ("{}")'.format(
+        name, schema, table_name, method.upper(), column_name)))
+    elapsed = time.perf_counter() - start
+
+    size = con.execute(text("SELECT pg_relation_size(to_regclass(:index_name))"),
+                       {"index_name": schema + "." + name}).scalar()
+    return name, elapsed, size
+
+def get_table_columns(con, schema, table_name):
+    """Gets the columns of a table, or an empty set if it doesn't exist.
+
+    Args:
+        con (sqlalchemy.engine.base.Connection): Mapstore DB connection.
+        schema (str): Schema of the table.
+        table_name (str): Name of the table.
+
+    Returns:
+        set.
+    """
+
+    rows = con.execute(text("""
+        SELECT column_name
+        FROM information_schema.columns
+        WHERE table_schema = :schema AND table_name = :table_name"""),
+        {"schema": schema, "table_name": table_name})
+    return {column_name for column_name, in rows}
+
+def provision_indexes(db_engine, schema, tables, logger, declared_schema = None):
+    """Creates the declared indexes of the given tables, runs ANALYZE on them and reports the build time and size of each index.
+
+    Tables without declared indexes are only analyzed. Missing tables and columns are skipped.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        schema (str): Schema of the tables.
+        tables (list): Names of the tables, without schema.
+        declared_schema (str): Schema of the LAYER_INDEXES declarations, if the tables were
+            built on another one (e.g. a staging schema). Defaults to 'schema'.
+
+    Returns:
+        dict: index name -> (seconds elapsed, size in bytes).
+    """
+
+    declared_schema = declared_schema or schema
+    report = {}
+
+    with db_engine.begin() as con:
+        for table_name in tables:
+            columns = get_table_columns(con, schema, table_name)
+            if not columns:
+                continue
+
+            indexes = LAYER_INDEXES.get(declared_schema + "." + table_name, {})
+            for method in ("gist", "btree"):
+                for column_name in indexes.get(method, []):
+                    if column_name not in columns:
+                        logger.debug("[OK] - PROVISION_INDEXES " + table_name.upper() + " HAS NO COLUMN " + column_name.upper())
+                        continue
+
+                    name, elapsed, size = create_index(con, schema, table_name, column_name, method)
+                    report[name] = (elapsed, size)
+                    print(f"[OK] - {name} index built in {elapsed:.2f} s ({size / 1024:.0f} kB)")
+                    logger.debug(f"[OK] - PROVISION_INDEXES {name.upper()} {elapsed:.2f} S {size} BYTES")
+
+            con.execute(text("ANALYZE " + schema + "." + table_name))
+
+    print("[OK] - Indexes of " + str(len(tables)) + " tables successfully provisioned")
+    logger.debug("[OK] - PROVISION_INDEXES")
+    return report
+
+def main(argv):
+    # Usage: python3 index_manager.py config.json [schema.table ...]
+    if len(argv) < 2:
+        sys.exit("[ERROR] - Usage: python3 index_manager.py <config.json> [schema.table ...]")
+
+    config = sql_runner.get_config(argv[1])
+    if not os.path.exists(config["log_path"]):
+        os.makedirs(config["log_path"])
+    logging.basicConfig(filename = config["log_path"] + "/index_manager.log",
+                        format = '%(asctime)s %(message)s',
+                        filemode = 'a',
+                        level = logging.DEBUG)
+    logger = logging.getLogger()
+
+    mapstore_engine = sql_runner.create_mapstore_engine(config)
+    tables = argv[2:] or list(LAYER_INDEXES)
+
+    for table in tables:
+        schema, _, table_name = table.partition(".")
+        provision_indexes(mapstore_engine, schema, [table_name], logger)
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,168 @@
+from contextlib import contextmanager
+from sshtunnel import SSHTunnelForwarder
+from psycopg2.pool import ThreadedConnectionPool
+import psycopg2
+import psycopg2.pool
+import logging
+import threading
+
+
+# Tunel ssh y pool de conexiones compartidos por todo el proceso, de modo que las consultas
+# reutilizan conexiones ya autenticadas en vez de crear un tunel y una conexion cada vez
+_tunnel = None
+_pool = None
+_pool_port = None
+_lock = threading.Lock()
+
+
+# Funcion que verifica que el tunel ssh siga activo. Si no existe o se cayo, se vuelve a crear
+def get_tunnel(config):
+    global _tunnel
+    if _tunnel is not None:
+        try:
+            _tunnel.check_tunnels()
+            if _tunnel.is_active and all(_tunnel.tunnel_is_up.values()):
+                return _tunnel
+        except Exception as e:
+            logging.warning(f"No se pudo verificar el tunel ssh. Error: {str(e)}")
+        logging.warning("El tunel ssh no esta activo, se vuelve a crear")
+        stop_tunnel()
+
+    # Se crea el tunel ssh
+    _tunnel = SSHTunnelForwarder(
+        (config["ssh_ip"], config['ssh_port']),
+        ssh_username=config["ssh_username"],
+        ssh_password=config["ssh_password"],
+        remote_bind_address=(config["db_host"], config["db_port"]),
+        set_keepalive=config.get("ssh_keepalive", 30))
+    _tunnel.start()
+    logging.info("Se ha creado el tunel ssh")
+    return _tunnel
+
+
+# Funcion que cierra el tunel ssh
+def stop_tunnel():
+    global _tunnel
+    if _tunnel is not None:
+        try:
+            _tunnel.stop()
+        except Exception as e:
+            logging.warning(f"No se pudo cerrar el tunel ssh. Error: {str(e)}")
+        _tunnel = None
+        logging.info("Se ha cerrado el tunel ssh")
+
+
+# Funcion que retorna el pool de conexiones a la base de datos, directo o por el tunel ssh.
+# Si el tunel se volvio a crear, el pool se vuelve a crear con el nuevo puerto local del tunel
+def get_pool(config):
+    global _pool, _pool_port
+    with _lock:
+        # Si la bd esta en la misma maquina desde donde se hace la conexion no se usa tunel ssh
+        if config["is_local_db"] == 1:
+            port = config["db_port"]
+        else:
+            port = get_tunnel(config).local_bind_port
+
+        if _pool is None or _pool.closed or port != _pool_port:
+            close_pool()
+            _pool = ThreadedConnectionPool(
+                config.get("db_pool_min", 1), config.get("db_pool_max", 5),
+                host=config["db_host"], dbname=config["db_name"],
+                user=config["db_username"], password=config["db_password"], port=port)
+            _pool_port = port
+            logging.info("Se ha creado el pool de conexiones con la base de datos")
+        return _pool
+
+
+# Funcion que cierra todas las conexiones del pool
+def close_pool():
+    global _pool, _pool_port
+    if _pool is not None and not _pool.closed:
+        _pool.closeall()
+        logging.info("Se han cerrado las conexiones con la base de datos")
+    _pool = None
+    _pool_port = None
+
+
+# Funcion que verifica que una conexion del pool siga abierta
+def is_alive(conn):
+    if conn.closed:
+        return False
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+# Funcion que obtiene una conexion del pool, verificando antes que siga abierta. Si no lo esta, se descarta
+# y se vuelve a intentar. Si no se puede conectar, se vuelven a crear el pool y el tunel ssh, hasta 'db_retries' veces
+def get_connection(config):
+    retries = config.get("db_retries", 3)
+    for attempt in range(retries):
+        try:
+            pool = get_pool(config)
+            conn = pool.getconn()
+        except psycopg2.pool.PoolError:
+            # El pool no tiene conexiones disponibles ('db_pool_max')
+            raise
+        except Exception as e:
+            logging.warning(f"No se pudo obtener una conexion con la base de datos (intento {attempt + 1}). Error: {str(e)}")
+            with _lock:
+                close_pool()
+                if config["is_local_db"] != 1:
+                    stop_tunnel()
+            if attempt + 1 == retries:
+                raise
+            continue
+
+        if is_alive(conn):
+            return conn
+        logging.warning("Se descarta una conexion cerrada del pool")
+        pool.putconn(conn, close=True)
+    raise psycopg2.OperationalError("No se pudo obtener una conexion abierta con la base de datos")
+
+
+# Funcion que devuelve una conexion al pool. Con close=True la conexion se cierra en vez de reutilizarse
+def release_connection(conn, close=False):
+    with _lock:
+        pool = _pool
+    if pool is None or pool.closed:
+        if not conn.closed:
+            conn.close()
+        return
+    try:
+        pool.putconn(conn, close=close or bool(conn.closed))
+    except psycopg2.pool.PoolError:
+        # La conexion pertenece a un pool anterior, que se volvio a crear
+        if not conn.closed:
+            conn.close()
+
+
+# Funcion que entrega una conexion del pool dentro de un bloque with y la devuelve al terminar.
+# Si el bloque falla se deshace la transaccion, y si la conexion se perdio no se reutiliza
+@contextmanager
+def connection(config):
+    conn = get_connection(config)
+    try:
+        yield conn
+    except Exception:
+        try:
+            if not conn.closed:
+                conn.rollback()
+        except psycopg2.Error:
+            conn.close()
+        release_connection(conn)
+        raise
+    else:
+        release_connection(conn)
+
+
+# Funcion que cierra el pool de conexiones y el tunel ssh
+def close_all():
+    with _lock:
+        close_pool()
+        stop_tunnel()
@@ -1,8 +1,7 @@
-from sshtunnel import SSHTunnelForwarder
-import psycopg2
 import logging
 import sys
 from mailer_daemon import read_config_file
+import db_connection
 import os
 
 
@@ -13,56 +12,44 @@ def schema_table_create_if_not_exists(conn, schema, table):
     cursor.execute(f"CREATE SCHEMA IF NOT EXISTS {schema}")
     cursor.execute(
         f"CREATE TABLE IF NOT EXISTS {schema}.{table} (id serial PRIMARY KEY, codigoarea BIGINT, ultimo_estado VARCHAR(80))")
+    # Se eliminan los estados repetidos de un area, conservando el ultimo, y se crea el indice unico
+    # que usa mailer_daemon.py para actualizar los estados
+    cursor.execute(
+        f"DELETE FROM {schema}.{table} AS t USING {schema}.{table} AS d WHERE t.codigoarea = d.codigoarea AND t.id < d.id")
+    cursor.execute(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS {table}_codigoarea_idx ON {schema}.{table} (codigoarea)")
     conn.commit()
     cursor.close()
     return
 
-# Funcion que realiza la conexion a la base de datos por un tunel ssh
-# y crea el schema notificaciones y la tabla estados
-def create_if_not_exists_ssh_tunnel(config):
-    try:
-    # Se crea el tunel ssh
-        with SSHTunnelForwarder(
-            (config["ssh_ip"], config['ssh_port']),
-            ssh_username=config["ssh_username"],
-            ssh_password=config["ssh_password"],
-                remote_bind_address=(config["db_host"], config["db_port"])) as tunnel:
-            conn = False
-            try:
-                # Con el tunel ssh, se realiza la conexion a la base de datos
-                port = tunnel.local_bind_port
-                conn = psycopg2.connect(host=config["db_host"], dbname=config["db_name"],
-                                        user=config["db_username"], password=config["db_password"], port=port)
-                schema_table_create_if_not_exists(
-                        conn, "notificaciones", "estados")
-            except Exception as e:
-                logging.error(f"No se puede realizar la conexion con la base de datos. Error: {str(e)}")
-            finally:
-                # Se cierra la conexion
-                if conn:
-                    conn.close()
-                    logging.info("Se ha cerrado la conexion con la base de datos")
-    except Exception as e:
-        logging.error(f"No se ha podido crear el tunel ssh. Error: {str(e)}")
-
+# Funcion que crea la tabla de suscripciones si no existe. Cada fila suscribe un correo a un area, o a todas
+# las areas si codigoarea es nulo. El indice por codigoarea permite buscar los suscriptores de las areas que cambiaron
+def subscriptions_table_create_if_not_exists(conn, schema):
+    logging.info("Se crea la tabla 'suscripciones' si no existe")
+    cursor = conn.cursor()
+    cursor.execute(
+        f"CREATE TABLE IF NOT EXISTS {schema}.suscripciones (id serial PRIMARY KEY, email VARCHAR(254) NOT NULL, codigoarea BIGINT, nombre VARCHAR(120))")
+    cursor.execute(
+        f"CREATE UNIQUE INDEX IF NOT EXISTS suscripciones_email_codigoarea_idx ON {schema}.suscripciones (email, codigoarea)")
+    cursor.execute(
+        f"CREATE INDEX IF NOT EXISTS suscripciones_codigoarea_idx ON {schema}.suscripciones (codigoarea)")
+    conn.commit()
+    cursor.close()
+    return
 
-# Funcion que realiza la conexion a la base de datos por un tunel ssh
-# y crea el schema notificaciones y la tabla estados
+# Funcion que realiza la conexion a la base de datos, directa o por el tunel ssh de db_connection.py,
+# y crea el schema notificaciones y las tablas estados y suscripciones
 def create_if_not_exists(config):
-    conn = False
     try:
-        # Se realiza la conexion a la base de datos
-        conn = psycopg2.connect(host=config["db_host"], dbname=config["db_name"],
-                                user=config["db_username"], password=config["db_password"], port=config["db_port"])
-        schema_table_create_if_not_exists(
-                conn, "notificaciones", "estados")
+        with db_connection.connection(config) as conn:
+            schema_table_create_if_not_exists(
+                    conn, "notificaciones", "estados")
+            subscriptions_table_create_if_not_exists(conn, "notificaciones")
     except Exception as e:
         logging.error(f"No se puede realizar la conexion con la base de datos. Error: {str(e)}")
     finally:
-        # Se cierra la conexion
-        if conn:
-            conn.close()
-            logging.info("Se ha cerrado la conexion con la base de datos")
+        # Se cierran la conexion y el tunel ssh
+        db_connection.close_all()
 
 
 if __name__ == '__main__':
@@ -83,11 +70,7 @@ if __name__ == '__main__':
         logging.error("El archivo de configuracion no se leyo correctamente")
         sys.exit("El archivo de configuracion no se leyo correctamente")
     else:
-        # Si la bd esta en la misma maquina desde donde se hace la conexion no se usa tunel ssh
-        if config["is_local_db"] == 1:
-            create_if_not_exists(config)
-        # Si la bd esta en una maquina diferente desde donde se hace la conexion, es decir, se accede 
-        # externamente, se usa tunel ssh
-        else:
-            create_if_not_exists_ssh_tunnel(config)
+        # Si la bd esta en una maquina diferente desde donde se hace la conexion (is_local_db distinto de 1)
+        # db_connection.py se conecta por un tunel ssh
+        create_if_not_exists(config)
         
@@ -1,14 +1,18 @@
 import json
 import os
+import functools
+import queue
 import smtplib
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from jinja2 import Environment
-from sshtunnel import SSHTunnelForwarder
-import psycopg2
+from jinja2 import Environment, FileSystemLoader
 from psycopg2.extras import RealDictCursor
 import logging
+import select
 import sys
+import time
+import db_connection
 
 
 # Funcion que lee el archivo de configuracion con extension .json
@@ -26,156 +30,273 @@ def read_config_file(filename):
         return None
 
 
-# Funcion que realiza el envio de un correo con los datos obtenidos sobre los cambios de estado
-# en los valores de toxicidad
-def send_email(config, toxic_values):
-    logging.info("Comienza el envio de correos")
-    try:
-        dirname = os.path.dirname(__file__)
-        filepath = os.path.join(dirname, config["output_html"])
-        with open(filepath, "r") as f:
-            base_message = f.read()
-            f.close()
-            # Se completa el html con los datos obtenidos sobre los cambios de estado en los valores de 
-            # toxicidad 
-            message = MIMEText(
-                Environment().from_string(base_message).render(
-                    rows=toxic_values,
-                    link_visor=config["link_visor"],
-                    contacto=config["contacto"]
-                ), "html"
-            )
-
-            # Se configura el mensaje
-            msg = MIMEMultipart()
-            msg['From'] = config["smtp_username"]
-            msg['Subject'] = config["smtp_subject"]
-            msg.attach(message)
-            msg['To'] = config["to_email"]
-
-            # Se realiza la conexión con el servidor SMTP
-            mailserver = smtplib.SMTP(
-                config["smtp_server"], config["smtp_port"])
-            mailserver.ehlo()
-            mailserver.starttls()
-            mailserver.ehlo()
-            mailserver.login(config["smtp_username"],
-                             config["smtp_password"])
-            # Se envia el email
+# Funcion que compila una sola vez la plantilla html del correo, para renderizar con ella todos los correos
+@functools.lru_cache(maxsize=None)
+def get_template(output_html):
+    dirname = os.path.dirname(__file__)
+    return Environment(loader=FileSystemLoader(dirname)).get_template(output_html)
+
+
+# Funcion que arma el correo de un destinatario con los cambios de estado de sus areas
+def build_message(config, to_email, toxic_values):
+    # Se completa el html con los datos obtenidos sobre los cambios de estado en los valores de
+    # toxicidad
+    message = MIMEText(
+        get_template(config["output_html"]).render(
+            rows=toxic_values,
+            link_visor=config["link_visor"],
+            contacto=config["contacto"]
+        ), "html"
+    )
+
+    # Se configura el mensaje
+    msg = MIMEMultipart()
+    msg['From'] = config["smtp_username"]
+    msg['Subject'] = config["smtp_subject"]
+    msg.attach(message)
+    msg['To'] = to_email if isinstance(to_email, str) else ", ".join(to_email)
+    return msg
+
+
+# Funcion que realiza la conexión con el servidor SMTP
+def smtp_connect(config):
+    mailserver = smtplib.SMTP(
+        config["smtp_server"], config["smtp_port"], timeout=config.get("smtp_timeout", 30))
+    mailserver.ehlo()
+    if config.get("smtp_starttls", True):
+        mailserver.starttls()
+        mailserver.ehlo()
+    if config.get("smtp_password"):
+        mailserver.login(config["smtp_username"],
+                         config["smtp_password"])
+    return mailserver
+
+
+# Funcion que envia un correo con una conexion SMTP del pool, o una nueva si no hay disponibles.
+# Si el envio falla se descarta la conexion y se reintenta hasta 'smtp_retries' veces con una nueva
+def send_with_pool(config, pool, to_email, msg):
+    retries = config.get("smtp_retries", 3)
+    for attempt in range(retries):
+        mailserver = None
+        try:
+            try:
+                mailserver = pool.get_nowait()
+            except queue.Empty:
+                mailserver = smtp_connect(config)
             mailserver.sendmail(
-                config["smtp_username"], config["to_email"], msg.as_string())
-            logging.info(f"Se envio el correo a {config['to_email']}")
+                config["smtp_username"], to_email, msg.as_string())
+            pool.put(mailserver)
+            return
+        except Exception as e:
+            logging.warning(f"Fallo el envio del correo a {to_email} (intento {attempt + 1}). Error: {str(e)}")
+            if mailserver is not None:
+                mailserver.close()
+            if attempt + 1 == retries:
+                raise
+            time.sleep(config.get("smtp_retry_seconds", 2) * 2 ** attempt)
 
-            mailserver.quit()
 
-    except Exception as e:
-        logging.error(f"Se produjo un error al enviar el correo. Error: {str(e)}")
-        sys.exit("Se produjo un error al enviar el correo")
+# Funcion que realiza el envio de un correo a cada destinatario con los cambios de estado de sus areas.
+# Los correos se envian en paralelo en hasta 'smtp_workers' hilos, que reutilizan las conexiones SMTP.
+# Retorna los destinatarios cuyo correo no se pudo enviar
+def send_email(config, digests):
+    logging.info("Comienza el envio de correos")
+    pool = queue.Queue()
+    failed = []
+    try:
+        with ThreadPoolExecutor(max_workers=config.get("smtp_workers", 4)) as executor:
+            futures = {executor.submit(send_with_pool, config, pool, to_email,
+                                       build_message(config, to_email, toxic_values)): to_email
+                       for to_email, toxic_values in digests.items()}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    logging.info(f"Se envio el correo a {futures[future]}")
+                except Exception as e:
+                    logging.error(f"Se produjo un error al enviar el correo a {futures[future]}. Error: {str(e)}")
+                    failed.append(futures[future])
     finally:
+        # Se cierran las conexiones del pool
+        while not pool.empty():
+            mailserver = pool.get()
+            try:
+                mailserver.quit()
+            except Exception:
+                mailserver.close()
         logging.info("Ha finalizado el envio de correos")
 
+    return failed
+
+# Consulta que compara el estado actual de las areas con el ultimo estado registrado, actualiza los estados
+# y retorna las areas que cambiaron, en una unica operacion. Las areas nuevas se registran sin notificarse.
+# Con una lista de areas solo se revisan esas areas
+TOXIC_VALUES_DIFF = """
+    WITH actual AS (
+        SELECT DISTINCT ON (codigoarea) codigoarea, nombrearea, accion, causal
+        FROM capas_estaticas.areas_contingencia
+        WHERE %(areas)s::bigint[] IS NULL OR codigoarea = ANY(%(areas)s::bigint[])
+        ORDER BY codigoarea
+    ), previo AS (
+        SELECT codigoarea FROM notificaciones.estados
+        WHERE codigoarea IN (SELECT codigoarea FROM actual)
+    ), upsert AS (
+        INSERT INTO notificaciones.estados (codigoarea, ultimo_estado)
+        SELECT codigoarea, accion FROM actual
+        ON CONFLICT (codigoarea) DO UPDATE SET ultimo_estado = EXCLUDED.ultimo_estado
+        WHERE estados.ultimo_estado IS DISTINCT FROM EXCLUDED.ultimo_estado
+        RETURNING codigoarea
+    )
+    SELECT actual.nombrearea AS area_name, actual.codigoarea AS area_code, actual.accion AS value,
+           COALESCE(actual.causal::text, '-') AS causal
+    FROM upsert
+    JOIN previo ON previo.codigoarea = upsert.codigoarea
+    JOIN actual ON actual.codigoarea = upsert.codigoarea
+    ORDER BY actual.codigoarea"""
+
 # Funcion que revisa si existen cambios de estado en la toxicidad de las areas
-def find_toxic_values_rows(conn):
-    toxic_value = {}
-    results = []
+def find_toxic_values_rows(conn, areas=None):
     cursor = conn.cursor(cursor_factory=RealDictCursor)
-    # Se recorren todas las areas en la tabla areas_contingencia del esquema capas_estaticas
-    cursor.execute("""SELECT * FROM capas_estaticas.areas_contingencia""")
-    rows = cursor.fetchall()
-    for area_cont in rows:
-        # Cada area se busca en la tabla estados del esquema notificaciones
-        cursor.execute(
-            f"SELECT * FROM notificaciones.estados WHERE codigoarea = {area_cont['codigoarea']}")
-        area_est = cursor.fetchone()
-        # Si el area no existe en esta tabla, se inserta con su estado actual
-        if area_est == None:
-            cursor.execute(
-                f"INSERT INTO notificaciones.estados (codigoarea, ultimo_estado) VALUES({area_cont['codigoarea']}, '{area_cont['accion']}')")
-            conn.commit()
-        # Si el area existe en esta tabla, se consulta si el ultimo estado registrado es diferente al actual
-        # Si lo es, se agrega a la lista de resultados y se actualiza el ultimo estado en la base de datos
-        elif area_cont["accion"] != area_est["ultimo_estado"]:
-            toxic_value["area_name"] = area_cont["nombrearea"]
-            toxic_value["area_code"] = area_cont["codigoarea"]
-            toxic_value["value"] = area_cont["accion"]
-            toxic_value["causal"] = area_cont["causal"]
-            if toxic_value["causal"] == None:
-                toxic_value["causal"] = "-"
-            results.append(toxic_value)
-            toxic_value = {}
-            cursor.execute(
-                f"UPDATE notificaciones.estados SET ultimo_estado = '{area_cont['accion']}' WHERE codigoarea = {area_cont['codigoarea']}")
-            conn.commit()
+    # Se detectan los cambios y se actualizan los estados en una sola transaccion, por lo que la cantidad
+    # de consultas no depende de la cantidad de areas. Requiere el indice unico creado por init.py
+    cursor.execute(TOXIC_VALUES_DIFF, {"areas": areas})
+    results = [dict(row) for row in cursor.fetchall()]
+    conn.commit()
     cursor.close()
     return results
 
 
-# Funcion que realiza la conexion a la base de datos por un tunel ssh
-# y obtiene los datos datos sobre los cambios de estado en los valores de toxicidad
-def find_toxic_values_ssh_tunnel(config):
-    try:
-    # Se crea el tunel ssh
-        with SSHTunnelForwarder(
-            (config["ssh_ip"], config['ssh_port']),
-            ssh_username=config["ssh_username"],
-            ssh_password=config["ssh_password"],
-                remote_bind_address=(config["db_host"], config["db_port"])) as tunnel:
-            conn = False
-            try:
-                # Con el tunel ssh, se realiza la conexion a la base de datos
-                port = tunnel.local_bind_port
-                conn = psycopg2.connect(host=config["db_host"], dbname=config["db_name"],
-                                        user=config["db_username"], password=config["db_password"], port=port)
-                # Se buscan los cambios de estado en los valores de toxicidad
-                toxic_values = find_toxic_values_rows(conn)
-                logging.info("Se termino de ejecutar la busqueda de cambios de estados en valores toxicos")
-                return toxic_values
-            except Exception as e:
-                logging.error(f"No se puede realizar la conexion con la base de datos. Error: {str(e)}")
-                sys.exit("No se puede realizar la conexion con la base de datos")
-            finally:
-                # Se cierra la conexion
-                if conn:
-                    conn.close()
-                    logging.info("Se ha cerrado la conexion con la base de datos")
-    except Exception as e:
-        logging.error(f"No se ha podido crear el tunel ssh. Error: {str(e)}")
-        sys.exit("No se ha podido crear el tunel ssh")
+# Consulta que obtiene los suscriptores de las areas indicadas y de todas las areas (codigoarea nulo),
+# mediante el indice por codigoarea de la tabla suscripciones
+SUBSCRIBERS_QUERY = """
+    SELECT email, array_agg(codigoarea) FILTER (WHERE codigoarea IS NOT NULL) AS areas,
+           bool_or(codigoarea IS NULL) AS todas
+    FROM notificaciones.suscripciones
+    WHERE codigoarea = ANY(%(areas)s::bigint[]) OR codigoarea IS NULL
+    GROUP BY email"""
+
+# Funcion que arma los correos de cada destinatario: 'to_email' recibe todos los cambios y cada suscriptor
+# solo los de sus areas
+def find_digests(config, conn, areas=None):
+    toxic_values = find_toxic_values_rows(conn, areas)
+    digests = {}
+    if toxic_values == []:
+        return digests
+    if config.get("to_email"):
+        to_email = config["to_email"] if isinstance(config["to_email"], str) else tuple(config["to_email"])
+        digests[to_email] = toxic_values
+
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute("SELECT to_regclass('notificaciones.suscripciones') IS NOT NULL AS existe")
+    if cursor.fetchone()["existe"]:
+        cursor.execute(SUBSCRIBERS_QUERY, {"areas": [row["area_code"] for row in toxic_values]})
+        for subscriber in cursor.fetchall():
+            rows = [row for row in toxic_values
+                    if subscriber["todas"] or row["area_code"] in (subscriber["areas"] or [])]
+            digests.setdefault(subscriber["email"], rows)
+    conn.commit()
+    cursor.close()
+    return digests
 
 
-# Funcion que realiza la conexion a la base de datos por un tunel ssh
+# Funcion que obtiene una conexion del pool de db_connection.py, directa o por el tunel ssh,
 # y obtiene los datos datos sobre los cambios de estado en los valores de toxicidad
 def find_toxic_values(config):
-    conn = False
     try:
-        # Se realiza la conexion a la base de datos
-        conn = psycopg2.connect(host=config["db_host"], dbname=config["db_name"],
-                                user=config["db_username"], password=config["db_password"], port=config["db_port"])
-        # Se buscan los cambios de estado en los valores de toxicidad
-        toxic_values = find_toxic_values_rows(conn)
+        with db_connection.connection(config) as conn:
+            # Se buscan los cambios de estado en los valores de toxicidad y sus destinatarios
+            digests = find_digests(config, conn)
         logging.info("Se termino de ejecutar la busqueda de cambios de estados en valores toxicos")
-        return toxic_values
+        return digests
     except Exception as e:
         logging.error(f"No se puede realizar la conexion con la base de datos. Error: {str(e)}")
         sys.exit("No se puede realizar la conexion con la base de datos")
+
+# Funcion que obtiene las areas de las notificaciones recibidas. Retorna None si alguna notificacion
+# indica que se recalcularon todas las areas
+def read_notified_areas(conn):
+    areas = set()
+    all_areas = False
+    while conn.notifies:
+        notify = conn.notifies.pop(0)
+        if notify.payload in ("", "*"):
+            all_areas = True
+        else:
+            areas.update(int(area) for area in notify.payload.split(","))
+    if all_areas:
+        return None
+    return sorted(areas)
+
+
+# Funcion que revisa los cambios de estado de las areas indicadas y envia el correo si existen.
+# Si falla el envio a algun destinatario se registra en el log y se sigue escuchando
+def send_changes(config, conn, areas=None):
+    digests = find_digests(config, conn, areas)
+    if digests != {}:
+        failed = send_email(config, digests)
+        if failed:
+            logging.error(f"No se pudieron enviar los cambios de estado a: {', '.join(str(to_email) for to_email in failed)}")
+    else:
+        logging.info("No existen cambios en los estados de toxicidad en las areas revisadas")
+
+
+# Funcion que espera las notificaciones de generate_spatial_outputs.py con las areas recalculadas
+# y revisa solo esas areas, sobre una unica conexion que se mantiene abierta
+def listen_and_send(config, conn):
+    channel = config.get("listen_channel", "contingencia_areas")
+    conn.set_session(autocommit=True)
+    cursor = conn.cursor()
+    cursor.execute(f"LISTEN {channel}")
+    cursor.close()
+    logging.info(f"Se escuchan las notificaciones del canal {channel}")
+
+    # Se revisan todas las areas al comenzar, por los cambios ocurridos mientras no se escuchaba el canal
+    send_changes(config, conn)
+    while True:
+        # Las notificaciones que llegan durante las consultas de send_changes ya quedan en conn.notifies,
+        # por lo que solo se espera el canal si no hay ninguna pendiente. Cada 'listen_timeout' segundos
+        # sin notificaciones se revisa que la conexion siga abierta
+        if not conn.notifies:
+            select.select([conn], [], [], config.get("listen_timeout", 60))
+            conn.poll()
+        if conn.notifies:
+            areas = read_notified_areas(conn)
+            logging.info(f"Se recibio una notificacion de cambios en las areas: {'todas' if areas is None else areas}")
+            send_changes(config, conn, areas)
+
+
+# Funcion que mantiene una conexion del pool de db_connection.py mientras se escuchan las notificaciones.
+# Si la conexion se pierde se descarta y se obtiene otra despues de 'reconnect_seconds' segundos,
+# revisando tambien el tunel ssh
+def listen_forever(config):
+    try:
+        while True:
+            conn = None
+            try:
+                conn = db_connection.get_connection(config)
+                listen_and_send(config, conn)
+            except KeyboardInterrupt:
+                logging.info("Se detuvo la escucha de notificaciones")
+                return
+            except Exception as e:
+                logging.error(f"Se perdio la conexion con la base de datos. Error: {str(e)}")
+            finally:
+                # La conexion queda en modo autocommit y escuchando el canal, por lo que no se reutiliza
+                if conn is not None:
+                    db_connection.release_connection(conn, close=True)
+            time.sleep(config.get("reconnect_seconds", 30))
     finally:
-        # Se cierra la conexion
-        if conn:
-            conn.close()
-            logging.info("Se ha cerrado la conexion con la base de datos")
+        db_connection.close_all()
+
 
 # Funcion que obtiene los resultados y envia el correo si existen cambios de estados en los 
 # valores de toxicidad
 def check_and_send(config):
-    # Si la bd esta en la misma maquina desde donde se hace la conexion no se usa tunel ssh
-    if config["is_local_db"] == 1:
-        toxic_values = find_toxic_values(config)
-    # Si la bd esta en una maquina diferente desde donde se hace la conexion, es decir, se accede 
-    # externamente, se usa tunel ssh
-    else:
-        toxic_values = find_toxic_values_ssh_tunnel(config)
-    if toxic_values != []:
-        send_email(config, toxic_values)
+    # Si la bd esta en una maquina diferente desde donde se hace la conexion (is_local_db distinto de 1)
+    # db_connection.py se conecta por un tunel ssh
+    digests = find_toxic_values(config)
+    if digests != {}:
+        if send_email(config, digests):
+            sys.exit("Se produjo un error al enviar el correo")
     else:
         logging.info("No existen cambios en los estados de toxicidad en ningun area")
 
@@ -198,7 +319,15 @@ if __name__ == '__main__':
         logging.error("El archivo de configuracion no se leyo correctamente")
         sys.exit("El archivo de configuracion no se leyo correctamente")
     else:
+        # Con --listen se queda escuchando las notificaciones de cambios en la contingencia
+        if "--listen" in sys.argv:
+            listen_forever(config)
         # Si el archivo de configuracion se lee correctamente se buscan los cambios de estado
         # en los valores de toxicidad y se envia el correo
-        check_and_send(config)
+        else:
+            try:
+                check_and_send(config)
+            finally:
+                # Se cierran las conexiones y el tunel ssh
+                db_connection.close_all()
 
@@ -0,0 +1,346 @@
+import sys
+import os
+import time
+import logging
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy import column, func, literal_column, select, table
+
+#python file with the shared mapstore bulk loader
+import bulk_loader
+
+#python file with the dependency-aware runner of the SQL steps
+import sql_runner
+
+#python file with the partitioned mrSAT history
+import mrsat_history
+
+#python file with the shared database engines
+import db_engine
+
+# Metadata table of the mapstore database with the date ranges already loaded by the backfill
+CHECKPOINT_TABLE = "mrsat_backfill_checkpoint"
+
+
+def historic_query(config_data):
+    """Gets the select of the mrSAT 'historic_table'.
+
+    Args:
+        config_data (dict): config.json parameters.
+
+    Returns:
+        sqlalchemy.sql.expression.Select
+    """
+
+    historic_table = table(config_data['mrsat']['historic_table'], schema = config_data['mrsat']['schema'])
+    return select(literal_column('*')).select_from(historic_table)
+
+def create_mrsat_engine(config_data):
+    """Gets the mrSAT sqlalchemy engine of the current process.
+
+    Each worker process creates its engine on its first range and reuses it on the next ones.
+
+    Args:
+        config_data (dict): config.json parameters.
+
+    Returns:
+        sqlalchemy.engine.base.Engine
+    """
+
+    return db_engine.get_engine(config_data, 'mrsat', logging.getLogger())
+
+def get_historic_range(config_data, mrsat_engine):
+    """Gets the first and last 'FechaExtraccion' of the mrSAT 'historic_table'.
+
+    Args:
+        config_data (dict): config.json parameters.
+        mrsat_engine (sqlalchemy.engine.base.Engine): mrSAT DB sqlalchemy engine.
+
+    Returns:
+        tuple: (datetime.datetime, datetime.datetime)
+    """
+
+    historic_table = table(config_data['mrsat']['historic_table'], column('FechaExtraccion'), schema = config_data['mrsat']['schema'])
+    with mrsat_engine.connect() as con:
+        return con.execute(select(func.min(historic_table.c.FechaExtraccion), func.max(historic_table.c.FechaExtraccion))).one()
+
+def split_ranges(first_date, last_date, interval):
+    """Splits a period into the date ranges of the history partitions.
+
+    Args:
+        first_date (datetime.datetime): First date of the period.
+        last_date (datetime.datetime): Last date of the period, included.
+        interval (str): 'month', 'week' or 'day' partitions.
+
+    Returns:
+        list: (start, end) of each range, with the end excluded.
+    """
+
+    ranges = []
+    start, end = mrsat_history.partition_bounds(first_date, interval)
+    while start <= last_date:
+        ranges.append((start, end))
+        start, end = mrsat_history.partition_bounds(end, interval)
+    return ranges
+
+def get_finished_ranges(db_engine, schema):
+    """Gets the date ranges already loaded by a previous backfill, creating the checkpoint table if it doesn't exist.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        schema (str): Schema of the checkpoint table.
+
+    Returns:
+        set: (start, end) of each loaded range.
+    """
+
+    with db_engine.begin() as con:
+        con.execute(text("""
+            CREATE TABLE IF NOT EXISTS {schema}.{table} (
+                range_start timestamp PRIMARY KEY,
+                range_end timestamp NOT NULL,
+                n_rows bigint,
+                elapsed double precision,
+                loaded_at timestamp NOT NULL DEFAULT now()
+            )""".format(schema = schema, table = CHECKPOINT_TABLE)))
+
+        rows = con.execute(text("SELECT range_start, range_end FROM {}.{}".format(schema, CHECKPOINT_TABLE)))
+        return {(range_start, range_end) for range_start, range_end in rows}
+
+def save_checkpoint(db_engine, schema, range_start, range_end, n_rows, elapsed):
+    """Stores a loaded date range, so a resumed backfill skips it.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        schema (str): Schema of the checkpoint table.
+        range_start (datetime.datetime): Start of the range.
+        range_end (datetime.datetime): End of the range, excluded.
+        n_rows (int): Loaded records.
+        elapsed (float): Seconds elapsed.
+    """
+
+    with db_engine.begin() as con:
+        con.execute(text("""
+            INSERT INTO {schema}.{table} (range_start, range_end, n_rows, elapsed, loaded_at)
+            VALUES (:range_start, :range_end, :n_rows, :elapsed, now())
+            ON CONFLICT (range_start) DO UPDATE
+            SET range_end = EXCLUDED.range_end,
+                n_rows = EXCLUDED.n_rows,
+                elapsed = EXCLUDED.elapsed,
+                loaded_at = EXCLUDED.loaded_at
+            """.format(schema = schema, table = CHECKPOINT_TABLE)),
+            {"range_start": range_start, "range_end": range_end, "n_rows": n_rows, "elapsed": elapsed})
+
+def prepare_partitions(config_data, mrsat_engine, mapstore_engine, ranges, logger):
+    """Creates the history table and the partitions of every range before the workers start.
+
+    The workers then load straight into their own partitions, so they don't wait for each
+    other on the locks of the partitioned table. A new history table takes the column types
+    of the mrSAT 'historic_table' metadata.
+
+    Args:
+        config_data (dict): config.json parameters.
+        mrsat_engine (sqlalchemy.engine.base.Engine): mrSAT DB sqlalchemy engine.
+        mapstore_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        ranges (list): (start, end) of each range to load.
+
+    Returns:
+        dict: column name -> DDL type of the history table.
+    """
+
+    schema = config_data['mapstore']['schema']
+    interval = config_data['mrsat'].get('partition_interval', 'week')
+
+    with mrsat_engine.connect() as con:
+        types = bulk_loader.reflect_column_types(con, config_data['mrsat']['historic_table'], config_data['mrsat']['schema'])
+
+    with mapstore_engine.begin() as con:
+        mrsat_history.create_history_table(con, mapstore_engine, schema, types = types)
+        # Up to the end of the last range, which an existing partition of a shorter interval may not reach
+        mrsat_history.create_partitions(con, schema, ranges[0][0], ranges[-1][1] - timedelta(microseconds = 1), interval, logger)
+        return bulk_loader.reflect_column_types(con, mrsat_history.HISTORY_TABLE, schema)
+
+def get_range_partitions(con, schema, range_start, range_end):
+    """Gets the partitions that cover a date range, with the part of the range each one covers.
+
+    The partitions may have another interval than the ranges, e.g. the ones created by the
+    hourly sync with another 'partition_interval'.
+
+    Args:
+        con (sqlalchemy.engine.base.Connection): Mapstore DB connection.
+        schema (str): Schema of the history table.
+        range_start (datetime.datetime): Start of the range.
+        range_end (datetime.datetime): End of the range, excluded.
+
+    Returns:
+        list: (name, start, end, overlap start, overlap end) of each partition.
+
+    Raises:
+        ValueError: part of the range isn't covered by any partition.
+    """
+
+    overlaps = [(name, start, end, max(start, range_start), min(end, range_end))
+                for name, start, end in mrsat_history.get_partitions(con, schema)
+                if start < range_end and end > range_start]
+
+    covered = sum((overlap_end - overlap_start for _, _, _, overlap_start, overlap_end in overlaps), timedelta())
+    if covered != range_end - range_start:
+        raise ValueError("The history partitions don't cover the range {:%Y-%m-%d} - {:%Y-%m-%d}".format(range_start, range_end))
+
+    return overlaps
+
+def load_range(config_data, range_start, range_end, types):
+    """Replaces the records of a date range of the history with the ones of the mrSAT 'historic_table', on a worker process.
+
+    Each partition of the range is truncated if the range covers it whole, or else only its
+    records of the range are deleted, and the records are copied in chunks on a single transaction.
+
+    Args:
+        config_data (dict): config.json parameters.
+        range_start (datetime.datetime): Start of the range.
+        range_end (datetime.datetime): End of the range, excluded.
+        types (dict): column name -> DDL type of the history table.
+
+    Returns:
+        tuple: (datetime.datetime, datetime.datetime, int, float) range, loaded records and seconds elapsed.
+    """
+
+    start = time.perf_counter()
+    schema = config_data['mapstore']['schema']
+    chunk_size = config_data['mrsat'].get('chunk_size', bulk_loader.COPY_CHUNK_SIZE)
+
+    mrsat_engine = create_mrsat_engine(config_data)
+    mapstore_engine = sql_runner.create_mapstore_engine(config_data)
+    quote = mapstore_engine.dialect.identifier_preparer.quote
+    n_rows = 0
+
+    # The pooled connections of the engines are reused by the next range of the worker
+    with mrsat_engine.connect() as mrsat_con, mapstore_engine.begin() as con:
+        overlaps = get_range_partitions(con, schema, range_start, range_end)
+        cursor = con.connection.cursor()
+
+        for name, partition_start, partition_end, overlap_start, overlap_end in overlaps:
+            partition = schema + "." + name
+            if (partition_start, partition_end) == (overlap_start, overlap_end):
+                con.execute(text("TRUNCATE " + partition))
+            else:
+                # The rest of the partition belongs to other ranges
+                con.execute(text('DELETE FROM ' + partition + ' WHERE "FechaExtraccion" >= :overlap_start AND "FechaExtraccion" < :overlap_end'),
+                            {"overlap_start": overlap_start, "overlap_end": overlap_end})
+
+            query = historic_query(config_data).where(column('FechaExtraccion') >= overlap_start).where(column('FechaExtraccion') < overlap_end)
+            for chunk in pd.read_sql(query, mrsat_con, chunksize = chunk_size):
+                chunk = bulk_loader.match_column_types(chunk, types)
+                bulk_loader.copy_rows(cursor, chunk, partition, ', '.join(quote(col) for col in chunk.columns))
+                n_rows += len(chunk)
+
+        cursor.close()
+
+    with mapstore_engine.begin() as con:
+        for name, _, _, _, _ in overlaps:
+            con.execute(text("ANALYZE " + schema + "." + name))
+
+    return range_start, range_end, n_rows, time.perf_counter() - start
+
+def backfill(config_data, first_date, last_date, logger, restart = False):
+    """Loads the mrSAT 'historic_table' into the history partitions, with one date range per worker process.
+
+    Ranges finished by a previous backfill are skipped unless 'restart' is set. Each range
+    is checkpointed as soon as it's loaded, so an interrupted backfill can be resumed.
+
+    Args:
+        config_data (dict): config.json parameters.
+        first_date (datetime.datetime): First date to load, the first one of the table by default.
+        last_date (datetime.datetime): Last date to load, the last one of the table by default.
+        restart (bool): Load again the ranges of the previous backfills.
+
+    Returns:
+        int: number of loaded records.
+    """
+
+    schema = config_data['mapstore']['schema']
+    interval = config_data['mrsat'].get('partition_interval', 'week')
+    workers = config_data['mrsat'].get('backfill_workers', 4)
+
+    mrsat_engine = create_mrsat_engine(config_data)
+    mapstore_engine = sql_runner.create_mapstore_engine(config_data)
+
+    if first_date is None or last_date is None:
+        historic_first, historic_last = get_historic_range(config_data, mrsat_engine)
+        first_date, last_date = first_date or historic_first, last_date or historic_last
+
+    if first_date is None:
+        print("[OK] - The mrSAT historic table is empty")
+        return 0
+
+    ranges = split_ranges(pd.Timestamp(first_date).to_pydatetime(), pd.Timestamp(last_date).to_pydatetime(), interval)
+    finished = set() if restart else get_finished_ranges(mapstore_engine, schema)
+    pending = [date_range for date_range in ranges if date_range not in finished]
+    print("[OK] - " + str(len(pending)) + " of " + str(len(ranges)) + " date ranges to load")
+
+    if not pending:
+        return 0
+
+    types = prepare_partitions(config_data, mrsat_engine, mapstore_engine, pending, logger)
+    mrsat_engine.dispose()
+
+    start = time.perf_counter()
+    total_rows = 0
+    failed = False
+
+    with ProcessPoolExecutor(max_workers = workers) as executor:
+        futures = [executor.submit(load_range, config_data, range_start, range_end, types) for range_start, range_end in pending]
+
+        for future in as_completed(futures):
+            try:
+                range_start, range_end, n_rows, elapsed = future.result()
+            except Exception as e:
+                print('[ERROR] - Loading a date range of the mrSAT history')
+                print(e)
+                logger.error('[ERROR] - LOAD_RANGE')
+                failed = True
+                continue
+
+            save_checkpoint(mapstore_engine, schema, range_start, range_end, n_rows, elapsed)
+            total_rows += n_rows
+            rows_sec = n_rows / elapsed if elapsed > 0 else float(n_rows)
+            print(f"[OK] - {range_start:%Y-%m-%d} - {range_end:%Y-%m-%d}: {n_rows} rows in {elapsed:.2f} s ({rows_sec:.0f} rows/s)")
+            logger.debug(f"[OK] - LOAD_RANGE {range_start:%Y%m%d} {n_rows} ROWS {rows_sec:.0f} ROWS/S")
+
+    elapsed = time.perf_counter() - start
+    db_engine.log_connect_stats(logger)
+    print(f"[OK] - {total_rows} mrSAT records backfilled in {elapsed:.2f} s ({total_rows / elapsed:.0f} rows/s)")
+    logger.debug("[OK] - BACKFILL")
+
+    if failed:
+        print("[ERROR] - Some date ranges failed, run the backfill again to resume them")
+        sys.exit(2)
+
+    return total_rows
+
+def main(argv):
+    # Usage: python3 mrsat_backfill.py config.json [first_date last_date] [restart]
+    if len(argv) < 2:
+        sys.exit("[ERROR] - Usage: python3 mrsat_backfill.py <config.json> [YYYY-MM-DD YYYY-MM-DD] [restart]")
+
+    config = sql_runner.get_config(argv[1])
+    if not config['mrsat'].get('historic_table'):
+        sys.exit("[ERROR] - The 'historic_table' of the mrsat config object is required")
+
+    if not os.path.exists(config["log_path"]):
+        os.makedirs(config["log_path"])
+    logging.basicConfig(filename = config["log_path"] + "/mrsat_backfill.log",
+                        format = '%(asctime)s %(message)s',
+                        filemode = 'a',
+                        level = logging.DEBUG)
+    logger = logging.getLogger()
+
+    dates = [datetime.strptime(arg, "%Y-%m-%d") for arg in argv[2:] if arg != "restart"]
+    first_date, last_date = (dates + [None, None])[:2]
+
+    backfill(config, first_date, last_date, logger, restart = "restart" in argv[2:])
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,337 @@
+import sys
+import os
+import re
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import text
+
+#python file with the shared mapstore bulk loader
+import bulk_loader
+
+#python file with the dependency-aware runner of the SQL steps
+import sql_runner
+
+#python file with the index declarations of the output layers
+import index_manager
+
+# History of the mrSAT records on the mapstore DB, range partitioned by 'FechaExtraccion', and view with its last days
+HISTORY_TABLE = "mrsat_historia"
+WINDOW_VIEW = "mrsat_60days"
+
+# Columns indexed on every partition, since Postgres 10 doesn't create the indexes of the partitioned table on its partitions
+PARTITION_INDEX_COLUMNS = ["FechaExtraccion", "CodigoArea"]
+
+PARTITION_BOUNDS = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def partition_bounds(date, interval = "week"):
+    """Gets the bounds of the partition of a date.
+
+    Args:
+        date (datetime.datetime): Date inside the partition.
+        interval (str): 'month', 'week' (starting on monday) or 'day'.
+
+    Returns:
+        tuple: (datetime.datetime, datetime.datetime) start, included, and end, excluded.
+    """
+
+    day = datetime(date.year, date.month, date.day)
+
+    if interval == "month":
+        start = day.replace(day = 1)
+        end = (start + timedelta(days = 32)).replace(day = 1)
+    elif interval == "week":
+        start = day - timedelta(days = day.weekday())
+        end = start + timedelta(days = 7)
+    elif interval == "day":
+        start = day
+        end = start + timedelta(days = 1)
+    else:
+        raise ValueError("Unknown partition interval: " + interval)
+
+    return start, end
+
+def partition_name(start):
+    """Gets the name of the partition that starts on a date.
+
+    Args:
+        start (datetime.datetime): Start of the partition.
+
+    Returns:
+        str
+    """
+
+    return HISTORY_TABLE + "_" + start.strftime("%Y%m%d")
+
+def table_exists(con, schema, table_name):
+    """Checks if a table or view exists.
+
+    Args:
+        con (sqlalchemy.engine.base.Connection): Mapstore DB connection.
+        schema (str): Schema of the table.
+        table_name (str): Name of the table.
+
+    Returns:
+        bool.
+    """
+
+    return con.execute(text("SELECT to_regclass(:table_name) IS NOT NULL"),
+                       {"table_name": schema + "." + table_name}).scalar()
+
+def get_partitions(con, schema):
+    """Gets the partitions of the history table with their bounds, ordered by start.
+
+    Args:
+        con (sqlalchemy.engine.base.Connection): Mapstore DB connection.
+        schema (str): Schema of the history table.
+
+    Returns:
+        list: (name, start, end) of each partition.
+    """
+
+    if not table_exists(con, schema, HISTORY_TABLE):
+        return []
+
+    rows = con.execute(text("""
+        SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+        FROM pg_inherits
+        JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(:history_table)"""),
+        {"history_table": schema + "." + HISTORY_TABLE})
+
+    partitions = []
+    for name, bounds in rows:
+        start, end = PARTITION_BOUNDS.search(bounds).groups()
+        partitions.append((name, datetime.fromisoformat(start), datetime.fromisoformat(end)))
+
+    return sorted(partitions, key = lambda partition: partition[1])
+
+def create_history_table(con, db_engine, schema, df = None, types = None):
+    """Creates the partitioned history table, if it doesn't exist.
+
+    The column types are the given ones, e.g. from the metadata of the mrSAT table, or else
+    the ones inferred from a mrSAT DataFrame.
+
+    Args:
+        con (sqlalchemy.engine.base.Connection): Mapstore DB connection.
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        schema (str): Schema of the history table.
+        df (pandas.core.frame.DataFrame): mrSAT records.
+        types (dict): column name -> DDL type.
+    """
+
+    quote = db_engine.dialect.identifier_preparer.quote
+    if types is None:
+        types = bulk_loader.column_types(df, db_engine, {"FechaExtraccion": "TIMESTAMP WITHOUT TIME ZONE"})
+    ddl = ', '.join(quote(column) + ' ' + col_type for column, col_type in types.items())
+
+    con.execute(text('CREATE TABLE IF NOT EXISTS ' + schema + '.' + HISTORY_TABLE + ' (' + ddl + ') '
+                     'PARTITION BY RANGE ("FechaExtraccion")'))
+
+def create_partitions(con, schema, first_date, last_date, interval, logger):
+    """Creates the missing partitions between two dates, together with their indexes.
+
+    Dates already covered by a partition, even one of another interval, are skipped, and the
+    new partitions are shortened so they don't overlap the existing ones.
+
+    Args:
+        con (sqlalchemy.engine.base.Connection): Mapstore DB connection.
+        schema (str): Schema of the history table.
+        first_date (datetime.datetime): First date to cover.
+        last_date (datetime.datetime): Last date to cover.
+        interval (str): 'month', 'week' or 'day'.
+
+    Returns:
+        list: names of the created partitions.
+    """
+
+    partitions = get_partitions(con, schema)
+    created = []
+    date = first_date
+
+    while date <= last_date:
+        covering = [end for _, start, end in partitions if start <= date < end]
+        if covering:
+            date = covering[0]
+            continue
+
+        # The bounds are clipped to the existing partitions of another interval around the date
+        start, end = partition_bounds(date, interval)
+        start = max([start] + [existing_end for _, _, existing_end in partitions if start < existing_end <= date])
+        end = min([end] + [existing_start for _, existing_start, _ in partitions if date < existing_start < end])
+        name = partition_name(start)
+        con.execute(text("CREATE TABLE {schema}.{name} PARTITION OF {schema}.{history} "
+                         "FOR VALUES FROM ('{start}') TO ('{end}')".format(
+                             schema = schema, name = name, history = HISTORY_TABLE, start = start, end = end)))
+
+        for column_name in PARTITION_INDEX_COLUMNS:
+            index_manager.create_index(con, schema, name, column_name, "btree")
+
+        logger.debug("[OK] - CREATE_PARTITIONS " + name.upper())
+        created.append(name)
+        date = end
+
+    if created:
+        print("[OK] - " + str(len(created)) + " mrSAT history partitions created")
+    return created
+
+def get_high_water_mark(db_engine, schema):
+    """Gets the latest 'FechaExtraccion' of the history table, or None if it doesn't exist or is empty.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        schema (str): Schema of the history table.
+
+    Returns:
+        datetime.datetime
+    """
+
+    with db_engine.connect() as con:
+        if not table_exists(con, schema, HISTORY_TABLE):
+            return None
+        return con.execute(text('SELECT MAX("FechaExtraccion") FROM ' + schema + '.' + HISTORY_TABLE)).scalar()
+
+def get_refresh_start(db_engine, schema, since):
+    """Gets the start of the partition that contains a date, so the refresh replaces whole partitions.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        schema (str): Schema of the history table.
+        since (datetime.datetime): First date to refresh.
+
+    Returns:
+        datetime.datetime: the date itself if no partition contains it.
+    """
+
+    with db_engine.connect() as con:
+        partitions = get_partitions(con, schema)
+
+    for _, start, end in partitions:
+        if start <= since < end:
+            return start
+    return since
+
+def replace_partitions(df, db_engine, schema, refresh_start, interval, logger):
+    """Replaces the partitions of the history table from a date with the given records, in a single transaction.
+
+    The refreshed partitions are truncated instead of deleting their rows, so they're left
+    without dead tuples. The missing partitions are created first.
+
+    Args:
+        df (pandas.core.frame.DataFrame): mrSAT records with 'FechaExtraccion' >= refresh_start.
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        schema (str): Schema of the history table.
+        refresh_start (datetime.datetime): Start of the refreshed partitions. With None every partition is replaced.
+        interval (str): 'month', 'week' or 'day' partitions.
+
+    Returns:
+        list: names of the refreshed partitions.
+    """
+
+    quote = db_engine.dialect.identifier_preparer.quote
+    columns = ', '.join(quote(column) for column in df.columns)
+
+    with db_engine.begin() as con:
+        create_history_table(con, db_engine, schema, df)
+
+        # The records are cast to the types of the existing table, e.g. an integer column with nulls read as float
+        df = bulk_loader.match_column_types(df, bulk_loader.reflect_column_types(con, HISTORY_TABLE, schema))
+
+        if len(df):
+            create_partitions(con, schema, df["FechaExtraccion"].min(), df["FechaExtraccion"].max(), interval, logger)
+
+        refreshed = [name for name, start, _ in get_partitions(con, schema)
+                     if refresh_start is None or start >= refresh_start]
+        if refreshed:
+            con.execute(text("TRUNCATE " + ", ".join(schema + "." + name for name in refreshed)))
+
+        # The rows are routed to their partition by the COPY into the partitioned table
+        cursor = con.connection.cursor()
+        bulk_loader.copy_rows(cursor, df, schema + "." + HISTORY_TABLE, columns)
+        cursor.close()
+
+    with db_engine.begin() as con:
+        for name in refreshed:
+            con.execute(text("ANALYZE " + schema + "." + name))
+
+    print("[OK] - " + str(len(df)) + " mrSAT records loaded into " + str(len(refreshed)) + " history partitions")
+    logger.debug("[OK] - REPLACE_PARTITIONS")
+    return refreshed
+
+def create_window_view(db_engine, schema, window_start, logger):
+    """Creates the 'mrsat_60days' view with the history records since a date, replacing the table of the other sync modes.
+
+    The start of the window is written as a constant, so the partitions before it are
+    pruned when the query is planned, also on Postgres 10.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        schema (str): Schema of the history table.
+        window_start (datetime.datetime): First 'FechaExtraccion' of the window.
+    """
+
+    with db_engine.begin() as con:
+        relkind = con.execute(text("SELECT relkind FROM pg_class WHERE oid = to_regclass(:view_name)"),
+                              {"view_name": schema + "." + WINDOW_VIEW}).scalar()
+        if relkind is not None and relkind != "v":
+            con.execute(text("DROP TABLE " + schema + "." + WINDOW_VIEW))
+
+        con.execute(text("CREATE OR REPLACE VIEW {schema}.{view} AS "
+                         "SELECT * FROM {schema}.{history} WHERE \"FechaExtraccion\" >= TIMESTAMP '{window_start}'".format(
+                             schema = schema, view = WINDOW_VIEW, history = HISTORY_TABLE,
+                             window_start = window_start.replace(microsecond = 0))))
+
+    print("[OK] - " + WINDOW_VIEW + " view starts on " + str(window_start.replace(microsecond = 0)))
+    logger.debug("[OK] - CREATE_WINDOW_VIEW")
+
+def drop_old_partitions(db_engine, schema, retention_days, logger):
+    """Drops the partitions whose records are all older than the retention days.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        schema (str): Schema of the history table.
+        retention_days (int): Days of history kept.
+
+    Returns:
+        list: names of the dropped partitions.
+    """
+
+    cutoff = datetime.now() - timedelta(days = retention_days)
+
+    with db_engine.begin() as con:
+        dropped = [name for name, _, end in get_partitions(con, schema) if end <= cutoff]
+        for name in dropped:
+            con.execute(text("DROP TABLE " + schema + "." + name))
+
+    print("[OK] - " + str(len(dropped)) + " mrSAT history partitions dropped")
+    logger.debug("[OK] - DROP_OLD_PARTITIONS")
+    return dropped
+
+def main(argv):
+    # Usage: python3 mrsat_history.py config.json [retention]
+    if len(argv) < 2:
+        sys.exit("[ERROR] - Usage: python3 mrsat_history.py <config.json> [retention]")
+
+    config = sql_runner.get_config(argv[1])
+    if not os.path.exists(config["log_path"]):
+        os.makedirs(config["log_path"])
+    logging.basicConfig(filename = config["log_path"] + "/mrsat_history.log",
+                        format = '%(asctime)s %(message)s',
+                        filemode = 'a',
+                        level = logging.DEBUG)
+    logger = logging.getLogger()
+
+    mapstore_engine = sql_runner.create_mapstore_engine(config)
+    schema = config['mapstore']['schema']
+
+    if len(argv) > 2 and argv[2] == "retention":
+        drop_old_partitions(mapstore_engine, schema, config['mrsat'].get('retention_days', 730), logger)
+
+    with mapstore_engine.connect() as con:
+        for name, start, end in get_partitions(con, schema):
+            n_rows, size = con.execute(text("SELECT reltuples::bigint, pg_total_relation_size(oid) FROM pg_class "
+                                            "WHERE oid = to_regclass(:name)"), {"name": schema + "." + name}).one()
+            print(f"{name}: {start:%Y-%m-%d} - {end:%Y-%m-%d}, ~{max(n_rows, 0)} rows, {size / 1024 / 1024:.1f} MB")
+
+if __name__ == "__main__":
+    main(sys.argv)
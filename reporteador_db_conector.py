@@ -2,14 +2,40 @@ import sys
 import os
 import logging
 import json
+import time
 import pandas as pd
-from sqlalchemy import create_engine
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from sqlalchemy import text
 from datetime import datetime
 
 #python file with SP's querys
 import sql_querys as querys
 
+#python file with the shared mapstore bulk loader
+import bulk_loader
+
+#python file with the shared database engines
+import db_engine
+
+#python file with the change detection of the loaded tables
+import fingerprint
+
+#python file with the index declarations of the output layers
+import index_manager
+
+# SP's querys of 'sql_querys.py' and the name of their output table on mapstore
+REPORTEADOR_TABLES = {
+    "areas_psmb": "areas_psmb",
+    "centros_psmb": "centros_psmb",
+    "existencias": "existencias_moluscos",
+    "salmonidos": "existencias_salmonidos",
+    "estaciones": "estaciones",
+    "detalle_caletas": "detalle_caletas"
+}
+
+# Tables of mapstore modified by 'reporteador_preprocessing.sql'
+PREPROCESSED_TABLES = ["existencias_moluscos", "existencias_salmonidos"]
+
 
 def execute_sql_query(mapstore_engine, sql_query, logger):
     """Execute the 'reporteador_preprocessing.sql' query on mapstore database.
@@ -20,7 +46,8 @@ def execute_sql_query(mapstore_engine, sql_query, logger):
     """
 
     try:
-        with mapstore_engine.connect().execution_options(autocommit=True) as con:
+        # The query is committed when the block ends, SQLAlchemy 2.0 connections don't autocommit
+        with mapstore_engine.begin() as con:
             con.execute(sql_query)
         print("[OK] - SQL query successfully executed")
         logger.debug("[OK] - EXECUTE_SQL_QUERY")
@@ -56,7 +83,7 @@ def df_to_bd(config, mapstore_engine, df, table_name, logger):
     """
 
     try:
-        df.to_sql(table_name, mapstore_engine, schema = config['mapstore']['schema'], if_exists = 'replace', index = False)
+        bulk_loader.load_df(df, config, mapstore_engine, table_name, config['mapstore']['schema'], logger)
 
         print("[OK] - " + table_name + " table successfully copied to the DB")
         logger.debug("[OK] - DFS_TO_BD")
@@ -66,98 +93,86 @@ def df_to_bd(config, mapstore_engine, df, table_name, logger):
         logger.error('[ERROR] - ' + table_name + ' DF_TO_BD')
         sys.exit(2)
 
-def tables_to_df(db_engine, query_file, logger):
-    """Read the input SQL querys and execute 'reporteador' database SP's and store them as pandas DFs. 
+def sp_to_df(db_engine, query, sp_name, logger):
+    """Executes a 'reporteador' database SP and stores the result as a pandas DF.
 
     Args:
         db_engine (sqlalchemy.engine.base.Engine): SQL Alchemy connection engine
-        query_file (.py file): Python file with the executable querys 
-    
+        query (str): Executable query of the SP.
+        sp_name (str): Name of the query on the 'sql_querys.py' file.
+
     Returns:
-        pandas Dataframes.
+        pandas Dataframe.
 
     Raises:
         UserWarning: pandas only support SQLAlchemy connectable(engine/connection) ordatabase string URI or sqlite3 DBAPI2 connectionother 
         DBAPI2 objects are not tested, please consider using SQLAlchemy
     """
 
-    df_areas_psmb = pd.read_sql(query_file.areas_psmb, db_engine)
-    df_centros_psmb = pd.read_sql(query_file.centros_psmb, db_engine)
-    df_existencias = pd.read_sql(query_file.existencias, db_engine)
-    df_salmonidos = pd.read_sql(query_file.salmonidos, db_engine)
-    df_estaciones = pd.read_sql(query_file.estaciones, db_engine)
-    df_caletas = pd.read_sql(query_file.detalle_caletas, db_engine)
-
-    print("[OK] - SP's executed and stored successfully")
-    logger.debug("[OK] - TABLES_TO_DF")
-
-    return df_areas_psmb, df_centros_psmb, df_existencias, df_salmonidos, df_estaciones, df_caletas
-
-def create_db_engine(config_data, db_object, db_string, logger):
-    """Creates the SQL Alchemy db engine. 
-
-    Args:
-        config_data (dict): config.json parameters.
-        db_object (str): Name of the DB object specified on the config.json file.
-        db_string (str):  Mapstore database connection string.
-    
-    Returns:
-        sqlalchemy.engine.base.Engine.
-    """
+    start = time.perf_counter()
+    df = pd.read_sql(query, db_engine)
+    elapsed = time.perf_counter() - start
 
-    try:
-        db_type = config_data[db_object]['db_type']
-
-        if db_type == 'postgresql':
-            db_engine = create_engine(db_string)
-            print("[OK] - SQLAlchemy engine successfully created")
-            logger.debug("[OK] - CREATE_DB_ENGINE")
-            return db_engine
-
-        else:
-            conn_args={
-                "TrustServerCertificate": "yes",
-                "Echo": "True",
-                "MARS_Connection": "yes"
-                }
-
-            db_engine = create_engine(db_string, connect_args=conn_args)
-            print("[OK] - SQLAlchemy engine succesfully generated")
-            logger.debug("[OK] - CREATE_DB_ENGINE")
-            return db_engine
+    print(f"[OK] - {sp_name} SP executed in {elapsed:.2f} s")
+    logger.debug(f"[OK] - {sp_name.upper()} SP_TO_DF {elapsed:.2f} S")
+    return df
 
-    except Exception as e:
-        print("[ERROR] - Creating the database connection engine")
-        print(e)
-        logger.error('[ERROR] - CREATE_DB_ENGINE')
-        sys.exit(2)
+def tables_to_bd(config, reporteador_engine, mapstore_engine, query_file, logger, fingerprints = None):
+    """Executes the 'reporteador' database SP's in parallel and copies each result to the mapstore database as soon as it arrives.
 
-def create_db_string(config_data, db_object, logger):
-    """Create database connection string based on the config file parameters.
+    The SP's run on pooled connections of the reporteador engine, with up to the optional
+    'max_workers' of the 'reporteador' config object at once (one per SP by default), while
+    the finished results are written to mapstore by a separate loader pool of
+    'load_workers' threads (2 by default). A result whose fingerprint equals the stored one
+    isn't copied.
 
     Args:
-        config_data (dict): config.json parameters.
-        db_object (str): Name of the DB object specified on the config.json file.
+        config (dict): Dictionary with the config.json file information.
+        reporteador_engine (sqlalchemy.engine.base.Engine): SQL Alchemy reporteador engine.
+        mapstore_engine (sqlalchemy.engine.base.Engine): SQL Alchemy mapstore engine.
+        query_file (.py file): Python file with the executable querys
+        fingerprints (dict): Stored fingerprint of the mapstore tables.
 
     Returns:
-        str
+        dict: table name -> (fingerprint, number of rows) of the copied tables.
     """
 
-    db_string = '{}://{}:{}@{}:{}/{}'.format(
-        config_data[db_object]['db_type'],
-        config_data[db_object]['user'],
-        config_data[db_object]['passwd'], 
-        config_data[db_object]['host'], 
-        config_data[db_object]['port'], 
-        config_data[db_object]['db'])
-
-    # Case if the DB is SQL Server
-    if config_data[db_object]['db_type'] == 'mssql+pyodbc':
-        db_string = db_string + '?driver=ODBC+Driver+17+for+SQL+Server'
-    
-    print("[OK] - Connection string successfully generated")
-    logger.debug("[OK] - CREATE_DB_STRING")
-    return db_string 
+    max_workers = config['reporteador'].get('max_workers', len(REPORTEADOR_TABLES))
+    load_workers = config['reporteador'].get('load_workers', 2)
+    fingerprints = fingerprints or {}
+    changed_tables = {}
+
+    with ThreadPoolExecutor(max_workers = max_workers) as extractor, ThreadPoolExecutor(max_workers = load_workers) as loader:
+        extractions = {extractor.submit(sp_to_df, reporteador_engine, getattr(query_file, sp_name), sp_name, logger): sp_name
+                       for sp_name in REPORTEADOR_TABLES}
+        loads = []
+
+        for extraction in as_completed(extractions):
+            sp_name = extractions[extraction]
+            table_name = REPORTEADOR_TABLES[sp_name]
+            try:
+                df = extraction.result()
+            except Exception as e:
+                print('[ERROR] - Executing ' + sp_name + ' SP')
+                print(e)
+                logger.error('[ERROR] - ' + sp_name + ' SP_TO_DF')
+                sys.exit(2)
+
+            df_fingerprint = fingerprint.df_fingerprint(df)
+            if fingerprints.get(table_name) == df_fingerprint:
+                print("[OK] - " + table_name + " table unchanged, copy skipped")
+                logger.debug("[OK] - " + table_name.upper() + " UNCHANGED")
+                continue
+
+            changed_tables[table_name] = (df_fingerprint, len(df))
+            loads.append(loader.submit(df_to_bd, config, mapstore_engine, df, table_name, logger))
+
+        for load in loads:
+            load.result()
+
+    print("[OK] - SP's executed and stored successfully")
+    logger.debug("[OK] - TABLES_TO_BD")
+    return changed_tables
 
 def create_logger(log_file):
     """Create a logger based on the passed log file.
@@ -260,34 +275,35 @@ def main(argv):
     # Creates the logger
     logger = create_logger(log_file)
 
-    # Connects to 'reporteador' database
-    reporteador_string = create_db_string(config, 'reporteador', logger)
+    # Gets mapstore's database engine, shared by the whole process
+    mapstore_engine = db_engine.get_engine(config, 'mapstore', logger)
+
+    # Gets reporteador's database engine, shared by the whole process
+    reporteador_engine = db_engine.get_engine(config, 'reporteador', logger)
+    
+    # Gets the fingerprint of the tables loaded on previous runs
+    fingerprints = fingerprint.get_fingerprints(mapstore_engine, config['mapstore']['schema'])
 
-    # Connects to 'mapstore' database
-    mapstore_string = create_db_string(config, 'mapstore', logger)
+    # Execute 'reporteador' database SP's in parallel and copy each changed result to the mapstore database as it arrives
+    changed_tables = tables_to_bd(config, reporteador_engine, mapstore_engine, querys, logger, fingerprints)
 
-    # Creates mapstore's database engine
-    mapstore_engine = create_db_engine(config, 'mapstore', mapstore_string, logger)
+    if any(table_name in changed_tables for table_name in PREPROCESSED_TABLES):
+        # Open the 'reporteador_preprocessing.sql' file
+        sql_query = open_sql_query('reporteador_preprocessing.sql', logger)
 
-    # Creates reporteador's database engine
-    reporteador_engine = create_db_engine(config, 'reporteador', reporteador_string, logger)
-    
-    # Execute 'reporteador' database SP's and store them as pandas DFs
-    df_areas_psmb, df_centros_psmb, df_existencias, df_salmonidos, df_estaciones, df_caletas = tables_to_df(reporteador_engine, querys, logger)
-
-    # Pandas DFs to mapstore database
-    df_to_bd(config, mapstore_engine, df_areas_psmb, "areas_psmb", logger)
-    df_to_bd(config, mapstore_engine, df_centros_psmb, "centros_psmb", logger)
-    df_to_bd(config, mapstore_engine, df_existencias, "existencias_moluscos", logger)
-    df_to_bd(config, mapstore_engine, df_salmonidos, "existencias_salmonidos", logger)
-    df_to_bd(config, mapstore_engine, df_estaciones, "estaciones", logger)
-    df_to_bd(config, mapstore_engine, df_caletas, "detalle_caletas", logger)
-
-    # Open the 'reporteador_preprocessing.sql' file
-    sql_query = open_sql_query('reporteador_preprocessing.sql', logger)
-
-    # Execute the SQL to preprocces the input tables
-    execute_sql_query(mapstore_engine, sql_query, logger)
+        # Execute the SQL to preprocces the input tables
+        execute_sql_query(mapstore_engine, sql_query, logger)
+
+    # Index and analyze the copied tables
+    index_manager.provision_indexes(mapstore_engine, config['mapstore']['schema'], list(changed_tables), logger)
+
+    # Stores the fingerprint of the copied tables
+    fingerprint.save_fingerprints(mapstore_engine, config['mapstore']['schema'], changed_tables)
+
+    print("[OK] - " + str(len(REPORTEADOR_TABLES) - len(changed_tables)) + " unchanged tables skipped")
+
+    # Reports the connections opened by each engine
+    db_engine.log_connect_stats(logger)
     
     end = datetime.now()
 
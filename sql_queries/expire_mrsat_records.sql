@@ -0,0 +1,22 @@
+/*
+CONTEXTO:
+- En la sincronización incremental del mrSAT la tabla 'mrsat_60days' ya no se reemplaza completa en cada ejecución.
+
+RESULTADOS ESPERADOS:
+- Eliminar los registros que quedaron fuera de la ventana de días de la tabla (60 días por defecto).
+- Las áreas de los registros eliminados se agregan a 'contingencia_areas_pendientes', para que la contingencia
+incremental las recalcule.
+- La consulta retorna la cantidad de registros eliminados.
+
+*/
+
+WITH expired AS (
+  DELETE FROM entradas.mrsat_60days
+  WHERE "FechaExtraccion" < now() - make_interval(days => :window_days)
+  RETURNING "CodigoArea"
+), pending AS (
+  INSERT INTO entradas.contingencia_areas_pendientes
+  SELECT DISTINCT "CodigoArea"::bigint FROM expired WHERE "CodigoArea" IS NOT NULL
+  ON CONFLICT DO NOTHING
+)
+SELECT COUNT(*) FROM expired
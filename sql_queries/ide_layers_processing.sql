@@ -2,6 +2,12 @@
 -- /* PROCESAMIENTO CAPAS ESPACIALES IDE SUBPESCA */ --
 -------------------------------------------------------
 
+-- El archivo se ejecuta mediante sql_runner.py, cada capa es un paso independiente (ver tables_processing.sql).
+
+-- @step areas_colecta
+-- @inputs entradas.areas_colecta
+-- @outputs capas_estaticas.areas_colecta
+
 -------------------------------
 -- /* 1. Areas de Colecta */ --
 -------------------------------
@@ -69,6 +75,10 @@ WHERE "REP_SUBPESCA2.ADM_UOT.ACUI_SSPA_T_AREACOLECTA.COD_REGION" = 10);
 
 
 
+-- @step ecmpo
+-- @inputs entradas.ecmpo
+-- @outputs capas_estaticas.ecmpo
+
 --------------------
 -- /* 2. ECMPO */ --
 --------------------
@@ -93,6 +103,10 @@ CREATE TABLE capas_estaticas.ecmpo AS
 FROM entradas.ecmpo);
 
 
+-- @step amerb
+-- @inputs entradas.amerb
+-- @outputs capas_estaticas.amerb
+
 --------------------
 -- /* 3. AMERB */ --
 --------------------
@@ -153,6 +167,10 @@ CREATE TABLE capas_estaticas.amerb AS
 		 "REP_SUBPESCA2.ADM_URB.RRBB_SSP_PO_AMERB.OBJECTID" objectid
 FROM entradas.amerb);
 
+-- @step acuiamerb
+-- @inputs entradas.acuiamerb
+-- @outputs capas_estaticas.acuiamerb
+
 -----------------------------------
 -- /* 4. Acuicultura en AMERB */ --
 -----------------------------------
@@ -6,10 +6,12 @@
 -- /* TABLAS REPORTEADOR */ ------
 ----------------------------------
 
--- Se modifican los valores del tonelaje para las tablas de existencias
+-- Se modifican los valores del tonelaje para las tablas de existencias.
+-- Las sentencias se pueden volver a ejecutar sobre una tabla ya procesada (columna float),
+-- ya que sólo se vuelve a cargar la tabla cuyo contenido cambió.
 
-UPDATE entradas.existencias_moluscos SET "Ton" = '0' WHERE "Ton" = '';
+UPDATE entradas.existencias_moluscos SET "Ton" = '0' WHERE "Ton"::text = '';
 ALTER TABLE entradas.existencias_moluscos ALTER COLUMN "Ton" TYPE float USING "Ton"::float;
 
-UPDATE entradas.existencias_salmonidos SET "Toneladas" = '0' WHERE "Toneladas" = '';
+UPDATE entradas.existencias_salmonidos SET "Toneladas" = '0' WHERE "Toneladas"::text = '';
 ALTER TABLE entradas.existencias_salmonidos ALTER COLUMN "Toneladas" TYPE float USING "Toneladas"::float;
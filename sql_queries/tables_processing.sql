@@ -2,10 +2,21 @@
 ---- PROCESAMIENTO INFORMACIÓN ----
 -----------------------------------
 
+/*
+El archivo se ejecuta mediante sql_runner.py. Cada paso comienza con una línea '-- @step <nombre>'
+y declara en '-- @inputs' y '-- @outputs' las tablas que lee y escribe. Un paso se ejecuta apenas
+terminan los pasos que escriben sus entradas, en su propia transacción y conexión, por lo que las
+tablas temporales sólo son visibles dentro del paso que las crea (ON COMMIT DROP).
+*/
+
 ----------------------------------
 -- /* 1. TABLAS REPORTEADOR */ ---
 ----------------------------------
 
+-- @step centros_acuicultura
+-- @inputs entradas.concesiones_acuicultura, entradas.centros_psmb
+-- @outputs capas_estaticas.total_centros, capas_estaticas.centros_acuicultura
+
 -----------------------------------------
 -- /* 1.1 Concesiones Acuicultura */ ----
 -----------------------------------------
@@ -124,6 +135,10 @@ CREATE TABLE capas_estaticas.centros_acuicultura AS (
 		t_grupoespecie = 'ABALONES o EQUINODERMOS'
 );
 
+-- @step centros_psmb
+-- @inputs capas_estaticas.centros_acuicultura
+-- @outputs capas_estaticas.centros_psmb, capas_estaticas.centros_no_psmb
+
 ---------------------------------------
 -- /* 1.2 Centros PSMB y no PSMB*/ ----
 ---------------------------------------
@@ -176,6 +191,10 @@ ALTER TABLE
 DROP 
 	COLUMN psmb;
 
+-- @step areas_psmb
+-- @inputs capas_estaticas.centros_psmb, entradas.areas_psmb
+-- @outputs capas_estaticas.areas_psmb
+
 --------------------------------------------
 -- /* 1.3 Estado Áreas y Bancos PSMB */ ----
 --------------------------------------------
@@ -224,6 +243,10 @@ CREATE TABLE capas_estaticas.areas_psmb AS (
 		areas."Fecha Estado Área"
 );
 
+-- @step bancos_psmb
+-- @inputs entradas.bancos_psmb, entradas.areas_psmb
+-- @outputs capas_estaticas.bancos_psmb
+
 ---------------------------------------
 ---- 1.3.2 Estado en Bancos PSMB ------
 ---------------------------------------
@@ -256,6 +279,10 @@ CREATE TABLE capas_estaticas.bancos_psmb AS (
 		bancos.cd_psmb::int = areas."Código Área"
 );
 
+-- @step centros_tara
+-- @inputs entradas.existencias_moluscos, capas_estaticas.centros_acuicultura
+-- @outputs capas_estaticas.centros_tara
+
 ---------------------------------------
 -- /* 1.4 Existencias Moluscos */ -----
 ---------------------------------------
@@ -278,7 +305,7 @@ SUPUESTOS:
 - Si un centro no registra existencias en los últimos 3 meses se muestra 'Sin Existencia' en el campo 'Exist_3m'
 */
 
-CREATE TEMP TABLE ult_fecha AS (
+CREATE TEMP TABLE ult_fecha ON COMMIT DROP AS (
 	SELECT 
 		"codigoCentro",
     	MAX("periodoInformado") AS fecha
@@ -336,6 +363,10 @@ CREATE TABLE capas_estaticas.centros_tara AS (
 		fechas.codigocentro = centros.codigocentro
 );
 
+-- @step areas_tara
+-- @inputs capas_estaticas.centros_tara, entradas.areas_psmb
+-- @outputs capas_estaticas.areas_tara
+
 ------------------------------------------------
 ------ /* 1.4.2 Existencias en Áreas */ --------
 ------------------------------------------------
@@ -373,6 +404,10 @@ CREATE TABLE capas_estaticas.areas_tara AS (
 	GROUP BY centros.codigoarea, areas."Nombre Área"
 );
 
+-- @step centros_salmonidos
+-- @inputs entradas.concesiones_acuicultura, entradas.existencias_salmonidos
+-- @outputs capas_estaticas.centros_salmonidos
+
 ---------------------------------------
 -- /* 1.5 Existencias Salmónidos */ ---
 ---------------------------------------
@@ -429,6 +464,10 @@ CREATE TABLE capas_estaticas.centros_salmonidos AS (
     )
 );
 
+-- @step ultimo_resultado
+-- @inputs entradas.mrsat_60days, entradas.grupos_toxinas, entradas.limites_toxicologicos, entradas.contingencia_areas_pendientes
+-- @outputs entradas.mrsat_ultimo_resultado, entradas.contingencia_areas_pendientes
+
 -------------------------------------
 ----- /* 2. TABLAS MRSAT */ ---------
 -------------------------------------
@@ -441,114 +480,144 @@ CREATE TABLE capas_estaticas.centros_salmonidos AS (
 CONTEXTO:
 - Para establecer contingencia toxicológica en cada uno de los centros de cultivo es necesario comparar los resultados
 muestreados para cada estación con los límites toxicológicos preestablecidos. 
+- Interesa únicamente el último registro de cada toxina específica (Análisis) para cada estación, por lo que éste se
+mantiene en la tabla persistente 'mrsat_ultimo_resultado'. En cada ejecución se insertan o actualizan sólo los últimos
+registros nuevos o modificados, y se eliminan los de las estaciones que ya no tienen registros en la ventana, sin
+reescribir el resto de la tabla.
 
 RESULTADOS ESPERADOS:
-- Tabla en la cual cada registro representa los distintos análisis realizados en las distintas estaciones.
-- Además, cada registro de cada centro posee el alias de la toxina muestreada y sus respectivos límites toxicológicos.
+- Tabla en la cual cada registro representa el último análisis realizado en cada estación, con su resultado
+normalizado, el alias de la toxina muestreada y sus respectivos límites toxicológicos.
 
 SUPUESTOS:
 - Las tablas 'grupos_toxinas' y 'limites_toxicologicos' se encuentran en el esquema de entradas cómo tablas fijas.
 - Únicamente sirven los resultados con Estado = 'INFORMADO'
+- Con el parámetro 'etl.contingency_mode' = 'incremental' (ver 'contingency_mode' en el README) sólo se recalculan
+las áreas de 'contingencia_areas_pendientes', es decir, las áreas con registros nuevos, modificados o expirados
+desde la ejecución anterior. Los bancos naturales se asocian a su área mediante "CodigoArea", por lo que
+quedan incluidos. En cualquier otro caso se procesa la tabla completa.
+- Si una estación tiene más de un registro del mismo análisis en la última fecha, se mantiene el de mayor resultado.
+- Para cada registro el valor de 'Resultado' es válido únicamente cuando "Signo" = null, en caso contrario:
+  Si "Signo" = '<' ---> "Resultado" = 0
+  Si "Signo" = 'T' AND ("grupo" != 'DTX' AND "grupo" != 'AZA') ---> "Resultado" = 0
+  Si "Signo" = 'T' AND ("grupo" = 'DTX' OR "grupo" = 'AZA') ---> "Resultado" = lim_cont
+- Los identificadores de estación se concatenan en base a si el registro corresponde a un centro o a un banco.
 */
 
-CREATE TEMP TABLE ult_pos AS(
-  SELECT 
-    tox_grup.*, 
-    lim.tipo,
-	-- Alias de la toxina muestreada
-    lim.nm_toxina,
-	-- Límite para que un centro presente valores sub-tóxicos
-    lim.lim_cont,
-	-- Límite para que un centro presente valores tóxicos
-    lim.lim_tox 
-  FROM 
+CREATE TABLE IF NOT EXISTS entradas.contingencia_areas_pendientes (
+  cod_area bigint PRIMARY KEY
+);
+
+CREATE TEMP TABLE ult_res ON COMMIT DROP AS (
+  SELECT
+	-- Se selecciona el último registro de cada análisis en cada estación
+    DISTINCT ON (cod_estacion_analisis, grupo)
+    *
+  FROM
     (
-      SELECT
-		-- Todas las columnas de la tabla del mrSAT.
-        mrsat_60days.*, 
-        grupos.grupo 
+      SELECT 
+        mrsat."FechaExtraccion" AS fechaext, 
+        (CASE WHEN "CodigoCentro" != 0 THEN ("CodigoCentro" || '-' || "EstacionMonitoreo") ELSE ("CodigoBancoNatural" || '-' || "EstacionMonitoreo") END)::varchar(50) AS cod_estacion, 
+        (CASE WHEN "CodigoCentro" != 0 THEN ("CodigoCentro" || '-' || "EstacionMonitoreo" || '-' || grupos.grupo) ELSE ("CodigoBancoNatural" || '-' || "EstacionMonitoreo" || '-' || grupos.grupo) END)::varchar(70) AS cod_estacion_grupo, 
+        (CASE WHEN "CodigoCentro" != 0 THEN ("CodigoCentro" || '-' || "EstacionMonitoreo" || '-' || "DescripcionAnalisis") ELSE ("CodigoBancoNatural" || '-' || "EstacionMonitoreo" || '-' || "DescripcionAnalisis") END)::varchar(100) AS cod_estacion_analisis, 
+        mrsat."EstacionMonitoreo" AS estacion, 
+        grupos.grupo, 
+        mrsat."DescripcionAnalisis" AS analisis, 
+        mrsat."CodigoArea" AS cod_area, 
+        mrsat."DescripcionArea" AS n_area, 
+        mrsat."CodigoCentro" AS cod_centro, 
+        lim.tipo, 
+		-- Alias de la toxina muestreada
+        lim.nm_toxina, 
+		-- Límite para que un centro presente valores sub-tóxicos
+        lim.lim_cont, 
+		-- Límite para que un centro presente valores tóxicos
+        lim.lim_tox, 
+		-- Resultado normalizado según el "Signo"
+        CASE WHEN 
+			-- Condición en caso de que se registren trazas Y DTX o AZA
+			("Signo" = 'T') 
+		AND (
+			grupos.grupo = 'DTX' OR 
+			grupos.grupo = 'AZA') 
+		THEN lim.lim_cont 
+		WHEN 
+			"Signo" = '<'
+			THEN 0
+		WHEN 
+			"Signo" = 'T' 
+		AND (
+			grupos.grupo != 'DTX' AND 
+			grupos.grupo != 'AZA')
+			THEN 0
+		ELSE "Resultado"
+		END AS resultado_toxina 
       FROM 
-        entradas.mrsat_60days 
-        RIGHT JOIN
+        (
+		  -- Modo completo: todos los registros de la ventana
+          SELECT * FROM entradas.mrsat_60days
+          WHERE current_setting('etl.contingency_mode', true) IS DISTINCT FROM 'incremental'
+          UNION ALL
+		  -- Modo incremental: sólo los registros de las áreas pendientes
+          SELECT * FROM entradas.mrsat_60days
+          WHERE current_setting('etl.contingency_mode', true) = 'incremental'
+            AND "CodigoArea" IN (SELECT cod_area FROM entradas.contingencia_areas_pendientes)
+        ) AS mrsat 
+        JOIN
 			-- Tabla que incluye los nombres completos de cada toxina
 			entradas.grupos_toxinas AS grupos 
 		ON 
-			mrsat_60days."DescripcionAnalisis" = grupos.analisis
-    ) AS tox_grup 
-    LEFT JOIN
-		-- Tabla que incluye los limites para establecer contingencia para las distintas toxinas
-		entradas.limites_toxicologicos lim 
-	ON 
-		lim.grupo = tox_grup.grupo 
-  WHERE 
-    "Estado" = 'INFORMADO'
+			mrsat."DescripcionAnalisis" = grupos.analisis
+        LEFT JOIN
+			-- Tabla que incluye los limites para establecer contingencia para las distintas toxinas
+			entradas.limites_toxicologicos lim 
+		ON 
+			lim.grupo = grupos.grupo 
+      WHERE 
+        "Estado" = 'INFORMADO'
+    ) AS tox
+  ORDER BY
+    cod_estacion_analisis,
+    grupo,
+    fechaext DESC,
+    resultado_toxina DESC NULLS LAST
 );
 
-/*
-CONTEXTO:
-- Para cada registro el valor de 'Resultado' es válido únicamente cuando "Signo" = null, en caso contrario, existen excepciones.
-
-RESULTADOS ESPERADOS:
-- La columna de resultado se actualiza de acuerdo a las condiciones señaladas en los supuestos.
-
-SUPUESTOS:
-- Si "Signo" = '<' ---> "Resultado" = 0
-- Si "Signo" = 'T' AND ("grupo" != 'DTX' AND "grupo" != 'AZA') ---> "Resultado" = 0
-- Si "Signo" = 'T' AND ("grupo" = 'DTX' OR "grupo" = 'AZA') ---> "Resultado" = lim_cont
-- Si "Signo" IS NULL ---> "Resultado" = "Resultado"
-*/
-
-UPDATE 
-  ult_pos 
-SET 
-  "Resultado" = CASE WHEN
-  		-- Condición en caso de que se registren trazas Y DTX o AZA
-		("Signo" = 'T') 
-	AND (
-		"grupo" = 'DTX' OR 
-	  	"grupo" = 'AZA') 
-	THEN lim_cont 
-	WHEN 
-		"Signo" = '<'
-		THEN 0
-	WHEN 
-		"Signo" = 'T' 
-	AND (
-		"grupo" != 'DTX' AND 
-		"grupo" != 'AZA')
-		THEN 0
-	ELSE "Resultado"
-	END
-;
-
-/*
-CONTEXTO:
-- Para poder realizar el procesamiento de la información toxicológica es necesario separar la información según
-su estación, grupo de toxina y análisis específico. Este se diferencia en base a sí el registro corresponde a un 
-centro o un banco.
-
-RESULTADOS ESPERADOS:
-- Se le añaden las columnas 'cod_estacion', 'cod_estacion_grupo' y 'cod_estacion_analisis' a la tabla temporal ult_pos
-*/
-
--- Se añaden las columnas vacías
-ALTER TABLE 
-  ult_pos 
-ADD 
-  COLUMN cod_estacion varchar(50), 
-ADD 
-  COLUMN cod_estacion_grupo varchar(70), 
-ADD 
-  COLUMN cod_estacion_analisis varchar(100);
-
--- Se concatenan los distintos id's en base a si el registro corresponde a un centro o a un banco
-UPDATE 
-  ult_pos 
-SET 
-  cod_estacion = (CASE WHEN "CodigoCentro" != 0 THEN ("CodigoCentro" || '-' || "EstacionMonitoreo") ELSE ("CodigoBancoNatural" || '-' || "EstacionMonitoreo") END), 
-  cod_estacion_grupo = (CASE WHEN "CodigoCentro" != 0 THEN ("CodigoCentro" || '-' || "EstacionMonitoreo" || '-' || grupo) ELSE ("CodigoBancoNatural" || '-' || "EstacionMonitoreo" || '-' || grupo) END), 
-  cod_estacion_analisis = (CASE WHEN "CodigoCentro" != 0 THEN ("CodigoCentro" || '-' || "EstacionMonitoreo" || '-' || "DescripcionAnalisis") ELSE ("CodigoBancoNatural" || '-' || "EstacionMonitoreo" || '-' || "DescripcionAnalisis") END);
-
+CREATE TABLE IF NOT EXISTS entradas.mrsat_ultimo_resultado AS SELECT * FROM ult_res WITH NO DATA;
+
+CREATE UNIQUE INDEX IF NOT EXISTS mrsat_ultimo_resultado_key_idx ON entradas.mrsat_ultimo_resultado (cod_estacion_analisis, grupo);
+
+-- Se eliminan las estaciones de las áreas recalculadas que ya no tienen resultados en la ventana
+DELETE FROM entradas.mrsat_ultimo_resultado AS ult
+WHERE (current_setting('etl.contingency_mode', true) IS DISTINCT FROM 'incremental'
+       OR ult.cod_area IN (SELECT cod_area FROM entradas.contingencia_areas_pendientes))
+  AND NOT EXISTS (
+    SELECT 1 FROM ult_res
+    WHERE ult_res.cod_estacion_analisis = ult.cod_estacion_analisis
+      AND ult_res.grupo = ult.grupo);
+
+-- Se insertan los últimos resultados nuevos y se actualizan los que cambiaron. Los que no cambiaron no se reescriben
+INSERT INTO entradas.mrsat_ultimo_resultado 
+SELECT * FROM ult_res
+ON CONFLICT (cod_estacion_analisis, grupo) DO UPDATE
+SET fechaext = EXCLUDED.fechaext,
+    cod_area = EXCLUDED.cod_area,
+    n_area = EXCLUDED.n_area,
+    tipo = EXCLUDED.tipo,
+    nm_toxina = EXCLUDED.nm_toxina,
+    lim_cont = EXCLUDED.lim_cont,
+    lim_tox = EXCLUDED.lim_tox,
+    resultado_toxina = EXCLUDED.resultado_toxina
+WHERE (mrsat_ultimo_resultado.fechaext, mrsat_ultimo_resultado.cod_area, mrsat_ultimo_resultado.n_area,
+       mrsat_ultimo_resultado.tipo, mrsat_ultimo_resultado.nm_toxina, mrsat_ultimo_resultado.lim_cont,
+       mrsat_ultimo_resultado.lim_tox, mrsat_ultimo_resultado.resultado_toxina)
+  IS DISTINCT FROM
+      (EXCLUDED.fechaext, EXCLUDED.cod_area, EXCLUDED.n_area, EXCLUDED.tipo, EXCLUDED.nm_toxina,
+       EXCLUDED.lim_cont, EXCLUDED.lim_tox, EXCLUDED.resultado_toxina);
+
+-- @step toxicologia
+-- @inputs entradas.mrsat_ultimo_resultado, entradas.contingencia_areas_pendientes
+-- @outputs entradas.contingencia_estaciones, entradas.contingencia_causal, entradas.contingencia_areas_pendientes
 
 ------------------------------------------------------------
 -- /* 2.2 Información toxicológica en áreas y bancos PSMB --
@@ -556,55 +625,18 @@ SET
 
 /*
 CONTEXTO:
-- Interesa únicamente el último registro de cada toxina específica (Análisis) para cada estación.
-
-RESULTADOS ESPERADOS: 
-- Tabla que contiene el último registro de cada toxina específica en cada estación, su resultado, nombre de toxina, tipo y limites.
+- El último resultado de cada toxina específica en cada estación se lee desde 'mrsat_ultimo_resultado', únicamente
+para las áreas recalculadas.
 */
 
-CREATE TEMP TABLE ult_tox AS (
+CREATE TEMP TABLE ult_tox ON COMMIT DROP AS (
   SELECT 
-    fech_tox.*, 
-    ult_pos."Resultado" AS resultado_toxina 
+    *
   FROM 
-    (
-      SELECT 
-        MAX("FechaExtraccion") AS fechaext, 
-        cod_estacion, 
-        cod_estacion_grupo, 
-        cod_estacion_analisis, 
-        "EstacionMonitoreo" AS estacion, 
-        grupo, 
-        "DescripcionAnalisis" AS analisis, 
-        "CodigoArea" AS cod_area, 
-        "DescripcionArea" AS n_area, 
-        "CodigoCentro" cod_centro, 
-        tipo, 
-        nm_toxina, 
-        lim_cont, 
-        lim_tox 
-      FROM 
-        ult_pos 
-      GROUP BY 
-        cod_estacion, 
-        cod_estacion_grupo, 
-        cod_estacion_analisis, 
-        "EstacionMonitoreo", 
-        grupo, 
-        "DescripcionAnalisis", 
-        "CodigoArea", 
-        "DescripcionArea", 
-        "CodigoCentro", 
-        tipo, 
-        nm_toxina, 
-        lim_cont, 
-        lim_tox
-    ) AS fech_tox 
-    LEFT JOIN 
-		ult_pos 
-	ON 
-		ult_pos.cod_estacion_analisis = fech_tox.cod_estacion_analisis AND 
-		fech_tox.fechaext = ult_pos."FechaExtraccion"
+    entradas.mrsat_ultimo_resultado
+  WHERE 
+    current_setting('etl.contingency_mode', true) IS DISTINCT FROM 'incremental'
+    OR cod_area IN (SELECT cod_area FROM entradas.contingencia_areas_pendientes)
 );
 
 /*
@@ -619,7 +651,7 @@ RESULTADOS ESPERADOS:
 */
 
 
-CREATE TEMP TABLE tox_est AS (
+CREATE TEMP TABLE tox_est ON COMMIT DROP AS (
   SELECT 
     *, 
     CASE WHEN resultado > lim_tox THEN 3 WHEN (
@@ -692,7 +724,7 @@ SUPUESTOS:
 - Se considera una área en contingencia aquella que alguna de sus estaciones presenta valores tóxicos o subtóxicos para algún grupo muestreado.
 */
 
-CREATE TEMP TABLE causal_area AS (
+CREATE TEMP TABLE causal_area ON COMMIT DROP AS (
   SELECT 
     max_tox.*,
 	-- Caso cuando se presentan resultados tóxicos
@@ -723,7 +755,9 @@ CREATE TEMP TABLE causal_area AS (
         n_accion > 1
       ORDER BY 
         cod_area, 
-        dif_tox DESC
+        dif_tox DESC,
+		-- Ante empates se escoge siempre la misma estación-grupo
+        cod_estacion_grupo
     ) as max_tox
 );
 
@@ -734,7 +768,7 @@ RESULTADOS ESPERADOS:
 
 */
 
-CREATE TEMP TABLE pivot_est AS (
+CREATE TEMP TABLE pivot_est ON COMMIT DROP AS (
   SELECT 
     cod_estacion, 
     estacion, 
@@ -781,6 +815,39 @@ CREATE TEMP TABLE pivot_est AS (
     cod_centro
 );
 
+/*
+CONTEXTO:
+- Los resultados por estación y la causal de cada área se guardan en tablas persistentes, de modo que en el modo
+incremental sólo se reemplazan los registros de las áreas recalculadas.
+
+RESULTADOS ESPERADOS:
+- Tablas 'contingencia_estaciones' y 'contingencia_causal' actualizadas y tabla de áreas pendientes vacía.
+*/
+
+CREATE TABLE IF NOT EXISTS entradas.contingencia_estaciones AS SELECT * FROM pivot_est WITH NO DATA;
+CREATE TABLE IF NOT EXISTS entradas.contingencia_causal AS SELECT * FROM causal_area WITH NO DATA;
+
+DELETE FROM entradas.contingencia_estaciones
+WHERE current_setting('etl.contingency_mode', true) IS DISTINCT FROM 'incremental'
+  OR cod_area IN (SELECT cod_area FROM entradas.contingencia_areas_pendientes);
+
+DELETE FROM entradas.contingencia_causal
+WHERE current_setting('etl.contingency_mode', true) IS DISTINCT FROM 'incremental'
+  OR cod_area IN (SELECT cod_area FROM entradas.contingencia_areas_pendientes);
+
+INSERT INTO entradas.contingencia_estaciones SELECT * FROM pivot_est;
+INSERT INTO entradas.contingencia_causal SELECT * FROM causal_area;
+
+DELETE FROM entradas.contingencia_areas_pendientes;
+
+-- @step contingencia
+-- @inputs entradas.contingencia_estaciones, entradas.contingencia_causal, capas_estaticas.areas_psmb, entradas.bancos_psmb, entradas.concesiones_acuicultura
+-- @outputs capas_estaticas.areas_contingencia, capas_estaticas.bancos_contingencia, capas_estaticas.centro_causal
+
+------------------------------------------------------------
+-- /* 2.3 Capas de contingencia en áreas y bancos PSMB -----
+------------------------------------------------------------
+
 -- Se genera tabla de áreas
 -- Se agrupan los resultados por área, se une la causal a cada área y se espacializan 
 
@@ -818,8 +885,8 @@ CREATE TABLE capas_estaticas.areas_contingencia AS (
         MAX(n_accion) as n_accion, 
         causal.causal 
       FROM 
-        pivot_est as piv 
-        LEFT JOIN causal_area as causal ON piv.cod_area = causal.cod_area 
+        entradas.contingencia_estaciones as piv 
+        LEFT JOIN entradas.contingencia_causal as causal ON piv.cod_area = causal.cod_area 
       GROUP BY 
         piv.cod_area, 
         causal.causal
@@ -862,8 +929,8 @@ CREATE TABLE capas_estaticas.bancos_contingencia AS (
         MAX(n_accion) as n_accion, 
         causal.causal 
       FROM 
-        pivot_est as piv 
-        LEFT JOIN causal_area as causal ON piv.cod_area = causal.cod_area 
+        entradas.contingencia_estaciones as piv 
+        LEFT JOIN entradas.contingencia_causal as causal ON piv.cod_area = causal.cod_area 
       GROUP BY 
         piv.cod_area, 
         causal.causal
@@ -936,19 +1003,9 @@ CREATE TABLE capas_estaticas.centro_causal AS (
     causal.resultado, 
     causal.causal 
   FROM 
-    causal_area AS causal 
+    entradas.contingencia_causal AS causal 
     JOIN entradas.concesiones_acuicultura AS shp ON shp."REP_SUBPESCA2.ADM_UOT.PULLINQUE4_T_ACUICULTURA.N_CODIGOCENTRO" = causal.cod_centro
     WHERE causal.cod_centro != 0
 );
 
--- Se generan índices espaciales para las capas espaciales de salida
-
-CREATE INDEX IF NOT EXISTS geom_id ON capas_estaticas.areas_contingencia USING GIST(geom);
-CREATE INDEX IF NOT EXISTS geom_id ON capas_estaticas.areas_psmb USING GIST(geom);
-CREATE INDEX IF NOT EXISTS geom_id ON capas_estaticas.areas_tara USING GIST(geom);
-CREATE INDEX IF NOT EXISTS geom_id ON capas_estaticas.centros_acuicultura USING GIST(geom);
-CREATE INDEX IF NOT EXISTS geom_id ON capas_estaticas.centros_no_psmb USING GIST(geom);
-CREATE INDEX IF NOT EXISTS geom_id ON capas_estaticas.centros_psmb USING GIST(geom);
-CREATE INDEX IF NOT EXISTS geom_id ON capas_estaticas.centros_tara USING GIST(geom);
-
-
+-- Los índices espaciales y de atributos de las capas de salida se generan mediante index_manager.py
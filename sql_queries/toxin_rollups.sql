@@ -0,0 +1,137 @@
+/*
+CONTEXTO:
+- Para consultar la tendencia de las toxinas en cada área no es necesario volver a agregar los registros del mrSAT,
+sino que se mantienen tablas con agregados diarios y semanales por área, estación-grupo y análisis.
+- Los agregados se actualizan sólo desde los días con registros nuevos: los días desde :lookback_days días antes del
+último día agregado. Con :lookback_days nulo se actualizan todos los días de la ventana de 'mrsat_60days'.
+
+RESULTADOS ESPERADOS:
+- Tabla 'toxinas_diario' con la cantidad de muestras, suma, máximo y cantidad de muestras sobre 'lim_cont' y 'lim_tox'
+de cada día.
+- Tabla 'toxinas_semanal' con los mismos agregados por semana (de lunes a domingo), calculados desde la tabla diaria.
+
+SUPUESTOS:
+- Únicamente sirven los resultados con Estado = 'INFORMADO', con el "Resultado" corregido según el "Signo"
+(ver paso 'ultimo_resultado' de 'tables_processing.sql').
+- Los días anteriores a la ventana de 'mrsat_60days' se mantienen en las tablas y no se actualizan. El primer día
+de la ventana tampoco, ya que puede estar incompleto.
+- El promedio se obtiene como suma / n_muestras, de modo que los agregados se pueden volver a agregar.
+*/
+
+CREATE TABLE IF NOT EXISTS entradas.toxinas_diario (
+  cod_area bigint NOT NULL,
+  dia date NOT NULL,
+  cod_estacion_grupo varchar(70) NOT NULL,
+  analisis varchar(100) NOT NULL,
+  grupo varchar(20),
+  nm_toxina varchar(50),
+  n_muestras integer,
+  suma double precision,
+  maximo double precision,
+  n_sobre_cont integer,
+  n_sobre_tox integer,
+  PRIMARY KEY (cod_area, dia, cod_estacion_grupo, analisis)
+);
+
+CREATE TABLE IF NOT EXISTS entradas.toxinas_semanal (
+  cod_area bigint NOT NULL,
+  semana date NOT NULL,
+  cod_estacion_grupo varchar(70) NOT NULL,
+  analisis varchar(100) NOT NULL,
+  grupo varchar(20),
+  nm_toxina varchar(50),
+  n_muestras integer,
+  suma double precision,
+  maximo double precision,
+  n_sobre_cont integer,
+  n_sobre_tox integer,
+  PRIMARY KEY (cod_area, semana, cod_estacion_grupo, analisis)
+);
+
+-- Primer día que se actualiza
+CREATE TEMP TABLE rollup_desde ON COMMIT DROP AS (
+  SELECT 
+    CASE WHEN agregado.ult_dia IS NULL 
+		THEN ventana.prim_dia 
+	ELSE GREATEST(agregado.ult_dia - CAST(:lookback_days AS integer), ventana.prim_dia + 1) END AS dia 
+  FROM 
+    (SELECT MAX(dia) AS ult_dia FROM entradas.toxinas_diario) AS agregado,
+    (SELECT MIN("FechaExtraccion")::date AS prim_dia FROM entradas.mrsat_60days) AS ventana
+);
+
+DELETE FROM entradas.toxinas_diario 
+WHERE dia >= (SELECT dia FROM rollup_desde);
+
+INSERT INTO entradas.toxinas_diario 
+SELECT 
+  cod_area, 
+  dia, 
+  cod_estacion_grupo, 
+  analisis, 
+  grupo, 
+  nm_toxina, 
+  COUNT(resultado) AS n_muestras, 
+  SUM(resultado) AS suma, 
+  MAX(resultado) AS maximo, 
+  COUNT(*) FILTER (WHERE resultado > lim_cont) AS n_sobre_cont, 
+  COUNT(*) FILTER (WHERE resultado > lim_tox) AS n_sobre_tox 
+FROM 
+  (
+    SELECT 
+      mrsat."CodigoArea"::bigint AS cod_area, 
+      mrsat."FechaExtraccion"::date AS dia, 
+      (CASE WHEN "CodigoCentro" != 0 THEN ("CodigoCentro" || '-' || "EstacionMonitoreo" || '-' || grupos.grupo) ELSE ("CodigoBancoNatural" || '-' || "EstacionMonitoreo" || '-' || grupos.grupo) END) AS cod_estacion_grupo, 
+      mrsat."DescripcionAnalisis" AS analisis, 
+      grupos.grupo, 
+      lim.nm_toxina, 
+      lim.lim_cont, 
+      lim.lim_tox, 
+      CASE WHEN "Signo" = 'T' AND grupos.grupo IN ('DTX', 'AZA') THEN lim.lim_cont 
+		WHEN "Signo" = '<' THEN 0 
+		WHEN "Signo" = 'T' THEN 0 
+		ELSE "Resultado" END AS resultado 
+    FROM 
+      entradas.mrsat_60days AS mrsat 
+      JOIN entradas.grupos_toxinas AS grupos ON mrsat."DescripcionAnalisis" = grupos.analisis 
+      LEFT JOIN entradas.limites_toxicologicos AS lim ON lim.grupo = grupos.grupo 
+    WHERE 
+      "Estado" = 'INFORMADO' 
+      AND mrsat."FechaExtraccion" >= (SELECT dia FROM rollup_desde) 
+      AND mrsat."CodigoArea" IS NOT NULL
+  ) AS muestras 
+WHERE 
+  cod_estacion_grupo IS NOT NULL 
+GROUP BY 
+  cod_area, 
+  dia, 
+  cod_estacion_grupo, 
+  analisis, 
+  grupo, 
+  nm_toxina;
+
+-- Las semanas se vuelven a agregar completas desde la tabla diaria
+DELETE FROM entradas.toxinas_semanal 
+WHERE semana >= (SELECT date_trunc('week', dia)::date FROM rollup_desde);
+
+INSERT INTO entradas.toxinas_semanal 
+SELECT 
+  cod_area, 
+  date_trunc('week', dia)::date AS semana, 
+  cod_estacion_grupo, 
+  analisis, 
+  MAX(grupo) AS grupo, 
+  MAX(nm_toxina) AS nm_toxina, 
+  SUM(n_muestras) AS n_muestras, 
+  SUM(suma) AS suma, 
+  MAX(maximo) AS maximo, 
+  SUM(n_sobre_cont) AS n_sobre_cont, 
+  SUM(n_sobre_tox) AS n_sobre_tox 
+FROM 
+  entradas.toxinas_diario 
+WHERE 
+  dia >= (SELECT date_trunc('week', dia)::date FROM rollup_desde) 
+GROUP BY 
+  cod_area, 
+  date_trunc('week', dia)::date, 
+  cod_estacion_grupo, 
+  analisis
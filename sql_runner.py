@@ -0,0 +1,258 @@
+import sys
+import os
+import re
+import json
+import time
+import logging
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+#python file with the shared database engines
+import db_engine
+
+# Step of a SQL file, delimited by the '-- @step', '-- @inputs' and '-- @outputs' markers
+SqlStep = namedtuple("SqlStep", ["name", "inputs", "outputs", "sql"])
+
+STEP_MARKER = re.compile(r"^--\s*@(step|inputs|outputs)\b[ \t]*(.*)$", re.MULTILINE)
+
+
+def parse_steps(sql_text):
+    """Splits a SQL file into the steps declared by its markers.
+
+    Each step starts at a '-- @step <name>' line and lasts until the next one. Its
+    '-- @inputs' and '-- @outputs' lines list the tables it reads and writes, separated
+    by commas. The text before the first step isn't executed.
+
+    Args:
+        sql_text (str): Content of the SQL file.
+
+    Returns:
+        list: SqlStep of the file, in order.
+
+    Raises:
+        ValueError: a step name is repeated or the file has no steps.
+    """
+
+    step_starts = [marker for marker in STEP_MARKER.finditer(sql_text) if marker.group(1) == "step"]
+    if not step_starts:
+        raise ValueError("The SQL file has no '-- @step' markers")
+
+    steps = []
+    for i, start in enumerate(step_starts):
+        end = step_starts[i + 1].start() if i + 1 < len(step_starts) else len(sql_text)
+        step_text = sql_text[start.start():end]
+        tables = {"inputs": [], "outputs": []}
+
+        for marker in STEP_MARKER.finditer(step_text):
+            if marker.group(1) in tables:
+                tables[marker.group(1)] += [table.strip() for table in marker.group(2).split(",") if table.strip()]
+
+        steps.append(SqlStep(start.group(2).strip(), tables["inputs"], tables["outputs"], step_text))
+
+    names = [step.name for step in steps]
+    if len(set(names)) != len(names):
+        raise ValueError("Repeated step names on the SQL file")
+
+    return steps
+
+def build_dag(steps):
+    """Gets the dependencies of each step: the previous steps that write one of its inputs.
+
+    Args:
+        steps (list): SqlStep of the file, in order.
+
+    Returns:
+        dict: step name -> set of the names of the steps it depends on.
+    """
+
+    dag = {}
+    for i, step in enumerate(steps):
+        dag[step.name] = {previous.name for previous in steps[:i]
+                          if set(previous.outputs) & set(step.inputs)}
+    return dag
+
+def downstream_steps(dag, step_name):
+    """Gets a step and every step that depends on it, directly or not.
+
+    Args:
+        dag (dict): step name -> set of the names of the steps it depends on.
+        step_name (str): Name of the step.
+
+    Returns:
+        set: names of the steps.
+
+    Raises:
+        KeyError: the step doesn't exist.
+    """
+
+    if step_name not in dag:
+        raise KeyError("Unknown step: " + step_name)
+
+    selected = {step_name}
+    for name, dependencies in dag.items():
+        if dependencies & selected:
+            selected.add(name)
+    return selected
+
+def run_step(db_engine, step, logger, settings = None):
+    """Executes a step in its own transaction on a pooled connection.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        step (SqlStep): Step to execute.
+        settings (dict): Optional custom settings (e.g. 'etl.contingency_mode') set for the
+            transaction of the step, readable with current_setting() on its SQL.
+
+    Returns:
+        float: seconds elapsed.
+    """
+
+    start = time.perf_counter()
+    with db_engine.begin() as con:
+        # The step is sent as is through the driver cursor, without bind parameter parsing
+        cursor = con.connection.cursor()
+        for name, value in (settings or {}).items():
+            cursor.execute("SELECT set_config(%s, %s, true)", (name, str(value)))
+        cursor.execute(step.sql)
+        cursor.close()
+    elapsed = time.perf_counter() - start
+
+    print(f"[OK] - {step.name} step executed in {elapsed:.2f} s")
+    logger.debug(f"[OK] - RUN_STEP {step.name.upper()} {elapsed:.2f} S")
+    return elapsed
+
+def run_steps(db_engine, steps, logger, max_workers = 4, selected = None, settings = None):
+    """Executes the steps of a SQL file, running at the same time the steps that don't depend on each other.
+
+    A step starts as soon as every step it depends on has finished. If a step fails no
+    new step is started, the running ones are awaited and the process exits.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        steps (list): SqlStep of the file, in order.
+        max_workers (int): Maximum number of steps running at once.
+        selected (set): Names of the steps to execute, all of them by default.
+        settings (dict): Optional custom settings of the transaction of each step.
+
+    Returns:
+        dict: step name -> seconds elapsed.
+    """
+
+    dag = build_dag(steps)
+    pending = [step for step in steps if selected is None or step.name in selected]
+    pending_names = {step.name for step in pending}
+    durations = {}
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        running = {}
+        failed = False
+
+        while (pending and not failed) or running:
+            if not failed:
+                for step in list(pending):
+                    if not (dag[step.name] & pending_names):
+                        running[executor.submit(run_step, db_engine, step, logger, settings)] = step
+                        pending.remove(step)
+
+            done, _ = wait(running, return_when = FIRST_COMPLETED)
+
+            for future in done:
+                step = running.pop(future)
+                try:
+                    durations[step.name] = future.result()
+                    pending_names.discard(step.name)
+                except Exception as e:
+                    print('[ERROR] - Executing ' + step.name + ' step')
+                    print(e)
+                    logger.error('[ERROR] - RUN_STEPS ' + step.name.upper())
+                    failed = True
+
+    if failed:
+        sys.exit(2)
+
+    print("[OK] - " + str(len(durations)) + " SQL steps successfully executed")
+    logger.debug("[OK] - RUN_STEPS")
+    return durations
+
+def run_sql_file(db_engine, sql_file, logger, max_workers = 4, step_name = None, settings = None):
+    """Executes the steps of a file of the 'sql_queries' folder, optionally only one step and its downstream steps.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        sql_file (str): Name of the .sql file.
+        max_workers (int): Maximum number of steps running at once.
+        step_name (str): Optional step to re-run together with every step that depends on it.
+        settings (dict): Optional custom settings of the transaction of each step.
+
+    Returns:
+        dict: step name -> seconds elapsed.
+    """
+
+    with open("./sql_queries/" + sql_file, encoding = "utf8") as file:
+        steps = parse_steps(file.read())
+
+    selected = None
+    if step_name is not None:
+        selected = downstream_steps(build_dag(steps), step_name)
+
+    return run_steps(db_engine, steps, logger, max_workers, selected, settings)
+
+def create_mapstore_engine(config_data):
+    """Gets the shared mapstore sqlalchemy engine, with a connection pool sized for the parallel steps.
+
+    Args:
+        config_data (dict): config.json parameters.
+
+    Returns:
+        sqlalchemy.engine.base.Engine
+    """
+
+    return db_engine.get_engine(config_data, 'mapstore')
+
+def get_config(filepath=""):
+    """Reads the config.json file.
+
+    Args:
+        filepath (string):  config.json file path.
+
+    Returns:
+        dict.
+    """
+
+    if filepath == "":
+        sys.exit("[ERROR] - Config filepath empty.")
+
+    with open(filepath) as json_file:
+        config_data = json.load(json_file)
+
+    if config_data == {}:
+        sys.exit("[ERROR] - Config file is empty.")
+
+    return config_data
+
+def main(argv):
+    # Usage: python3 sql_runner.py config.json tables_processing.sql [step]
+    if len(argv) < 3:
+        sys.exit("[ERROR] - Usage: python3 sql_runner.py <config.json> <sql file> [step]")
+
+    config = get_config(argv[1])
+    if not os.path.exists(config["log_path"]):
+        os.makedirs(config["log_path"])
+    logging.basicConfig(filename = config["log_path"] + "/sql_runner.log",
+                        format = '%(asctime)s %(message)s',
+                        filemode = 'a',
+                        level = logging.DEBUG)
+    logger = logging.getLogger()
+
+    mapstore_engine = create_mapstore_engine(config)
+    durations = run_sql_file(mapstore_engine,
+                             argv[2],
+                             logger,
+                             config['mapstore'].get('sql_workers', 4),
+                             argv[3] if len(argv) > 3 else None)
+
+    for step_name, elapsed in sorted(durations.items(), key = lambda item: -item[1]):
+        print(f"{step_name}: {elapsed:.2f} s")
+
+if __name__ == "__main__":
+    main(sys.argv)
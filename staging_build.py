@@ -0,0 +1,256 @@
+import sys
+import os
+import re
+import time
+import logging
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+#python file with the dependency-aware runner of the SQL steps
+import sql_runner
+
+#python file with the index declarations of the output layers
+import index_manager
+
+# Schema read by the map server, prefix of the schemas where the layers are built and schema with the replaced layers
+TARGET_SCHEMA = "capas_estaticas"
+STAGING_PREFIX = "capas_estaticas_staging_"
+PREVIOUS_SCHEMA = "capas_estaticas_prev"
+
+TARGET_REFERENCE = re.compile(r"\b" + TARGET_SCHEMA + r"\.")
+
+
+def get_staging_schema(sql_file):
+    """Gets the staging schema of a SQL file, so the builds of different files don't share it.
+
+    Args:
+        sql_file (str): Name of the .sql file.
+
+    Returns:
+        str
+    """
+
+    return STAGING_PREFIX + os.path.splitext(os.path.basename(sql_file))[0]
+
+def to_staging_steps(steps, staging_schema, unlogged = False):
+    """Redirects the steps of a SQL file from the target schema to the staging schema.
+
+    Args:
+        steps (list): sql_runner.SqlStep of the file, in order.
+        staging_schema (str): Schema where the layers are built.
+        unlogged (bool): Create the staging tables as UNLOGGED, without writing WAL.
+
+    Returns:
+        list: rewritten sql_runner.SqlStep.
+    """
+
+    staging_steps = []
+    for step in steps:
+        sql = TARGET_REFERENCE.sub(staging_schema + ".", step.sql)
+        if unlogged:
+            sql = re.sub(r"CREATE\s+TABLE\s+" + staging_schema + r"\.", "CREATE UNLOGGED TABLE " + staging_schema + ".", sql)
+
+        staging_steps.append(step._replace(
+            inputs = [TARGET_REFERENCE.sub(staging_schema + ".", table) for table in step.inputs],
+            outputs = [TARGET_REFERENCE.sub(staging_schema + ".", table) for table in step.outputs],
+            sql = sql))
+
+    return staging_steps
+
+def get_output_tables(steps):
+    """Gets the names of the target schema tables written by the steps of a SQL file.
+
+    Args:
+        steps (list): sql_runner.SqlStep of the file, in order.
+
+    Returns:
+        list: table names, without schema.
+    """
+
+    tables = []
+    for step in steps:
+        for table in step.outputs:
+            schema, _, table_name = table.partition(".")
+            if schema == TARGET_SCHEMA and table_name not in tables:
+                tables.append(table_name)
+    return tables
+
+def prepare_staging_schema(db_engine, staging_schema, logger):
+    """Creates an empty staging schema, removing the leftovers of a failed build.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        staging_schema (str): Schema where the layers are built.
+    """
+
+    with db_engine.begin() as con:
+        con.execute(text("DROP SCHEMA IF EXISTS " + staging_schema + " CASCADE"))
+        con.execute(text("CREATE SCHEMA " + staging_schema))
+        con.execute(text("CREATE SCHEMA IF NOT EXISTS " + PREVIOUS_SCHEMA))
+
+    print("[OK] - Staging schema successfully created")
+    logger.debug("[OK] - PREPARE_STAGING_SCHEMA")
+
+def move_tables(con, tables, from_schema, to_schema):
+    """Moves the tables that exist on a schema to another one.
+
+    Args:
+        con (sqlalchemy.engine.base.Connection): Mapstore DB connection inside a transaction.
+        tables (list): Names of the tables.
+        from_schema (str): Current schema of the tables.
+        to_schema (str): New schema of the tables.
+    """
+
+    for table_name in tables:
+        con.execute(text("ALTER TABLE IF EXISTS " + from_schema + "." + table_name + " SET SCHEMA " + to_schema))
+
+def swap_tables(db_engine, tables, staging_schema, logger, lock_timeout = "5s", retries = 3):
+    """Publishes the staging tables on the target schema in a single transaction.
+
+    The replaced tables are kept on the previous schema for rollback. Their indexes, already built
+    on the staging schema, move with them. Each attempt waits at most 'lock_timeout' for the
+    queries of the map server that are reading the tables.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        tables (list): Names of the tables.
+        staging_schema (str): Schema where the layers were built.
+        lock_timeout (str): Maximum wait for the locks of the tables on each attempt.
+        retries (int): Number of attempts.
+    """
+
+    for attempt in range(1, retries + 1):
+        try:
+            with db_engine.begin() as con:
+                con.execute(text("SET LOCAL lock_timeout = '" + lock_timeout + "'"))
+                for table_name in tables:
+                    con.execute(text("DROP TABLE IF EXISTS " + PREVIOUS_SCHEMA + "." + table_name + " CASCADE"))
+                move_tables(con, tables, TARGET_SCHEMA, PREVIOUS_SCHEMA)
+                move_tables(con, tables, staging_schema, TARGET_SCHEMA)
+            break
+
+        except OperationalError:
+            if attempt == retries:
+                raise
+            print("[OK] - Swap attempt " + str(attempt) + " timed out waiting for locks, retrying")
+            logger.debug("[OK] - SWAP_TABLES RETRY " + str(attempt))
+            time.sleep(attempt)
+
+    print("[OK] - " + str(len(tables)) + " tables successfully swapped into " + TARGET_SCHEMA)
+    logger.debug("[OK] - SWAP_TABLES")
+
+def rollback_tables(db_engine, tables, staging_schema, logger):
+    """Exchanges the published tables with their previous version, in a single transaction.
+
+    Running it twice restores the tables that were published before the first rollback.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        tables (list): Names of the tables.
+        staging_schema (str): Schema used to exchange the tables.
+    """
+
+    with db_engine.begin() as con:
+        con.execute(text("CREATE SCHEMA IF NOT EXISTS " + staging_schema))
+        con.execute(text("CREATE SCHEMA IF NOT EXISTS " + PREVIOUS_SCHEMA))
+        for table_name in tables:
+            con.execute(text("DROP TABLE IF EXISTS " + staging_schema + "." + table_name + " CASCADE"))
+        move_tables(con, tables, TARGET_SCHEMA, staging_schema)
+        move_tables(con, tables, PREVIOUS_SCHEMA, TARGET_SCHEMA)
+        move_tables(con, tables, staging_schema, PREVIOUS_SCHEMA)
+
+    print("[OK] - " + str(len(tables)) + " tables successfully rolled back")
+    logger.debug("[OK] - ROLLBACK_TABLES")
+
+def build_sql_file(db_engine, sql_file, config_data, logger, settings = None):
+    """Builds the layers of a file of the 'sql_queries' folder on the staging schema and swaps them into the target schema.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        sql_file (str): Name of the .sql file.
+        config_data (dict): config.json parameters.
+        settings (dict): Optional custom settings of the transaction of each step.
+
+    Returns:
+        dict: step name -> seconds elapsed.
+    """
+
+    with open("./sql_queries/" + sql_file, encoding = "utf8") as file:
+        steps = sql_runner.parse_steps(file.read())
+
+    tables = get_output_tables(steps)
+    staging_schema = get_staging_schema(sql_file)
+    staging_steps = to_staging_steps(steps, staging_schema, config_data['mapstore'].get('staging_unlogged', False))
+
+    # Builds every layer on an empty staging schema
+    prepare_staging_schema(db_engine, staging_schema, logger)
+    durations = sql_runner.run_steps(db_engine, staging_steps, logger, config_data['mapstore'].get('sql_workers', 4),
+                                     settings = settings)
+
+    # Indexes and statistics are built before the layers are visible to the map server
+    index_manager.provision_indexes(db_engine, staging_schema, tables, logger, declared_schema = TARGET_SCHEMA)
+
+    try:
+        swap_tables(db_engine, tables, staging_schema, logger,
+                    config_data['mapstore'].get('swap_lock_timeout', '5s'),
+                    config_data['mapstore'].get('swap_retries', 3))
+
+    except Exception as e:
+        print('[ERROR] - Swapping the staging tables into ' + TARGET_SCHEMA)
+        print(e)
+        logger.error('[ERROR] - SWAP_TABLES')
+        sys.exit(2)
+
+    return durations
+
+def run_sql_file(db_engine, sql_file, config_data, logger, settings = None):
+    """Executes a file of the 'sql_queries' folder in place or through the staging schema, following the 'build_mode' of the 'mapstore' config object.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        sql_file (str): Name of the .sql file.
+        config_data (dict): config.json parameters.
+        settings (dict): Optional custom settings of the transaction of each step.
+
+    Returns:
+        dict: step name -> seconds elapsed.
+    """
+
+    if config_data['mapstore'].get('build_mode', 'in_place') == 'staging':
+        return build_sql_file(db_engine, sql_file, config_data, logger, settings)
+
+    durations = sql_runner.run_sql_file(db_engine, sql_file, logger, config_data['mapstore'].get('sql_workers', 4),
+                                        settings = settings)
+
+    with open("./sql_queries/" + sql_file, encoding = "utf8") as file:
+        tables = get_output_tables(sql_runner.parse_steps(file.read()))
+    index_manager.provision_indexes(db_engine, TARGET_SCHEMA, tables, logger)
+
+    return durations
+
+def main(argv):
+    # Usage: python3 staging_build.py config.json tables_processing.sql [rollback]
+    if len(argv) < 3:
+        sys.exit("[ERROR] - Usage: python3 staging_build.py <config.json> <sql file> [rollback]")
+
+    config = sql_runner.get_config(argv[1])
+    if not os.path.exists(config["log_path"]):
+        os.makedirs(config["log_path"])
+    logging.basicConfig(filename = config["log_path"] + "/staging_build.log",
+                        format = '%(asctime)s %(message)s',
+                        filemode = 'a',
+                        level = logging.DEBUG)
+    logger = logging.getLogger()
+
+    mapstore_engine = sql_runner.create_mapstore_engine(config)
+
+    if len(argv) > 3 and argv[3] == "rollback":
+        with open("./sql_queries/" + argv[2], encoding = "utf8") as file:
+            tables = get_output_tables(sql_runner.parse_steps(file.read()))
+        rollback_tables(mapstore_engine, tables, get_staging_schema(argv[2]), logger)
+
+    else:
+        build_sql_file(mapstore_engine, argv[2], config, logger)
+
+if __name__ == "__main__":
+    main(sys.argv)
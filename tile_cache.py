@@ -0,0 +1,368 @@
+import sys
+import os
+import gzip
+import math
+import sqlite3
+import logging
+import json
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from sqlalchemy import text
+
+#python file with the dependency-aware runner of the SQL steps
+import sql_runner
+
+#python file with the index declarations of the output layers
+import index_manager
+
+# Layers of 'capas_estaticas' cut into vector tiles, by the SQL file that builds them
+TILE_LAYERS = {
+    "tables_processing.sql": ["areas_contingencia", "bancos_contingencia", "centros_psmb", "centros_salmonidos",
+                              "centros_acuicultura"],
+    "ide_layers_processing.sql": ["areas_colecta", "ecmpo", "amerb", "acuiamerb"]
+}
+
+# Metadata table of the mapstore database with the hash and bounding box of the features of each tiled layer
+STATE_TABLE = "tile_cache_features"
+
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+
+# Half of the side of the web mercator square, in meters
+MERCATOR_HALF = 20037508.342789244
+MAX_LATITUDE = 85.0511287798
+
+
+def lonlat_to_tile(lon, lat, zoom):
+    """Gets the XYZ tile of a WGS84 coordinate.
+
+    Args:
+        lon (float): Longitude.
+        lat (float): Latitude, clamped to the web mercator limits.
+        zoom (int): Zoom level.
+
+    Returns:
+        tuple: (x, y)
+    """
+
+    n = 2 ** zoom
+    lat = math.radians(max(min(lat, MAX_LATITUDE), -MAX_LATITUDE))
+    x = int((lon + 180.0) / 360.0 * n)
+    y = int((1.0 - math.log(math.tan(lat) + 1.0 / math.cos(lat)) / math.pi) / 2.0 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+def tile_bounds(zoom, x, y):
+    """Gets the web mercator bounds of a XYZ tile.
+
+    Args:
+        zoom (int): Zoom level.
+        x (int): Tile column.
+        y (int): Tile row, from the north.
+
+    Returns:
+        tuple: (xmin, ymin, xmax, ymax) in EPSG:3857.
+    """
+
+    size = 2 * MERCATOR_HALF / 2 ** zoom
+    return (-MERCATOR_HALF + x * size, MERCATOR_HALF - (y + 1) * size,
+            -MERCATOR_HALF + (x + 1) * size, MERCATOR_HALF - y * size)
+
+def tiles_for_bounds(bounds, min_zoom, max_zoom):
+    """Gets the tiles that cover a list of WGS84 bounding boxes on every zoom level.
+
+    Args:
+        bounds (list): (xmin, ymin, xmax, ymax) of each feature.
+        min_zoom (int): First zoom level.
+        max_zoom (int): Last zoom level.
+
+    Returns:
+        set: (zoom, x, y) of each tile.
+    """
+
+    tiles = set()
+    for xmin, ymin, xmax, ymax in bounds:
+        for zoom in range(min_zoom, max_zoom + 1):
+            # The tile buffer also draws the features that cross the border of the neighbour tiles
+            x_first, y_first = lonlat_to_tile(xmin, ymax, zoom)
+            x_last, y_last = lonlat_to_tile(xmax, ymin, zoom)
+            for x in range(max(x_first - 1, 0), min(x_last + 1, 2 ** zoom - 1) + 1):
+                for y in range(max(y_first - 1, 0), min(y_last + 1, 2 ** zoom - 1) + 1):
+                    tiles.add((zoom, x, y))
+    return tiles
+
+def create_state_table(con, schema):
+    """Creates the metadata table of the tiled features if it doesn't exist.
+
+    Args:
+        con (sqlalchemy.engine.base.Connection): Mapstore DB connection.
+        schema (str): Schema of the metadata table.
+    """
+
+    con.execute(text("""
+        CREATE TABLE IF NOT EXISTS {schema}.{table} (
+            layer text NOT NULL,
+            feature_hash text NOT NULL,
+            xmin double precision,
+            ymin double precision,
+            xmax double precision,
+            ymax double precision,
+            PRIMARY KEY (layer, feature_hash)
+        )""".format(schema = schema, table = STATE_TABLE)))
+
+def get_changed_bounds(con, schema, layer):
+    """Gets the bounding boxes of the features of a layer added or removed since its last tiling.
+
+    A changed feature has a new hash, so both its previous and its new bounding box are
+    returned. The features of the layer are left on a temporary table until the state is saved.
+
+    Args:
+        con (sqlalchemy.engine.base.Connection): Mapstore DB connection.
+        schema (str): Schema of the metadata table.
+        layer (str): Layer of 'capas_estaticas'.
+
+    Returns:
+        list: (xmin, ymin, xmax, ymax) in WGS84 of each changed feature.
+    """
+
+    con.execute(text("DROP TABLE IF EXISTS tile_layer_features"))
+    con.execute(text("""
+        CREATE TEMP TABLE tile_layer_features AS
+        SELECT DISTINCT ON (feature_hash) feature_hash, ST_XMin(bbox) AS xmin, ST_YMin(bbox) AS ymin,
+               ST_XMax(bbox) AS xmax, ST_YMax(bbox) AS ymax
+        FROM (SELECT md5(layer::text) AS feature_hash, ST_Envelope(ST_Transform(layer.geom, 4326))::box2d AS bbox
+              FROM capas_estaticas.{layer} AS layer
+              WHERE layer.geom IS NOT NULL) AS features""".format(layer = layer)))
+
+    rows = con.execute(text("""
+        SELECT xmin, ymin, xmax, ymax FROM tile_layer_features AS new
+        WHERE NOT EXISTS (SELECT 1 FROM {schema}.{table} AS old
+                          WHERE old.layer = :layer AND old.feature_hash = new.feature_hash)
+        UNION ALL
+        SELECT xmin, ymin, xmax, ymax FROM {schema}.{table} AS old
+        WHERE old.layer = :layer
+          AND NOT EXISTS (SELECT 1 FROM tile_layer_features AS new WHERE new.feature_hash = old.feature_hash)
+        """.format(schema = schema, table = STATE_TABLE)), {"layer": layer})
+
+    return [tuple(row) for row in rows]
+
+def save_layer_state(con, schema, layer):
+    """Replaces the stored features of a layer with the ones of the temporary table of get_changed_bounds.
+
+    Args:
+        con (sqlalchemy.engine.base.Connection): Mapstore DB connection.
+        schema (str): Schema of the metadata table.
+        layer (str): Layer of 'capas_estaticas'.
+    """
+
+    con.execute(text("DELETE FROM {}.{} WHERE layer = :layer".format(schema, STATE_TABLE)), {"layer": layer})
+    con.execute(text("INSERT INTO {}.{} SELECT :layer, feature_hash, xmin, ymin, xmax, ymax "
+                     "FROM tile_layer_features".format(schema, STATE_TABLE)), {"layer": layer})
+    con.execute(text("DROP TABLE tile_layer_features"))
+
+def tile_query(layer, columns):
+    """Gets the query that encodes a tile of a layer with ST_AsMVT, with the given columns as attributes.
+
+    The layers of 'capas_estaticas' are stored on EPSG:4326, so the tile envelope, expanded
+    by the tile buffer, is transformed once and the GiST index of 'geom' can be used.
+
+    Args:
+        layer (str): Layer of 'capas_estaticas'.
+        columns (list): Attribute columns of the layer.
+
+    Returns:
+        sqlalchemy.sql.elements.TextClause
+    """
+
+    attributes = "".join(', layer."' + column.replace('"', '""') + '"' for column in columns)
+
+    return text("""
+        SELECT ST_AsMVT(tile, '{layer}', {extent}, 'geom') FROM (
+            SELECT ST_AsMVTGeom(ST_Transform(layer.geom, 3857), ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, 3857)::box2d,
+                                {extent}, {buffer}, true) AS geom{attributes}
+            FROM capas_estaticas.{layer} AS layer
+            WHERE layer.geom && ST_Transform(ST_Expand(ST_MakeEnvelope(:xmin, :ymin, :xmax, :ymax, 3857), :margin), 4326)
+        ) AS tile WHERE tile.geom IS NOT NULL""".format(
+            layer = layer, extent = TILE_EXTENT, buffer = TILE_BUFFER, attributes = attributes))
+
+def open_mbtiles(mbtiles_path, layer, min_zoom, max_zoom):
+    """Opens the MBTiles file of a layer, creating its tables and metadata if they don't exist.
+
+    Args:
+        mbtiles_path (str): Path of the .mbtiles file.
+        layer (str): Layer of 'capas_estaticas'.
+        min_zoom (int): First zoom level.
+        max_zoom (int): Last zoom level.
+
+    Returns:
+        sqlite3.Connection
+    """
+
+    mbtiles = sqlite3.connect(mbtiles_path)
+    mbtiles.execute("CREATE TABLE IF NOT EXISTS metadata (name text PRIMARY KEY, value text)")
+    mbtiles.execute("CREATE TABLE IF NOT EXISTS tiles (zoom_level integer, tile_column integer, tile_row integer, "
+                    "tile_data blob, PRIMARY KEY (zoom_level, tile_column, tile_row))")
+
+    metadata = {"name": layer, "format": "pbf", "type": "overlay", "minzoom": str(min_zoom), "maxzoom": str(max_zoom),
+                "json": json.dumps({"vector_layers": [{"id": layer, "minzoom": min_zoom, "maxzoom": max_zoom, "fields": {}}]})}
+    mbtiles.executemany("INSERT OR REPLACE INTO metadata (name, value) VALUES (?, ?)", metadata.items())
+    return mbtiles
+
+def update_layer_tiles(config_data, db_engine, layer, logger):
+    """Regenerates the tiles of a layer that cover its added, changed or removed features.
+
+    Empty tiles are deleted from the MBTiles file. Without a previous MBTiles file every
+    tile with features is generated.
+
+    Args:
+        config_data (dict): config.json parameters.
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        layer (str): Layer of 'capas_estaticas'.
+
+    Returns:
+        int: number of regenerated tiles.
+    """
+
+    schema = config_data['mapstore']['schema']
+    tiles_path = config_data['tiles'].get('path', './tiles')
+    min_zoom = config_data['tiles'].get('min_zoom', 4)
+    max_zoom = config_data['tiles'].get('max_zoom', 12)
+    mbtiles_path = os.path.join(tiles_path, layer + ".mbtiles")
+
+    with db_engine.begin() as con:
+        columns = index_manager.get_table_columns(con, 'capas_estaticas', layer)
+        if 'geom' not in columns:
+            return 0
+
+        create_state_table(con, schema)
+        if not os.path.exists(mbtiles_path):
+            con.execute(text("DELETE FROM {}.{} WHERE layer = :layer".format(schema, STATE_TABLE)), {"layer": layer})
+
+        tiles = tiles_for_bounds(get_changed_bounds(con, schema, layer), min_zoom, max_zoom)
+        query = tile_query(layer, sorted(columns - {'geom'}))
+
+        mbtiles = open_mbtiles(mbtiles_path, layer, min_zoom, max_zoom)
+        try:
+            for zoom, x, y in sorted(tiles):
+                xmin, ymin, xmax, ymax = tile_bounds(zoom, x, y)
+                tile_data = con.execute(query, {"xmin": xmin, "ymin": ymin, "xmax": xmax, "ymax": ymax,
+                                                "margin": (xmax - xmin) * TILE_BUFFER / TILE_EXTENT}).scalar()
+                # MBTiles rows are numbered from the south (TMS)
+                key = (zoom, x, 2 ** zoom - 1 - y)
+
+                if tile_data:
+                    mbtiles.execute("INSERT OR REPLACE INTO tiles (zoom_level, tile_column, tile_row, tile_data) "
+                                    "VALUES (?, ?, ?, ?)", key + (gzip.compress(bytes(tile_data)),))
+                else:
+                    mbtiles.execute("DELETE FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", key)
+
+            mbtiles.commit()
+        finally:
+            mbtiles.close()
+
+        # The state is saved on the same transaction, after the tiles are written
+        save_layer_state(con, schema, layer)
+
+    logger.debug("[OK] - UPDATE_LAYER_TILES " + layer.upper() + " " + str(len(tiles)) + " TILES")
+    return len(tiles)
+
+def update_tiles(config_data, db_engine, layers, logger):
+    """Regenerates the changed tiles of the given layers.
+
+    Args:
+        config_data (dict): config.json parameters.
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        layers (list): Layers of 'capas_estaticas'.
+    """
+
+    try:
+        os.makedirs(config_data['tiles'].get('path', './tiles'), exist_ok = True)
+
+        for layer in layers:
+            n_tiles = update_layer_tiles(config_data, db_engine, layer, logger)
+            print("[OK] - " + str(n_tiles) + " tiles of " + layer + " regenerated")
+
+        logger.debug("[OK] - UPDATE_TILES")
+
+    except Exception as e:
+        print(e)
+        print('[ERROR] - Updating vector tiles')
+        logger.error('[ERROR] - UPDATE_TILES')
+        sys.exit(2)
+
+class TileHandler(BaseHTTPRequestHandler):
+    """Serves the tiles of the MBTiles files of a folder on /<layer>/<z>/<x>/<y>.pbf."""
+
+    tiles_path = "./tiles"
+
+    def do_GET(self):
+        parts = self.path.split("?")[0].strip("/").split("/")
+        if len(parts) != 4 or not parts[3].endswith(".pbf") or not all(part.isdigit() for part in parts[1:3] + [parts[3][:-4]]):
+            self.send_error(404)
+            return
+
+        layer, zoom, x, y = parts[0], int(parts[1]), int(parts[2]), int(parts[3][:-4])
+        mbtiles_path = os.path.join(self.tiles_path, os.path.basename(layer) + ".mbtiles")
+        if not os.path.exists(mbtiles_path):
+            self.send_error(404)
+            return
+
+        mbtiles = sqlite3.connect("file:" + mbtiles_path + "?mode=ro", uri = True)
+        try:
+            row = mbtiles.execute("SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                                  (zoom, x, 2 ** zoom - 1 - y)).fetchone()
+        finally:
+            mbtiles.close()
+
+        # Tiles without features are answered empty, so the visor doesn't log them as errors
+        self.send_response(200 if row else 204)
+        self.send_header("Access-Control-Allow-Origin", "*")
+        if row:
+            self.send_header("Content-Type", "application/vnd.mapbox-vector-tile")
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Content-Length", str(len(row[0])))
+            self.send_header("Cache-Control", "public, max-age=300")
+        self.end_headers()
+        if row:
+            self.wfile.write(row[0])
+
+def serve_tiles(tiles_path, port):
+    """Serves the MBTiles files of a folder over HTTP until interrupted.
+
+    Args:
+        tiles_path (str): Folder with the .mbtiles files.
+        port (int): Port of the server.
+    """
+
+    TileHandler.tiles_path = tiles_path
+    server = ThreadingHTTPServer(("", port), TileHandler)
+    print("[OK] - Serving " + tiles_path + " on http://localhost:" + str(port) + "/<layer>/{z}/{x}/{y}.pbf")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+def main(argv):
+    # Usage: python3 tile_cache.py config.json [layer ...] | python3 tile_cache.py config.json serve [port]
+    if len(argv) < 2:
+        sys.exit("[ERROR] - Usage: python3 tile_cache.py <config.json> [layer ...] | <config.json> serve [port]")
+
+    config = sql_runner.get_config(argv[1])
+    config.setdefault('tiles', {})
+
+    if len(argv) > 2 and argv[2] == "serve":
+        serve_tiles(config['tiles'].get('path', './tiles'), int(argv[3]) if len(argv) > 3 else 8090)
+        return
+
+    if not os.path.exists(config["log_path"]):
+        os.makedirs(config["log_path"])
+    logging.basicConfig(filename = config["log_path"] + "/tile_cache.log",
+                        format = '%(asctime)s %(message)s',
+                        filemode = 'a',
+                        level = logging.DEBUG)
+    logger = logging.getLogger()
+
+    mapstore_engine = sql_runner.create_mapstore_engine(config)
+    layers = argv[2:] or [layer for file_layers in TILE_LAYERS.values() for layer in file_layers]
+    update_tiles(config, mapstore_engine, layers, logger)
+
+if __name__ == "__main__":
+    main(sys.argv)
@@ -0,0 +1,110 @@
+import sys
+import os
+import time
+import logging
+from datetime import datetime
+import pandas as pd
+from sqlalchemy import column, select, table
+
+#python file with the dependency-aware runner of the SQL steps
+import sql_runner
+
+# Aggregate tables of 'toxin_rollups.sql' and their period column, by granularity
+ROLLUP_TABLES = {"day": ("toxinas_diario", "dia"),
+                 "week": ("toxinas_semanal", "semana")}
+
+ROLLUP_COLUMNS = ["cod_estacion_grupo", "analisis", "grupo", "nm_toxina", "n_muestras", "suma", "maximo",
+                  "n_sobre_cont", "n_sobre_tox"]
+
+
+def trend_query(cod_area, granularity = "day", analisis = None, first_date = None, last_date = None):
+    """Gets the select of the aggregates of an area, ordered by period.
+
+    The filters match the primary key of the aggregate tables (cod_area, period, ...), so
+    any range of dates is read with an index range scan.
+
+    Args:
+        cod_area (int): Area code.
+        granularity (str): 'day' or 'week'.
+        analisis (str): Only the aggregates of this analysis, all of them by default.
+        first_date (datetime.datetime): First period, included.
+        last_date (datetime.datetime): Last period, included.
+
+    Returns:
+        sqlalchemy.sql.expression.Select
+    """
+
+    table_name, period = ROLLUP_TABLES[granularity]
+    rollup = table(table_name, column("cod_area"), column(period), *[column(name) for name in ROLLUP_COLUMNS],
+                   schema = "entradas")
+
+    query = select(rollup.c[period].label("periodo"), *[rollup.c[name] for name in ROLLUP_COLUMNS]) \
+        .where(rollup.c.cod_area == cod_area) \
+        .order_by(rollup.c[period], rollup.c.cod_estacion_grupo, rollup.c.analisis)
+
+    if analisis is not None:
+        query = query.where(rollup.c.analisis == analisis)
+    if first_date is not None:
+        query = query.where(rollup.c[period] >= first_date)
+    if last_date is not None:
+        query = query.where(rollup.c[period] <= last_date)
+
+    return query
+
+def get_trend(db_engine, cod_area, granularity = "day", analisis = None, first_date = None, last_date = None):
+    """Reads the toxin trend of an area from the aggregate tables, with the mean result of each period.
+
+    Args:
+        db_engine (sqlalchemy.engine.base.Engine): Mapstore DB sqlalchemy engine.
+        cod_area (int): Area code.
+        granularity (str): 'day' or 'week'.
+        analisis (str): Only the aggregates of this analysis, all of them by default.
+        first_date (datetime.datetime): First period, included.
+        last_date (datetime.datetime): Last period, included.
+
+    Returns:
+        pandas.core.frame.DataFrame
+    """
+
+    with db_engine.connect() as con:
+        trend_df = pd.read_sql(trend_query(cod_area, granularity, analisis, first_date, last_date), con)
+
+    trend_df.insert(trend_df.columns.get_loc("suma"), "promedio",
+                    trend_df["suma"] / trend_df["n_muestras"].where(trend_df["n_muestras"] > 0))
+    return trend_df.drop(columns = "suma")
+
+def main(argv):
+    # Usage: python3 toxin_trends.py config.json cod_area [day|week] [analisis] [first_date last_date]
+    if len(argv) < 3:
+        sys.exit("[ERROR] - Usage: python3 toxin_trends.py <config.json> <cod_area> [day|week] [analisis] "
+                 "[YYYY-MM-DD YYYY-MM-DD]")
+
+    config = sql_runner.get_config(argv[1])
+    if not os.path.exists(config["log_path"]):
+        os.makedirs(config["log_path"])
+    logging.basicConfig(filename = config["log_path"] + "/toxin_trends.log",
+                        format = '%(asctime)s %(message)s',
+                        filemode = 'a',
+                        level = logging.DEBUG)
+    logger = logging.getLogger()
+
+    args = argv[3:]
+    granularity = args.pop(0) if args and args[0] in ROLLUP_TABLES else "day"
+    date_args = [arg for arg in args if arg[:4].isdigit() and arg[4:5] == "-"]
+    dates = [datetime.strptime(arg, "%Y-%m-%d") for arg in date_args]
+    analisis = next((arg for arg in args if arg not in date_args), None)
+    first_date, last_date = (dates + [None, None])[:2]
+
+    mapstore_engine = sql_runner.create_mapstore_engine(config)
+
+    start = time.perf_counter()
+    trend_df = get_trend(mapstore_engine, int(argv[2]), granularity, analisis, first_date, last_date)
+    elapsed = time.perf_counter() - start
+
+    with pd.option_context("display.max_rows", None, "display.width", 200):
+        print(trend_df.to_string(index = False))
+    print(f"[OK] - {len(trend_df)} {granularity} aggregates read in {elapsed * 1000:.1f} ms")
+    logger.debug(f"[OK] - GET_TREND {argv[2]} {granularity.upper()} {elapsed * 1000:.1f} MS")
+
+if __name__ == "__main__":
+    main(sys.argv)